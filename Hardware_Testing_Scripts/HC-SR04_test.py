@@ -1,66 +1,34 @@
-# This is a script used to test the HC-SR04 ultrasonic sensor module
+# This is a script used to test the HC-SR04 ultrasonic sensor module with the Ultrasonic class (Ultrasonic_Class from
+# the motor_PID_package)
+# NOTE: the sensor is wired as in main.py (trigger pin 24, echo pin 25). The class reads the sensor in the background
+#       with a timeout, so this script never hangs if no echo comes back (the readings without an echo are counted)
 
-#Libraries
-import RPi.GPIO as GPIO
+# import relevant libraries
 import time
- 
-#GPIO Mode (BOARD / BCM)
-GPIO.setmode(GPIO.BCM)
- 
-#set GPIO Pins
-GPIO_TRIGGER = 23
-GPIO_ECHO = 24
- 
-#set GPIO direction (IN / OUT)
-GPIO.setup(GPIO_TRIGGER, GPIO.OUT)
-GPIO.setup(GPIO_ECHO, GPIO.IN)
-print("Pin Setup Complete")
+import RPi.GPIO as GPIO
+from Ultrasonic_Class import Ultrasonic
 
-# make sure trigger is set to low
-GPIO.output(GPIO_TRIGGER, False)
-print("Waiting for sensor to settle")
-time.sleep(2)
- 
-def distance():
-    # set Trigger to HIGH
-    GPIO.output(GPIO_TRIGGER, True)
- 
-    # set Trigger after 0.01ms to LOW
-    time.sleep(0.00001)
-    GPIO.output(GPIO_TRIGGER, False)
-    print("Trigger Successful")
- 
-    StartTime = time.time()
-    StopTime = time.time()
- 
-    # save StartTime
-    while GPIO.input(GPIO_ECHO) == 0:
-        StartTime = time.time()
+# set GPIO Pins
+GPIO_TRIGGER = 24
+GPIO_ECHO = 25
 
-    print("Start Time Saved")
- 
-    # save time of arrival
-    while GPIO.input(GPIO_ECHO) == 1:
-        StopTime = time.time()
+# readings per second
+RATE = 10
 
-    print("Stop Time Saved")
- 
-    # time difference between start and arrival
-    TimeElapsed = StopTime - StartTime
-    # multiply with the sonic speed (34300 cm/s)
-    # and divide by 2, because there and back
-    distance = (TimeElapsed * 34300) / 2
- 
-    return distance
- 
 if __name__ == '__main__':
+    sensor = Ultrasonic(trigger_pin=GPIO_TRIGGER, echo_pin=GPIO_ECHO, rate=RATE)
+    print("Pin Setup Complete")
     try:
         while True:
-            dist = distance()
-            print ("Measured Distance = %.1f cm" % dist)
             time.sleep(1)
- 
+            if sensor.distance is None:
+                print("No distance measured yet (readings without an echo: %d)" % sensor.timeouts.value)
+            else:
+                print("Measured Distance = %.1f cm (last readings: %s, readings without an echo: %d)" % (sensor.distance,
+                        ', '.join('%.1f' % reading for reading in sensor.readings), sensor.timeouts.value))
+
         # Reset by pressing CTRL + C
     except KeyboardInterrupt:
         print("Measurement stopped by User")
-        GPIO.cleanup()
\ No newline at end of file
+        sensor.stop()
+        GPIO.cleanup()
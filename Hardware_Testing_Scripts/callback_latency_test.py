@@ -0,0 +1,94 @@
+# This script is used to measure the latency of an encoder-style GPIO callback while button callbacks are firing
+# NOTE: this test requires two jumper wires (loopbacks) on the RPi:
+#       ENC_OUT -> ENC_IN (simulates the motor encoder) and BTN_OUT -> BTN_IN (simulates a button being pressed)
+# The test is run twice: once with the button work done inside the GPIO callback (how the buttons used to work),
+# and once with the button work deferred to the CallbackWorker from the motor_PID_package
+
+# import relevant libraries
+import RPi.GPIO as GPIO
+import os
+import tempfile
+import time
+from Callback_Worker_Class import CallbackWorker
+
+# Setup the GPIO mode to BCM
+GPIO.setmode(GPIO.BCM)
+
+# Identify the loopback pins
+ENC_OUT = 24
+ENC_IN = 25
+BTN_OUT = 14
+BTN_IN = 15
+
+# number of encoder edges to time for each mode, and the number of encoder edges between button presses
+NUM_EDGES = 2000
+EDGES_PER_PRESS = 20
+
+# set up the pins
+GPIO.setup(ENC_OUT, GPIO.OUT, initial=GPIO.LOW)
+GPIO.setup(BTN_OUT, GPIO.OUT, initial=GPIO.HIGH)
+GPIO.setup(ENC_IN, GPIO.IN)
+GPIO.setup(BTN_IN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+
+# variables shared with the callbacks
+edge_sent = 0           # time the last encoder edge was driven
+latencies = []          # measured encoder callback latencies (sec)
+
+def button_work(*args):
+    # representative button handling (file creation and printing, like the ExperimentButton)
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    with os.fdopen(fd, 'w') as f:
+        f.write('time_elapsed,desired_speed,actual_speed\n')
+    os.remove(path)
+    print("Button handled")
+
+def encoder_callback(channel):
+    # record the time between driving the edge and this callback running
+    latencies.append(time.perf_counter() - edge_sent)
+
+def run_test(button_callback):
+    # measures the encoder callback latency with the given callback attached to the button
+    global edge_sent
+    latencies.clear()
+
+    GPIO.add_event_detect(ENC_IN, GPIO.BOTH, callback=encoder_callback)
+    GPIO.add_event_detect(BTN_IN, GPIO.FALLING, callback=button_callback)
+
+    enc_state = GPIO.LOW
+    for i in range(NUM_EDGES):
+        # press the button every so often
+        if i % EDGES_PER_PRESS == 0:
+            GPIO.output(BTN_OUT, GPIO.LOW)
+            GPIO.output(BTN_OUT, GPIO.HIGH)
+
+        # toggle the encoder line and give the callback time to run
+        enc_state = not enc_state
+        edge_sent = time.perf_counter()
+        GPIO.output(ENC_OUT, enc_state)
+        time.sleep(0.002)
+
+    GPIO.remove_event_detect(ENC_IN)
+    GPIO.remove_event_detect(BTN_IN)
+
+    # summarise the results
+    results = sorted(latencies)
+    missed = NUM_EDGES - len(results)
+    p50 = results[len(results)//2]*1e6
+    p99 = results[int(len(results)*0.99)]*1e6
+    return p50, p99, results[-1]*1e6, missed
+
+try:
+    callback_worker = CallbackWorker()
+
+    inline = run_test(button_callback=button_work)
+    deferred = run_test(button_callback=callback_worker.deferred(button_work))
+
+    print("\nEncoder callback latency under button activity (us)")
+    print("%-10s %10s %10s %10s %8s" % ("mode", "p50", "p99", "max", "missed"))
+    print("%-10s %10.1f %10.1f %10.1f %8d" % (("inline",) + inline))
+    print("%-10s %10.1f %10.1f %10.1f %8d" % (("worker",) + deferred))
+
+except KeyboardInterrupt:
+    print("\nKeyboard Interrupt")
+finally:
+    GPIO.cleanup()
@@ -0,0 +1,138 @@
+# This script is used to find the maximum edge rate the encoder (Encoder_Class from the motor_PID_package) can count
+# without missing edges, with the per-edge callbacks and with the sampling mode (sample_rate)
+# NOTE: this test requires two jumper wires (loopbacks) on the RPi: A_OUT -> ENCA and B_OUT -> ENCB (the encoder of
+#       the motor must be disconnected). A separate process drives a quadrature signal on A_OUT/B_OUT at each edge
+#       rate for TEST_TIME seconds, and the edges counted by the encoder are compared with the edges driven.
+#       Run with --file to test the sampling mode without hardware: the levels are written to an ordinary file that
+#       the encoder maps instead of /dev/gpiomem (the callbacks cannot be tested this way).
+
+# import relevant libraries
+import multiprocessing
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+import Encoder_Class
+from Encoder_Class import Encoder
+
+# encoder pins (as in main.py) and the loopback pins that drive them
+ENCA = 20
+ENCB = 21
+A_OUT = 5
+B_OUT = 6
+
+# edge rates tested (edges per second, both pins), time each rate is driven for (sec) and the sampling mode tested
+EDGE_RATES = (1000, 2000, 5000, 10000, 15000, 20000, 30000, 50000)
+TEST_TIME = 2
+SAMPLE_RATE = 20000
+BATCH_SIZE = 64
+
+# time before an edge the driver stops sleeping and spins until the edge (sec)
+SPIN_TIME = 0.0002
+
+def drive(gpio_path, edge_rate, done):
+    # drives the quadrature signal forward at edge_rate for TEST_TIME seconds (in its own process so it does not
+    # share the GIL with the encoder), and returns the number of edges driven through done
+    if gpio_path is None:
+        import RPi.GPIO as GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(A_OUT, GPIO.OUT, initial=GPIO.LOW)
+        GPIO.setup(B_OUT, GPIO.OUT, initial=GPIO.LOW)
+        def write(state):
+            GPIO.output(A_OUT, state >> 1)
+            GPIO.output(B_OUT, state & 1)
+    else:
+        f = open(gpio_path, 'r+b')
+        gpio_map = mmap.mmap(f.fileno(), Encoder_Class.GPIO_BLOCK_SIZE)
+        def write(state):
+            struct.pack_into('I', gpio_map, Encoder_Class.GPLEV0_INDEX*4, ((state >> 1) << ENCA) | ((state & 1) << ENCB))
+
+    period = 1/edge_rate
+    edges = 0
+    start_time = time.perf_counter()
+    while time.perf_counter() - start_time < TEST_TIME:
+        edges = edges + 1
+        write(Encoder_Class.QUADRATURE_SEQUENCE[edges % 4])
+        next_time = start_time + edges*period
+
+        # sleep if there is time to (so the driver does not hold a CPU the encoder needs), spin otherwise
+        if next_time - time.perf_counter() > SPIN_TIME:
+            time.sleep(next_time - time.perf_counter() - SPIN_TIME)
+        while time.perf_counter() < next_time:
+            pass
+    done.send(edges)
+
+def drive_to_start(gpio_path):
+    # sets the quadrature signal back to its first state (both pins LOW)
+    if gpio_path is None:
+        import RPi.GPIO as GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(A_OUT, GPIO.OUT, initial=GPIO.LOW)
+        GPIO.setup(B_OUT, GPIO.OUT, initial=GPIO.LOW)
+    else:
+        with open(gpio_path, 'r+b') as f:
+            f.seek(Encoder_Class.GPLEV0_INDEX*4)
+            f.write(struct.pack('I', 0))
+
+def run_mode(name, encoder, gpio_path):
+    # drives each edge rate and prints the edges counted by the encoder, returns the highest rate without errors
+    print("\n%s" % name)
+    sustained = 0
+    for edge_rate in EDGE_RATES:
+        pos_start = encoder.pos_i
+        missed_start = encoder.missed_edges.value
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        driver = context.Process(target=drive, args=(gpio_path, edge_rate, sender))
+        driver.start()
+        edges = receiver.recv()
+        driver.join()
+
+        # wait for the last batch of the sampling mode to be decoded
+        time.sleep(0.1)
+        counted = encoder.pos_i - pos_start
+        missed = encoder.missed_edges.value - missed_start
+        print("%6d edges/s: driven %7d, counted %7d, missed %d" % (edge_rate, edges, counted, missed))
+
+        # start the next rate from the same state of the quadrature signal
+        if edges % 4 != 0:
+            driver = context.Process(target=drive_to_start, args=(gpio_path,))
+            driver.start()
+            driver.join()
+            time.sleep(0.1)
+
+        if counted != edges or missed:
+            break
+        sustained = edge_rate
+    return sustained
+
+# the driver processes are spawned (they do not inherit the GPIO callbacks and the sampling thread)
+context = multiprocessing.get_context('spawn')
+
+if __name__ == '__main__':
+    results = {}
+    if '--file' in sys.argv:
+        # levels of the pins written to an ordinary file
+        fd, gpio_path = tempfile.mkstemp()
+        os.write(fd, bytes(Encoder_Class.GPIO_BLOCK_SIZE))
+        os.close(fd)
+        encoder = Encoder(ENCA=ENCA, ENCB=ENCB, sample_rate=SAMPLE_RATE, batch_size=BATCH_SIZE, gpio_path=gpio_path)
+        results['sampling (%d samples/s, file)' % SAMPLE_RATE] = run_mode('Sampling mode (%d samples/s, file)' % SAMPLE_RATE, encoder, gpio_path)
+        os.remove(gpio_path)
+    else:
+        import RPi.GPIO as GPIO
+        drive_to_start(None)
+
+        encoder = Encoder(ENCA=ENCA, ENCB=ENCB)
+        results['callbacks'] = run_mode('Per-edge callbacks', encoder, None)
+        GPIO.remove_event_detect(ENCA)
+        GPIO.remove_event_detect(ENCB)
+
+        encoder = Encoder(ENCA=ENCA, ENCB=ENCB, sample_rate=SAMPLE_RATE, batch_size=BATCH_SIZE)
+        results['sampling (%d samples/s)' % SAMPLE_RATE] = run_mode('Sampling mode (%d samples/s)' % SAMPLE_RATE, encoder, None)
+        GPIO.cleanup()
+
+    print("\nMaximum edge rate without missed edges (of the rates tested):")
+    for name, sustained in results.items():
+        print("%-32s %6d edges/s" % (name, sustained))
@@ -0,0 +1,203 @@
+# This script is used to measure the cost of refreshing the LCD (LCD_Class from the motor_PID_package) through the
+# digitalio pins of the Adafruit class (before) and through the fast write path of HD44780_Class (after)
+# NOTE: by default this test uses the LCD wired as in main.py. Run with --sim to use a simulated HD44780 instead of
+#       the display (no hardware is needed, but the Adafruit character LCD library must still be installed). The
+#       simulator decodes the pins like the display does, so it also checks that the characters shown are the ones
+#       written and that the datasheet timings were respected.
+#       Each mode is timed for two kinds of refreshes:
+#           live: the live speed lines of the main loop (cursor_position() and message for each row)
+#           full: a queued message printed on a clear screen (printfromLCDThread())
+#           all: a message that changes every character of the display
+
+# import relevant libraries
+import random
+import sys
+import time
+from IO_Loop_Class import IOLoop
+from LCD_Class import LCD
+from HD44780_Class import (HD44780, GPSET0_INDEX, GPCLR0_INDEX, ENABLE_PULSE_NS, ENABLE_CYCLE_NS, EXEC_NS,
+                            LONG_EXEC_NS, LONG_INSTRUCTIONS, ROW_OFFSETS)
+
+# size of the LCD and its pins (BCM form, as in main.py)
+LCD_COLUMNS = 16
+LCD_ROWS = 2
+RS, EN, D4, D5, D6, D7 = 9, 11, 8, 7, 5, 6
+
+# number of refreshes timed for each kind
+NUM_REFRESHES = 200
+
+class SimulatedHD44780(object):
+    # simulated HD44780 in 4-bit mode, driven through digitalio-like pins (before) or the GPIO set/clear
+    # registers (after), that checks the timings of the datasheet
+    def __init__(self):
+        self.levels = {pin: False for pin in (RS, EN, D4, D5, D6, D7)}
+        self.ddram = [0x20]*0x80            # DDRAM (spaces)
+        self.cgram = [0]*64
+        self.address = 0
+        self.in_cgram = False
+        self.high_nibble = None             # first nibble of the byte being written
+        self.enable_ns = 0                  # time of the last rising edge of the enable pin
+        self.ready_ns = 0                   # time the display can take the next byte
+        self.violations = 0                 # number of writes that came before the datasheet allows
+
+    def pin(self, bcm):
+        # digitalio-like pin of the simulator
+        return SimulatedPin(self, bcm)
+
+    def setPin(self, bcm, value):
+        now = time.perf_counter_ns()
+        if bcm == EN and value and not self.levels[EN]:
+            if now - self.enable_ns < ENABLE_CYCLE_NS:
+                self.violations += 1
+            self.enable_ns = now
+        elif bcm == EN and not value and self.levels[EN]:
+            if now - self.enable_ns < ENABLE_PULSE_NS:
+                self.violations += 1
+            self.latch(now)
+        self.levels[bcm] = bool(value)
+
+    def __setitem__(self, index, mask):
+        # writes to the GPIO set/clear registers
+        value = (index == GPSET0_INDEX)
+        if index not in (GPSET0_INDEX, GPCLR0_INDEX):
+            return
+        for bcm in (RS, D4, D5, D6, D7, EN):
+            if mask & (1 << bcm):
+                self.setPin(bcm, value)
+
+    def latch(self, now):
+        # takes a nibble on the falling edge of the enable pin
+        nibble = sum(1 << bit for bit, pin in enumerate((D4, D5, D6, D7)) if self.levels[pin])
+        if self.high_nibble is None:
+            self.high_nibble = nibble
+            return
+        value = (self.high_nibble << 4) | nibble
+        self.high_nibble = None
+        if now < self.ready_ns:
+            self.violations += 1
+        self.execute(value, self.levels[RS])
+        self.ready_ns = now + (LONG_EXEC_NS if not self.levels[RS] and value in LONG_INSTRUCTIONS else EXEC_NS)
+
+    def execute(self, value, char_mode):
+        if char_mode:
+            if self.in_cgram:
+                self.cgram[self.address] = value
+                self.address = (self.address + 1) % 64
+            else:
+                self.ddram[self.address] = value
+                self.address = {0x27: 0x40, 0x67: 0x00}.get(self.address, self.address + 1)
+        elif value & 0x80:
+            self.address = value & 0x7F
+            self.in_cgram = False
+        elif value & 0x40:
+            self.address = value & 0x3F
+            self.in_cgram = True
+        elif value == 0x01:
+            self.ddram = [0x20]*0x80
+            self.address = 0
+            self.in_cgram = False
+        elif value in (0x02, 0x03):
+            self.address = 0
+            self.in_cgram = False
+
+    def lines(self):
+        # characters shown on each row
+        return [''.join(chr(c) for c in self.ddram[ROW_OFFSETS[row]:ROW_OFFSETS[row] + LCD_COLUMNS]) for row in range(LCD_ROWS)]
+
+class SimulatedPin(object):
+    # digitalio.DigitalInOut-like pin of the simulator
+    def __init__(self, simulator, bcm):
+        self.simulator = simulator
+        self.bcm = bcm
+        self.direction = None
+
+    @property
+    def value(self):
+        return self.simulator.levels[self.bcm]
+
+    @value.setter
+    def value(self, value):
+        self.simulator.setPin(self.bcm, value)
+
+def live_refresh(lcd, i):
+    # the live lines of the main loop (see LCD.__printLiveLines()), returns the lines expected on the display
+    lines = ["Des: %.2f m/s" % (0.5 + 0.01*(i % 3)), "Act: %.2f m/s" % random.uniform(0.45, 0.55)]
+    for row in range(LCD_ROWS):
+        lcd.cursor_position(0, row)
+        lcd.message = lines[row]
+    return lines
+
+def full_refresh(lcd, i):
+    # a queued message printed on a clear screen by LCD.printfromLCDThread(), returns the lines expected
+    # NOTE: the coroutine is run in this thread (it does not wait for anything without a duration)
+    msg = "Ramping speed\nto: %.2f m/s" % random.uniform(0.1, 1.5)
+    try:
+        lcd.printfromLCDThread(item=[msg, 0, True, False]).send(None)
+    except StopIteration:
+        pass
+    return [line.ljust(LCD_COLUMNS) for line in msg.split('\n')]
+
+def all_refresh(lcd, i):
+    # a message that changes every cell of the screen (the worst case of the fast write path)
+    lines = [chr(ord('A') + i % 26)*LCD_COLUMNS, chr(ord('a') + i % 26)*LCD_COLUMNS]
+    lcd.message = '\n'.join(lines)
+    return lines
+
+def time_refreshes(lcd, refresh, simulator):
+    # returns the median wall and CPU times of a refresh (sec) and the number of refreshes shown wrong
+    wall_times = []
+    cpu_times = []
+    wrong = 0
+    lcd.clear()
+    for i in range(NUM_REFRESHES):
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        lines = refresh(lcd, i)
+        cpu_times.append(time.thread_time() - cpu_start)
+        wall_times.append(time.perf_counter() - wall_start)
+        if simulator is not None and [line[:len(expected)] for line, expected in zip(simulator.lines(), lines)] != lines:
+            wrong += 1
+    wall_times.sort()
+    cpu_times.sort()
+    return wall_times[len(wall_times)//2], cpu_times[len(cpu_times)//2], wrong
+
+io_loop = IOLoop()
+if '--sim' in sys.argv:
+    simulator = SimulatedHD44780()
+    pins = [simulator.pin(bcm) for bcm in (RS, EN, D4, D5, D6, D7)]
+    registers = simulator
+else:
+    import board
+    import digitalio
+    simulator = None
+    pins = [digitalio.DigitalInOut(getattr(board, 'D%d' % bcm)) for bcm in (RS, EN, D4, D5, D6, D7)]
+    registers = None
+
+# before: the digitalio pins of the Adafruit class
+lcd = LCD(*pins, LCD_COLUMNS, LCD_ROWS, io_loop)
+results = {}
+violations = {}
+if simulator is not None:
+    simulator.violations = 0
+for name, refresh in (('live', live_refresh), ('full', full_refresh), ('all', all_refresh)):
+    results[('before', name)] = time_refreshes(lcd, refresh, simulator)
+if simulator is not None:
+    violations['before'] = simulator.violations
+
+# after: the fast write path (the display has been set up by the Adafruit class, and is cleared so that it
+# matches the copy of the fast write path)
+lcd.hd44780 = HD44780(RS, EN, D4, D5, D6, D7, columns=LCD_COLUMNS, rows=LCD_ROWS, registers=registers)
+lcd.hd44780.write8(0x01)
+if simulator is not None:
+    simulator.violations = 0
+for name, refresh in (('live', live_refresh), ('full', full_refresh), ('all', all_refresh)):
+    results[('after', name)] = time_refreshes(lcd, refresh, simulator)
+if simulator is not None:
+    violations['after'] = simulator.violations
+
+print("%s, median of %d refreshes" % ("Simulated HD44780" if simulator else "LCD", NUM_REFRESHES))
+print("%-8s %-6s %10s %10s %s" % ('path', 'kind', 'wall (ms)', 'CPU (ms)', 'wrong' if simulator else ''))
+for (path, name), (wall_time, cpu_time, wrong) in results.items():
+    print("%-8s %-6s %10.3f %10.3f %s" % (path, name, wall_time*1000, cpu_time*1000, wrong if simulator else ''))
+if simulator is not None:
+    print("Writes earlier than the datasheet timings: before %d, after %d" % (violations['before'], violations['after']))
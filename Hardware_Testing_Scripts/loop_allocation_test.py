@@ -0,0 +1,120 @@
+# This script is used to check that the steady-state iteration of the control loop (maintainMotorVelocity(), logging,
+# the LCD handoff, publishing the sample and the flight recorder) does not allocate any memory that it keeps
+# NOTE: this test requires the treadmill hardware from main.py (the motor is held at 0 m/s with a trial "running" so
+#       that every row is logged). steady_state_iteration() runs the same MainLoopIteration.maintain() as the main loop
+#       of main.py. The allocations are traced with tracemalloc and only the allocations made from
+#       steady_state_iteration() (the control thread) are counted, the I/O loop thread is free to allocate.
+
+# import relevant libraries
+from single_tb9051ftg_rpi import Motor, Motors
+from Encoder_Class import Encoder
+from PID_Controller_Class import MotorPID
+from LCD_Class import LCD
+from Data_Collection_Class import DataLogger
+from Flight_Recorder_Class import FlightRecorder
+from IO_Loop_Class import IOLoop
+from State_Store_Class import StateStore
+from Control_Server_Class import ControlServer
+from Telemetry_Class import TelemetryPublisher
+from Loop_Profiler_Class import LoopProfiler
+from Main_Loop_Class import MainLoopIteration, PROFILE_STAGES
+import Metrics_Class
+import RPi.GPIO as GPIO
+import board
+import digitalio
+import inspect
+import sys
+import time
+import tracemalloc
+
+# number of iterations to warm up (fills the free lists and caches) and to measure
+WARM_UP_ITERATIONS = 50
+TEST_ITERATIONS = 500
+
+# a leak grows with every iteration, but a few blocks can differ between the snapshots without growing (the
+# objects that hold the latest values, and floats reused from the free list are traced where they were first created)
+MAX_NOISE_BLOCKS = 16
+
+# number of frames kept for each traced allocation (enough to reach steady_state_iteration())
+TRACE_DEPTH = 25
+
+# Create the objects used by the steady-state path of main.py
+io_loop = IOLoop()
+lcd = LCD(digitalio.DigitalInOut(board.D9), digitalio.DigitalInOut(board.D11), digitalio.DigitalInOut(board.D8),
+            digitalio.DigitalInOut(board.D7), digitalio.DigitalInOut(board.D5), digitalio.DigitalInOut(board.D6),
+            16, 2, io_loop)
+motor1 = Motor(pwm1_pin=12, pwm2_pin=13, en_pin=19, enb_pin=16, diag_pin=26)
+motors = Motors(motor1)
+encoder = Encoder(ENCA=20, ENCB=21)
+state_store = StateStore()
+data_logger = DataLogger(io_loop=io_loop)
+recorder = FlightRecorder(io_loop=io_loop)
+control_server = ControlServer(io_loop=io_loop, user_input=None, exp_button=None, state_store=state_store,
+                                profiler=LoopProfiler(stage_names=('iteration',)), socket_path='/tmp/treadmill_alloc_test.sock')
+telemetry = TelemetryPublisher(io_loop=io_loop, socket_path='/tmp/treadmill_alloc_test_telemetry.sock')
+loop_time = Metrics_Class.registry.histogram('treadmill_loop_iteration_seconds', 'Time of an iteration of the main loop')
+motor_control = MotorPID(motor=motor1, encoder=encoder, data_logger=data_logger, state_store=state_store)
+main_loop = MainLoopIteration(motor_control=motor_control, lcd=lcd, control_server=control_server, telemetry=telemetry,
+                                recorder=recorder, loop_time=loop_time, profiler=LoopProfiler(stage_names=PROFILE_STAGES),
+                                loop_start_time=time.perf_counter())
+
+def steady_state_iteration():
+    # one iteration of the main loop when the user has not changed the velocity (after the safety checks)
+    state = state_store.snapshot
+    recorder.recordState(state=state)
+    main_loop.maintain(speed_des=state.speed_des_RPM, log_data=True)
+
+# lines of steady_state_iteration() (an allocation made from one of these lines was made by the control loop)
+source, first_line = inspect.getsourcelines(steady_state_iteration)
+ITERATION_LINES = range(first_line, first_line + len(source))
+
+def control_thread_stats(before, after):
+    # differences between two snapshots for the allocations made from steady_state_iteration()
+    stats = after.compare_to(before, 'traceback')
+    return [stat for stat in stats
+                if any(frame.filename == __file__ and frame.lineno in ITERATION_LINES for frame in stat.traceback) and
+                    (stat.size_diff != 0 or stat.count_diff != 0)]
+
+try:
+    data_logger.create_new_file()
+    data_logger.set_start_time()
+
+    # warm up
+    tracemalloc.start(TRACE_DEPTH)
+    for i in range(WARM_UP_ITERATIONS):
+        steady_state_iteration()
+
+    # measure (the I/O loop is given time to handle the wake ups before each snapshot)
+    time.sleep(0.1)
+    before = tracemalloc.take_snapshot()
+    for i in range(TEST_ITERATIONS):
+        steady_state_iteration()
+    time.sleep(0.1)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = control_thread_stats(before, after)
+    net_size = sum(stat.size_diff for stat in stats)
+    net_count = sum(stat.count_diff for stat in stats)
+
+    print("\nNet allocations of the control loop over %d iterations" % TEST_ITERATIONS)
+    print("%d bytes in %d blocks (%.2f bytes/iteration)" % (net_size, net_count, net_size/TEST_ITERATIONS))
+    for stat in sorted(stats, key=lambda stat: -abs(stat.size_diff))[:10]:
+        frame = stat.traceback[-1]
+        print("  %+d bytes, %+d blocks at %s:%d" % (stat.size_diff, stat.count_diff, frame.filename, frame.lineno))
+
+    if net_count > MAX_NOISE_BLOCKS:
+        print("FAIL: the steady-state iteration keeps allocated memory")
+        result = 1
+    else:
+        print("PASS: no net allocations per iteration after warm-up")
+        result = 0
+
+except KeyboardInterrupt:
+    print("\nKeyboard Interrupt")
+    result = 1
+finally:
+    motors.forceStop()
+    GPIO.cleanup()
+
+sys.exit(result)
@@ -0,0 +1,171 @@
+# This script is used to measure how the control loop of several motor channels (Motor_Channels_Class from the
+# motor_PID_package) scales as channels are added
+# NOTE: no hardware is needed. The motor driver, motor and encoder of each channel are replaced by a simulated plant
+#       (a first-order DC motor with static friction, as in stall_detection_test.py, computed when it is read so
+#       that the plants do not need threads of their own). Every channel has its own stall detector and log, and the
+#       channels share the watchdog, as in main.py --channels. The desired speed of channel i is coupled to the desired
+#       speed of the treadmill with a ratio between 1 and 0.5.
+#       For each number of channels in NUM_CHANNELS:
+#           one after the other: a MotorPID for each channel updated one after the other (each measures its own
+#                                encoder for 0.1 s, as the single motor does)
+#           scheduled: one MotorChannels object (every encoder is measured over the same 0.1 s)
+#       The period is the time between two updates of the same channel, the CPU time is that of the control thread
+#       for an update of every channel, and the speed error is the largest error of a channel after the ramp.
+
+# import relevant libraries
+import math
+import time
+import Exceptions
+from PID_Controller_Class import MotorPID
+from State_Store_Class import StateStore
+from Watchdog_Class import Watchdog
+from Motor_Channels_Class import ChannelConfig, MotorGroup, createChannelControl
+
+# numbers of channels tested, desired speed of the treadmill (m/s), time of the ramp and time the speed is held (sec)
+NUM_CHANNELS = (1, 2, 4, 8, 16)
+SPEED = 0.8
+RAMP_TIME = 2
+HOLD_TIME = 5
+
+# number of updates of the channels one after the other
+SERIAL_UPDATES = 3
+
+# simulated plant: speed at full PWM (RPM), time constant (sec), PWM needed to start moving
+GAIN = 300/480
+TAU = 0.2
+BREAKAWAY_PWM = 40
+COUNTS_PER_REV = 9.68*48
+
+class SimulatedPlant(object):
+    # simulated motor driver, motor and encoder of a channel (the attributes used by MotorPID, the stall detector
+    # and the MotorGroup), the motor is moved to the current time whenever it is read or driven
+    def __init__(self):
+        self.u = 0                  # PWM sent to the motor
+        self.speed = 0              # speed of the motor (RPM)
+        self.position = 0.0         # position of the motor (counts)
+        self.edge_time_ns = time.perf_counter_ns()
+        self.update_time = time.perf_counter()
+        self.motor1 = self
+
+    def advance(self):
+        # exact solution of the first-order motor since the last update
+        now = time.perf_counter()
+        dt = now - self.update_time
+        self.update_time = now
+        target = GAIN*self.u
+        if self.speed == 0 and abs(self.u) < BREAKAWAY_PWM:
+            return
+        decay = math.exp(-dt/TAU)
+        revs = (target*dt + (self.speed - target)*TAU*(1 - decay))/60
+        self.speed = target + (self.speed - target)*decay
+        if int(self.position + revs*COUNTS_PER_REV) != int(self.position):
+            self.edge_time_ns = time.perf_counter_ns()
+        self.position = self.position + revs*COUNTS_PER_REV
+
+    # motor driver
+    def setSpeed(self, u):
+        self.advance()
+        self.u = max(-480, min(480, u))
+
+    def getFault(self):
+        return False
+
+    def forceStop(self):
+        self.setSpeed(0)
+
+    # encoder (same measurement and conversion as the Encoder class)
+    @property
+    def pos_i(self):
+        self.advance()
+        return int(self.position)
+
+    def countsToRPM(self, counts, deltaT):
+        return counts/deltaT/COUNTS_PER_REV*60.0
+
+    def calcMotorVelocity(self):
+        time_start = time.perf_counter()
+        pos_start = self.pos_i
+        time.sleep(0.1)
+        pos_stop = self.pos_i
+        return self.countsToRPM(pos_stop - pos_start, time.perf_counter() - time_start)
+
+class RowCounter(object):
+    # stands in for the DataLogger of a channel (counts the rows of its log)
+    def __init__(self):
+        self.rows = 0
+
+    def det_elasped_time(self):
+        return 0
+
+    def save_data(self, *args):
+        self.rows = self.rows + 1
+
+def trial_state():
+    # a running trial (the rows of every channel are logged)
+    state_store = StateStore()
+    state_store.update(program_started=True, trial_started=True)
+    return state_store
+
+def run_serial(num_channels):
+    # updates a MotorPID for each channel one after the other, returns the period of a channel (sec)
+    plants = [SimulatedPlant() for i in range(num_channels)]
+    state_store = trial_state()
+    controllers = [MotorPID(motor=plant, encoder=plant, data_logger=RowCounter(), state_store=state_store)
+                    for plant in plants]
+    speed_des = controllers[0].MPSToRPM(SPEED)
+    start_time = time.perf_counter()
+    for update in range(SERIAL_UPDATES):
+        for i in range(num_channels):
+            controllers[i].maintainMotorVelocity(speed_des=speed_des*(1 - 0.5*i/num_channels), log_data=True)
+    return (time.perf_counter() - start_time)/SERIAL_UPDATES
+
+def run_scheduled(num_channels):
+    # runs the channels from one MotorChannels object, returns the periods and CPU times of the updates (sec),
+    # the largest relative speed error of a channel at the end and the rows logged by each channel
+    channels = [ChannelConfig(name='belt%d' % i, motor_pins=None, encoder_pins=None, gains=None,
+                                ratio=1 - 0.5*i/num_channels, speed_mps=None) for i in range(num_channels)]
+    plants = [SimulatedPlant() for i in range(num_channels)]
+    motors = MotorGroup(plants)
+    loggers = [RowCounter() for i in range(num_channels)]
+    state_store = trial_state()
+    watchdog = Watchdog(motors=motors, deadline=0.5)
+    motor_control, stall_detector = createChannelControl(channels=channels, motor_list=plants, motors=motors,
+                                                            encoders=plants, data_loggers=loggers,
+                                                            state_store=state_store, gains=(0.1, 0, 0),
+                                                            watchdog=watchdog, stall_time=0.25)
+    watchdog.arm()
+    stall_detector.arm()
+
+    speed_des = motor_control.MPSToRPM(SPEED)
+    periods = []
+    cpu_times = []
+    try:
+        motor_control.changeMotorVelocity(ramp_time=RAMP_TIME, speed_des=speed_des)
+        start_time = time.perf_counter()
+        last_time = start_time
+        while last_time - start_time < HOLD_TIME:
+            cpu_start = time.thread_time()
+            motor_control.maintainMotorVelocity(speed_des=speed_des, log_data=True)
+            cpu_times.append(time.thread_time() - cpu_start)
+            now = time.perf_counter()
+            periods.append(now - last_time)
+            last_time = now
+    except (Exceptions.WatchdogFault, Exceptions.StallFault) as e:
+        print("%d channels: stopped by %s" % (num_channels, type(e).__name__))
+    finally:
+        watchdog.disarm()
+        stall_detector.disarm()
+        motors.forceStop()
+
+    errors = [abs(motor_control.speeds[i] - motor_control.channelSpeed(i, speed_des))/motor_control.channelSpeed(i, speed_des)
+                for i in range(num_channels)]
+    return periods, cpu_times, max(errors), [logger.rows for logger in loggers]
+
+print("%-9s %-22s %-24s %-16s %-12s %s" % ('channels', 'one after the other', 'scheduled period (ms)', 'CPU per update', 'speed error', 'rows logged'))
+print("%-9s %-22s %-24s %-16s %-12s %s" % ('', 'period (ms)', 'mean / max', '(ms)', '(max %)', 'per channel'))
+for num_channels in NUM_CHANNELS:
+    serial_period = run_serial(num_channels)
+    periods, cpu_times, error, rows = run_scheduled(num_channels)
+    print("%-9d %-22.0f %-24s %-16.3f %-12.1f %s" % (num_channels, serial_period*1000,
+            '%.1f / %.1f' % (sum(periods)/len(periods)*1000, max(periods)*1000), sum(cpu_times)/len(cpu_times)*1000,
+            error*100, '%d-%d' % (min(rows), max(rows))))
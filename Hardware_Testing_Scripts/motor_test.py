@@ -3,6 +3,8 @@
 # import required modules
 from single_tb9051ftg_rpi import Motor, Motors, MAX_SPEED
 from User_Input_Class import UserInput
+from IO_Loop_Class import IOLoop
+from State_Store_Class import StateStore
 import Exceptions
 
 # Create the Motor and Motors objects
@@ -10,7 +12,7 @@ motor1 = Motor(pwm1_pin=12, pwm2_pin=13, en_pin=19, enb_pin=16, diag_pin=26)
 motors = Motors(motor1)
 
 # Creat UserInput object to allow the user to change the PWM values
-user_input = UserInput(input_mode='PWM')
+user_input = UserInput(input_mode='PWM', io_loop=IOLoop(), state_store=StateStore())
 
 # main function to test
 def main():
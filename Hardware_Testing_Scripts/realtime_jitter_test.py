@@ -0,0 +1,87 @@
+# This script is used to compare the timing jitter of a periodic control loop with and without the real-time mode
+# (python main.py --realtime) from the motor_PID_package
+# NOTE: no hardware is needed, but the script should be run on the RPi (as root, or with the limits from
+#       treadmill.service) for SCHED_FIFO and mlockall() to be allowed. Each iteration of the loop creates some
+#       cyclic garbage (so the garbage collector runs), and a background thread allocates and works like the
+#       I/O loop does. The loop is run first as usual and then in the real-time mode (as if a trial was running).
+
+# import relevant libraries
+import gc
+import threading
+import time
+from Realtime_Class import RealtimeMode
+
+# period of the loop (sec) and the number of iterations for each mode
+PERIOD = 0.005
+NUM_ITERATIONS = 4000
+
+# the real-time mode has to be created before the background thread is started
+realtime = RealtimeMode(enabled=True)
+
+# number of collections done by the garbage collector (counted with a gc callback)
+collections = 0
+
+def count_collections(phase, info):
+    # called by the garbage collector at the start and end of each collection
+    global collections
+    if phase == 'start':
+        collections += 1
+
+def background_work():
+    # representative work of the other threads (formatting, building lists and dictionaries)
+    while True:
+        rows = [{'time': i*0.1, 'msg': "Des: %.2f m/s" % (i*0.01)} for i in range(200)]
+        del rows
+        time.sleep(0.001)
+
+def control_work(i):
+    # representative work of an iteration of the control loop that leaves some cyclic garbage behind
+    sample = {'time': i*PERIOD, 'speed': i*0.01}
+    sample['self'] = sample
+    return sum(range(50))
+
+def run_loop():
+    # runs the periodic loop and returns the lateness of each wake up (sec) and the number of collections
+    global collections
+    collections = 0
+    lateness = []
+
+    next_time = time.perf_counter() + PERIOD
+    for i in range(NUM_ITERATIONS):
+        # sleep until the start of the next period
+        delay = next_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        lateness.append(time.perf_counter() - next_time)
+        next_time = next_time + PERIOD
+
+        control_work(i)
+
+    return lateness, collections
+
+def summary(name, lateness, num_collections):
+    # creates a line of the results table (times in microseconds)
+    results = sorted(lateness)
+    p50 = results[len(results)//2]*1e6
+    p99 = results[int(len(results)*0.99)]*1e6
+    return "%-10s %10.1f %10.1f %10.1f %12d" % (name, p50, p99, results[-1]*1e6, num_collections)
+
+gc.callbacks.append(count_collections)
+threading.Thread(target=background_work, daemon=True).start()
+
+# run the loop as usual
+normal = run_loop()
+
+# run the loop in the real-time mode (the same steps main.py takes once the startup is complete)
+memory_locked = realtime.lockMemory()
+realtime.freezeStartup()
+sched_fifo = realtime.setupControlThread()
+realtime.trialChanged(in_trial=True)
+rt = run_loop()
+realtime.trialChanged(in_trial=False)
+
+print("\nWake up lateness of a %.1f ms loop over %d iterations (us)" % (PERIOD*1000, NUM_ITERATIONS))
+print("memory locked: %s, SCHED_FIFO: %s" % (memory_locked, sched_fifo))
+print("%-10s %10s %10s %10s %12s" % ("mode", "p50", "p99", "max", "collections"))
+print(summary("normal", *normal))
+print(summary("realtime", *rt))
@@ -0,0 +1,171 @@
+# This script is used to measure how quickly the stall detector (Stall_Detector_Class from the motor_PID_package)
+# cuts a jammed motor, and how often it declares a stall when nothing is wrong (false positives)
+# NOTE: no hardware is needed. The motor, motor driver and encoder are replaced by a simulated plant (a first-order
+#       DC motor with static friction and a varying load, that produces encoder edges like the real encoder) and the
+#       MotorPID object runs against it as it does in main.py:
+#           normal runs: ramp up from rest, hold the speed under a changing load, change speed, ramp back down
+#           jams: ramp up, hold the speed and jam the belt (the motor stops dead) at a random time (the speeds of
+#                 the jams are spread over the whole range, so the slowest jam is at MIN_SPEED)
+#       The detection latency is the time from the jam to the motor being cut. The test passes if there are no false
+#       positives and every jam is cut within the stall time (plus LATENCY_MARGIN).
+
+# import relevant libraries
+import random
+import sys
+import threading
+import time
+import Exceptions
+from PID_Controller_Class import MotorPID
+from State_Store_Class import StateStore
+from Stall_Detector_Class import StallDetector
+
+# stall time of the detector (sec), and the time a jam may take to be cut on top of it (two checks of the encoder
+# edges by the detector thread)
+STALL_TIME = 0.25
+LATENCY_MARGIN = 2*STALL_TIME/10
+
+# number of normal runs and jams
+NUM_RUNS = 10
+NUM_JAMS = 10
+
+# range of the speeds of the runs (m/s) and the time the speed is held for (sec)
+MIN_SPEED = 0.1
+MAX_SPEED = 1.2
+HOLD_TIME = 3
+
+# simulated plant: speed at full PWM (RPM), time constant (sec), PWM needed to start moving, load (RPM lost)
+GAIN = 300/480
+TAU = 0.2
+BREAKAWAY_PWM = 40
+MAX_LOAD = 20
+COUNTS_PER_REV = 9.68*48
+PLANT_STEP = 0.001
+
+class SimulatedPlant(object):
+    # simulated motor, motor driver and encoder (the attributes used by MotorPID and the stall detector)
+    def __init__(self):
+        self.u = 0                  # PWM sent to the motor
+        self.speed = 0              # speed of the motor (RPM)
+        self.position = 0.0         # position of the motor (counts)
+        self.pos_i = 0              # encoder count
+        self.edge_time_ns = 0       # time of the last encoder edge
+        self.load = 0               # load on the motor (RPM lost)
+        self.jammed = False         # whether the belt is jammed
+        self.jam_time = None        # time the belt was jammed
+        self.stop_time = None       # time the motor was cut
+        self.running = True         # whether the plant is simulated
+        self.motor1 = self
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while self.running:
+            if self.jammed or (self.speed == 0 and abs(self.u) < BREAKAWAY_PWM):
+                self.speed = 0
+            else:
+                self.speed = self.speed + (GAIN*self.u - self.load - self.speed)*PLANT_STEP/TAU
+            self.position = self.position + self.speed/60*COUNTS_PER_REV*PLANT_STEP
+            if int(self.position) != self.pos_i:
+                self.pos_i = int(self.position)
+                self.edge_time_ns = time.perf_counter_ns()
+            time.sleep(PLANT_STEP)
+
+    def jam(self):
+        self.jam_time = time.perf_counter()
+        self.jammed = True
+
+    # motor driver
+    def setSpeed(self, u):
+        self.u = max(-480, min(480, u))
+
+    def getFault(self):
+        return False
+
+    def forceStop(self):
+        self.u = 0
+        if self.stop_time is None:
+            self.stop_time = time.perf_counter()
+
+    # encoder (same measurement as the Encoder class)
+    def calcMotorVelocity(self):
+        time_start = time.perf_counter()
+        pos_start = self.pos_i
+        time.sleep(0.1)
+        pos_stop = self.pos_i
+        return (pos_stop - pos_start)/(time.perf_counter() - time_start)/COUNTS_PER_REV*60.0
+
+class NoLogging(object):
+    # stands in for the DataLogger (no trial is running)
+    def det_elasped_time(self):
+        return 0
+
+    def save_data(self, *args):
+        pass
+
+def hold(motor_control, speed_des, hold_time, jam_time=None):
+    # holds the speed for hold_time seconds (jams the belt after jam_time seconds)
+    plant = motor_control.motor
+    start_time = time.perf_counter()
+    while time.perf_counter() - start_time < hold_time:
+        if jam_time is not None and not plant.jammed and time.perf_counter() - start_time >= jam_time:
+            plant.jam()
+        plant.load = random.uniform(0, MAX_LOAD)
+        motor_control.maintainMotorVelocity(speed_des=speed_des, log_data=False)
+
+def new_run():
+    # creates a stopped plant with a new controller and an armed stall detector
+    plant = SimulatedPlant()
+    detector = StallDetector(motors=plant, encoder=plant, stall_time=STALL_TIME)
+    motor_control = MotorPID(motor=plant, encoder=plant, data_logger=NoLogging(), state_store=StateStore(),
+                                stall_detector=detector)
+    detector.arm()
+    return plant, motor_control
+
+# normal runs (any stall is a false positive)
+false_positives = 0
+run_time = 0
+for i in range(NUM_RUNS):
+    plant, motor_control = new_run()
+    start_time = time.perf_counter()
+    try:
+        for mps in (random.uniform(MIN_SPEED, MAX_SPEED), random.uniform(MIN_SPEED, MAX_SPEED)):
+            speed_des = motor_control.MPSToRPM(mps)
+            motor_control.changeMotorVelocity(ramp_time=5, speed_des=speed_des)
+            hold(motor_control, speed_des, HOLD_TIME)
+        motor_control.changeMotorVelocity(ramp_time=2, speed_des=0)
+        result = "ok"
+    except Exceptions.StallFault as s:
+        false_positives += 1
+        result = "stall declared (control signal %.0f)" % s.control_sig
+    run_time += time.perf_counter() - start_time
+    plant.running = False
+    print("run %d: %s" % (i + 1, result))
+
+# jams (the latency is the time from the jam to the motor being cut)
+latencies = []
+for i in range(NUM_JAMS):
+    plant, motor_control = new_run()
+    mps = MIN_SPEED + (MAX_SPEED - MIN_SPEED)*i/(NUM_JAMS - 1)
+    speed_des = motor_control.MPSToRPM(mps)
+    try:
+        motor_control.changeMotorVelocity(ramp_time=5, speed_des=speed_des)
+        hold(motor_control, speed_des, hold_time=30, jam_time=random.uniform(0.5, 2))
+        print("jam %d at %.2f m/s: not detected" % (i + 1, mps))
+    except Exceptions.StallFault as s:
+        latency = plant.stop_time - plant.jam_time
+        latencies.append(latency)
+        print("jam %d at %.2f m/s: motor cut after %.0f ms (control signal %.0f)" % (i + 1, mps, latency*1000, s.control_sig))
+    plant.running = False
+
+latencies.sort()
+print("\nStall time of the detector: %.0f ms" % (STALL_TIME*1000))
+print("False positives: %d in %d normal runs (%.0f sec of operation)" % (false_positives, NUM_RUNS, run_time))
+if latencies:
+    print("Detection latency over %d of %d jams (ms): p50 %.0f, max %.0f" % (len(latencies), NUM_JAMS,
+            latencies[len(latencies)//2]*1000, latencies[-1]*1000))
+else:
+    print("No jam was detected")
+
+if false_positives > 0 or len(latencies) < NUM_JAMS or latencies[-1] > STALL_TIME + LATENCY_MARGIN:
+    print("FAIL: a stall was declared in a normal run, or a jam was not cut within %.0f ms" % ((STALL_TIME + LATENCY_MARGIN)*1000))
+    sys.exit(1)
+print("PASS: every jam was cut within %.0f ms without false positives" % ((STALL_TIME + LATENCY_MARGIN)*1000))
@@ -0,0 +1,62 @@
+# This script is used to measure how long the treadmill takes to be ready after it has been started (the boot-to-ready
+# time after the Pi has been power cycled is this plus the boot of the Pi itself)
+# NOTE: this test requires the treadmill hardware, and the treadmill service has to be stopped first
+#       (sudo systemctl stop treadmill). main.py is run with --startup-benchmark, which prints the time of each phase
+#       of the startup and exits once the treadmill is ready:
+#           imports: loading the modules of main.py (the device libraries are imported later, in parallel)
+#           devices: creating the LCD, hardware, knob, buttons and servers (the devices in parallel)
+#           ready: waiting for the servers to listen and the control process to set up its hardware (--isolated)
+#       The time from starting the interpreter to the first output of main.py is also measured. Any extra arguments
+#       are passed to main.py (i.e. python startup_benchmark.py --isolated).
+
+# import relevant libraries
+import os
+import re
+import subprocess
+import sys
+import time
+
+# number of times main.py is started
+NUM_RUNS = 5
+
+# path of main.py
+MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'motor_PID_package', 'main.py')
+
+# phases of the startup printed by main.py (i.e. "Startup: imports 412 ms, devices 230 ms, ready 15 ms (...)")
+PHASE_PATTERN = re.compile(r'(\w+) (\d+) ms')
+
+def run_once(extra_args):
+    # starts main.py once, and returns the time from starting the interpreter to the startup line, and the phases
+    start_time = time.perf_counter()
+    process = subprocess.Popen([sys.executable, MAIN_PATH, '--startup-benchmark'] + extra_args, stdout=subprocess.PIPE,
+                                stdin=subprocess.DEVNULL, text=True, cwd=os.path.dirname(MAIN_PATH))
+
+    ready_time = None
+    phases = {}
+    for line in process.stdout:
+        if line.startswith("Startup:"):
+            ready_time = time.perf_counter() - start_time
+            for name, ms in PHASE_PATTERN.findall(line.split('(')[0]):
+                phases[name] = int(ms)
+    process.wait()
+
+    if ready_time is None:
+        sys.exit("main.py exited without printing the startup phases (is the treadmill service still running?)")
+    return ready_time, phases
+
+results = []
+for i in range(NUM_RUNS):
+    ready_time, phases = run_once(sys.argv[1:])
+    print("run %d: ready %.0f ms after starting the interpreter, %s" % (i + 1, ready_time*1000,
+            ", ".join("%s %d ms" % (name, ms) for name, ms in phases.items())))
+    results.append((ready_time, phases))
+
+# medians of every phase over the runs
+def median(values):
+    values = sorted(values)
+    return values[len(values)//2]
+
+print("\nMedian over %d runs (main.py %s)" % (NUM_RUNS, " ".join(sys.argv[1:])))
+for name in results[0][1]:
+    print("%-10s %6d ms" % (name, median([phases[name] for ready_time, phases in results])))
+print("%-10s %6.0f ms" % ("total", median([ready_time for ready_time, phases in results])*1000))
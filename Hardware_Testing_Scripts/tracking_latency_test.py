@@ -0,0 +1,199 @@
+# This script is used to characterise the tracking mode (Tracking_Class from the motor_PID_package): the latency from a
+# position of the animal to the desired speed set from it (and to the motor), and how well the animal is kept at the
+# centre of the belt
+# NOTE: no hardware is needed. The motor, motor driver and encoder are replaced by a simulated plant (a first-order DC
+#       motor with static friction, as in stall_detection_test.py) and the MotorPID object runs against it as it does in
+#       main.py. A simulated animal walks on the belt at a speed that changes every few seconds, and a client sends its
+#       position to the PositionServer over the Unix domain socket at SENSOR_RATE (as a camera tracking script would).
+#       The position stream stops for DROPOUT_TIME in the middle of each run (the speed must be held).
+#       Each outer loop rate in TRACKING_RATES is run for TEST_TIME seconds:
+#           sensor -> setpoint: time from the capture of a position to the desired speed set from it
+#           sensor -> motor: time from the capture of a position to the control signal computed for its setpoint
+#       The test fails if the animal gets further than MAX_ERROR from the centre of the belt at any rate.
+
+# import relevant libraries
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from IO_Loop_Class import IOLoop
+from PID_Controller_Class import MotorPID
+from State_Store_Class import StateStore
+from Tracking_Class import PositionServer, PositionTracker, MPS_TO_RPM
+
+# outer loop rates tested (Hz) and the time each rate is run for (sec)
+TRACKING_RATES = (10, 50, 100)
+TEST_TIME = 20
+
+# rate of the positions sent by the client (Hz), and the time the positions stop in the middle of each run (sec)
+SENSOR_RATE = 30
+DROPOUT_TIME = 0.5
+
+# range of the speeds of the animal (m/s) and the time each speed is walked for (sec)
+# NOTE: the simulated belt tops out at 0.8 m/s (GAIN at full PWM), so the animal stays below it to leave the belt
+#       the headroom it needs to catch up
+MIN_SPEED = 0.1
+MAX_SPEED = 0.6
+SEGMENT_TIME = 4
+
+# largest distance of the animal from the centre of the belt (m), the default --tracking-center of main.py
+MAX_ERROR = 0.3
+
+# seed of the walk of the animal (every rate is run with the same walk)
+SEED = 1
+
+# simulated plant: speed at full PWM (RPM), time constant (sec), PWM needed to start moving
+GAIN = 300/480
+TAU = 0.2
+BREAKAWAY_PWM = 40
+COUNTS_PER_REV = 9.68*48
+PLANT_STEP = 0.001
+
+class SimulatedPlant(object):
+    # simulated motor, motor driver and encoder (the attributes used by MotorPID)
+    def __init__(self):
+        self.u = 0                  # PWM sent to the motor
+        self.speed = 0              # speed of the motor (RPM)
+        self.position = 0.0         # position of the motor (counts)
+        self.pos_i = 0              # encoder count
+        self.running = True         # whether the plant is simulated
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while self.running:
+            if self.speed == 0 and abs(self.u) < BREAKAWAY_PWM:
+                self.speed = 0
+            else:
+                self.speed = self.speed + (GAIN*self.u - self.speed)*PLANT_STEP/TAU
+            self.position = self.position + self.speed/60*COUNTS_PER_REV*PLANT_STEP
+            self.pos_i = int(self.position)
+            time.sleep(PLANT_STEP)
+
+    # motor driver
+    def setSpeed(self, u):
+        self.u = max(-480, min(480, u))
+
+    # encoder (same measurement as the Encoder class)
+    def calcMotorVelocity(self):
+        time_start = time.perf_counter()
+        pos_start = self.pos_i
+        time.sleep(0.1)
+        pos_stop = self.pos_i
+        return (pos_stop - pos_start)/(time.perf_counter() - time_start)/COUNTS_PER_REV*60.0
+
+class NoLogging(object):
+    # stands in for the DataLogger
+    def det_elasped_time(self):
+        return 0
+
+    def save_data(self, *args):
+        pass
+
+class SimulatedAnimal(object):
+    # animal walking on the belt (position ahead of the centre of the belt in m), that records the latencies of the
+    # setpoints of the tracker
+    def __init__(self, plant, tracker):
+        self.plant = plant
+        self.tracker = tracker
+        self.position = 0.0
+        self.errors = []                # position of the animal every step (m)
+        self.setpoint_latencies = []    # sensor -> setpoint latencies (sec)
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        speed = (MIN_SPEED + MAX_SPEED)/2
+        segment_start = last_time = time.perf_counter()
+        last_update = (None, None, None)
+        while self.running:
+            now = time.perf_counter()
+            if now - segment_start > SEGMENT_TIME:
+                speed = random.uniform(MIN_SPEED, MAX_SPEED)
+                segment_start = now
+            belt_speed = self.plant.speed/MPS_TO_RPM
+            self.position = self.position + (speed - belt_speed)*(now - last_time)
+            self.errors.append(self.position)
+            last_time = now
+
+            # every setpoint written by the tracker
+            update = self.tracker.last_update
+            if update[0] is not None and update != last_update:
+                self.setpoint_latencies.append(update[2] - update[1])
+                last_update = update
+            time.sleep(PLANT_STEP)
+
+def send_positions(animal, socket_path, start_time):
+    # sends the positions of the animal to the PositionServer at SENSOR_RATE (none during the dropout)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    dropout_start = start_time + TEST_TIME/2
+    while animal.running:
+        now = time.monotonic()
+        if not (dropout_start <= time.perf_counter() < dropout_start + DROPOUT_TIME):
+            client.sendall(b'POS %.4f %.6f\n' % (animal.position, now))
+        time.sleep(1/SENSOR_RATE)
+    client.close()
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction*len(values)))]
+
+io_loop = IOLoop()
+socket_path = os.path.join(tempfile.mkdtemp(), 'position.sock')
+server = PositionServer(io_loop=io_loop, socket_path=socket_path)
+server.server_task.result()
+
+results = []
+for rate in TRACKING_RATES:
+    # a trial at the average speed of the animal that has finished ramping
+    random.seed(SEED)
+    state_store = StateStore()
+    speed = (MIN_SPEED + MAX_SPEED)/2
+    state_store.update(program_started=True, trial_started=True, speed_des_mps=speed, speed_des_RPM=speed*MPS_TO_RPM)
+    plant = SimulatedPlant()
+    motor_control = MotorPID(motor=plant, encoder=plant, data_logger=NoLogging(), state_store=state_store)
+    tracker = PositionTracker(state_store=state_store, source=server, rate=rate)
+    stale_start = tracker.stale.value
+    server.latest = (None, None)
+    animal = SimulatedAnimal(plant=plant, tracker=tracker)
+    start_time = time.perf_counter()
+    threading.Thread(target=send_positions, args=(animal, socket_path, start_time), daemon=True).start()
+
+    # control loop (as the main loop of main.py without ramps), timing each setpoint of the tracker up to the motor
+    motor_latencies = []
+    last_version = None
+    while time.perf_counter() - start_time < TEST_TIME:
+        state = state_store.snapshot
+        version, position_time, setpoint_time = tracker.last_update
+        motor_control.maintainMotorVelocity(speed_des=state.speed_des_RPM, log_data=False)
+        if version == state.version and version != last_version:
+            motor_latencies.append(time.perf_counter() - position_time)
+            last_version = version
+
+    tracker.stop()
+    animal.running = False
+    plant.running = False
+    time.sleep(0.2)
+    errors = animal.errors
+    rms = (sum(e*e for e in errors)/len(errors))**0.5
+    results.append((rate, animal.setpoint_latencies, motor_latencies, rms, max(abs(e) for e in errors),
+                    tracker.stale.value - stale_start))
+
+print("Tracking over %d sec per rate, positions at %d Hz (stopped for %.1f sec in each run)" % (TEST_TIME, SENSOR_RATE, DROPOUT_TIME))
+print("%-10s %-28s %-22s %-22s %s" % ('outer loop', 'sensor -> setpoint (ms)', 'sensor -> motor (ms)', 'position error (cm)', 'stale'))
+print("%-10s %-28s %-22s %-22s %s" % ('', 'p50 / p99 / max', 'p50 / max', 'rms / max', 'iterations'))
+for rate, setpoint_latencies, motor_latencies, rms, max_error, stale in results:
+    print("%-10s %-28s %-22s %-22s %d" % ('%d Hz' % rate,
+            '%.1f / %.1f / %.1f' % (percentile(setpoint_latencies, 0.5)*1000, percentile(setpoint_latencies, 0.99)*1000,
+                                    max(setpoint_latencies)*1000),
+            '%.0f / %.0f' % (percentile(motor_latencies, 0.5)*1000, max(motor_latencies)*1000),
+            '%.1f / %.1f' % (rms*100, max_error*100), stale))
+os.remove(socket_path)
+
+if any(max_error > MAX_ERROR for _, _, _, _, max_error, _ in results):
+    print("FAIL: the animal got further than %.0f cm from the centre of the belt" % (MAX_ERROR*100))
+    sys.exit(1)
+print("PASS: the animal stayed within %.0f cm of the centre of the belt at every rate" % (MAX_ERROR*100))
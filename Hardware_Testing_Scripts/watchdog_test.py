@@ -0,0 +1,98 @@
+# This script is used to measure the overhead of kicking the watchdog of the control loop and how long the watchdog
+# takes to stop the motor once the control loop has stalled (Watchdog_Class from the motor_PID_package)
+# NOTE: no hardware is needed (the motor is replaced by an object that records when it has been stopped). The
+#       control loop is simulated by a thread that kicks the watchdog every PERIOD seconds and then stalls:
+#           sleep: the loop is blocked without holding the GIL (i.e. a slow SD card write or a stalled read)
+#           gil: the loop is busy in a C function that holds the GIL (i.e. sorting a long list)
+#       The detection latency is the time from the deadline to the motor being stopped.
+
+# import relevant libraries
+import time
+import Exceptions
+from Watchdog_Class import Watchdog
+
+# deadline of the watchdog (sec), period of the simulated control loop (sec) and the number of stalls of each kind
+DEADLINE = 0.1
+PERIOD = 0.005
+NUM_STALLS = 20
+
+# number of kicks timed for the overhead
+NUM_KICKS = 1000000
+
+class StopRecorder(object):
+    # stands in for the motors object and records the time the motor was stopped
+    def __init__(self):
+        self.stop_time = None
+
+    def forceStop(self):
+        self.stop_time = time.perf_counter()
+
+def measure_kick(watchdog):
+    # returns the time of a kick (sec), minus the time of an empty loop
+    watchdog.arm()
+    start = time.perf_counter()
+    for i in range(NUM_KICKS):
+        watchdog.kick()
+    kick_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(NUM_KICKS):
+        pass
+    empty_time = time.perf_counter() - start
+    watchdog.disarm()
+    return (kick_time - empty_time)/NUM_KICKS
+
+def stall(kind):
+    # stalls the simulated control loop for twice the deadline
+    if kind == 'sleep':
+        time.sleep(2*DEADLINE)
+    else:
+        stop_time = time.perf_counter() + 2*DEADLINE
+        values = list(range(200000, 0, -1))
+        while time.perf_counter() < stop_time:
+            sorted(values)
+
+def measure_stall(watchdog, motors, kind):
+    # runs the simulated control loop until it stalls, and returns the detection latency (sec)
+    motors.stop_time = None
+    watchdog.arm()
+    for i in range(20):
+        watchdog.kick()
+        time.sleep(PERIOD)
+    watchdog.kick()
+    last_kick = watchdog.kick_time
+    stall(kind)
+
+    # the next kick stops the simulated control loop
+    try:
+        watchdog.kick()
+    except Exceptions.WatchdogFault:
+        pass
+    watchdog.disarm()
+
+    if motors.stop_time is None:
+        return None
+    return motors.stop_time - last_kick - DEADLINE
+
+def summary(name, results):
+    # creates a line of the results table (times in milliseconds)
+    missed = results.count(None)
+    results = sorted(result for result in results if result is not None)
+    if not results:
+        return "%-10s %10s %10s %10s %8d" % (name, "-", "-", "-", missed)
+    return "%-10s %10.2f %10.2f %10.2f %8d" % (name, results[len(results)//2]*1000, results[int(len(results)*0.99)]*1000,
+                                                results[-1]*1000, missed)
+
+motors = StopRecorder()
+watchdog = Watchdog(motors=motors, deadline=DEADLINE)
+
+kick_overhead = measure_kick(watchdog)
+results = {}
+for kind in ('sleep', 'gil'):
+    results[kind] = [measure_stall(watchdog, motors, kind) for i in range(NUM_STALLS)]
+
+print("\nKick overhead: %.0f ns" % (kick_overhead*1e9))
+print("Detection latency after a %.0f ms deadline over %d stalls (ms)" % (DEADLINE*1000, NUM_STALLS))
+print("%-10s %10s %10s %10s %8s" % ("stall", "p50", "p99", "max", "missed"))
+for kind in results:
+    print(summary(kind, results[kind]))
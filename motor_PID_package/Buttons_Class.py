@@ -8,8 +8,6 @@
 
 # import the required libraries
 import RPi.GPIO as GPIO
-import threading
-from math import pi
 
 class Button(object):
     '''
@@ -56,34 +54,36 @@ class StartStopButton(Button):
     functions that deal with starting and stopping the main.py script via a background
     service
 
-    ARGS: button_pin (the pin that the button is attached to)
+    ARGS: button_pin (the pin that the button is attached to), callback_worker (CallbackWorker object from
+    the Callback_Worker_Class used to handle the button press outside of the GPIO callback thread),
+    state_store (StateStore object from the State_Store_Class that holds the program_started flag)
     '''
 
-    def __init__(self, button_pin):
+    def __init__(self, button_pin, callback_worker, state_store):
         # initializaition function for the StartStopButton class
 
         # obtain original init function
         super().__init__(button_pin)
 
-        self.program_started = False                # variable to store start/stop state of the program
-        self.start_stop_lock = threading.Lock()     # lock for the program_started variable (because the main loop needs access to this variable)
+        self.state_store = state_store              # StateStore object (the main loop reads the program_started flag from its snapshot)
+        self.press_time = None                      # time of the last press of the button (used to time the start of the treadmill)
 
-        # setup an interrupt on the desired pin 
-        GPIO.add_event_detect(button_pin, GPIO.FALLING, callback=self.__start_stop_function, bouncetime=500)
+        # setup an interrupt on the desired pin (the callback only captures the event for the worker)
+        GPIO.add_event_detect(button_pin, GPIO.FALLING, callback=callback_worker.deferred(self.__start_stop_function), bouncetime=500)
 
-    def __start_stop_function(self, channel):
+    def __start_stop_function(self, timestamp, channel):
         '''
         DESCRIPTION: Function that changes the state of the program_started variable, which is used
-        to control whether or not the main function should be executed
+        to control whether or not the main function should be executed (runs on the callback worker)
 
-        ARGS: channel (the pin number the button is attached to)
+        ARGS: timestamp (time the button press was captured), channel (the pin number the button is attached to)
 
         RETURN: NONE
         '''
 
-        # switch the program_started variable's state when the button is pressed
-        with self.start_stop_lock:
-            self.program_started = not self.program_started
+        # switch the program_started flag's state when the button is pressed
+        self.press_time = timestamp
+        self.state_store.modify(lambda state: {'program_started': not state.program_started})
 
 class PresetSpeedButton(Button):
     '''
@@ -93,9 +93,11 @@ class PresetSpeedButton(Button):
 
     ARGS: button_pin (pin number that the button is connected to), user_input (User_Input_Class object
     which needs to be accessed in order to update the desired speed), lcd (lcd object from the LCD_Class
-    used to allow this button to print messages to the LCD)
+    used to allow this button to print messages to the LCD), callback_worker (CallbackWorker object from
+    the Callback_Worker_Class), persistent_state (PersistentState object from the Persistent_State_Class
+    that keeps the preset speed between restarts, or None)
     '''
-    def __init__(self, button_pin, user_input, lcd):
+    def __init__(self, button_pin, user_input, lcd, callback_worker, persistent_state=None):
         # initializaition function for the StartStopButton class
 
         # obtain original init function
@@ -103,31 +105,31 @@ class PresetSpeedButton(Button):
 
         self.user_input = user_input        # store the user_input object to update speed_des
         self.lcd = lcd                      # store the lcd object to update the lcd
+        self.persistent_state = persistent_state    # store the persistent_state object to save the preset speed
 
-        # setup an interrupt on the desired pin 
-        GPIO.add_event_detect(button_pin, GPIO.FALLING, callback=self.__set_preset_speed, bouncetime=500)
+        # setup an interrupt on the desired pin (the callback only captures the event for the worker)
+        GPIO.add_event_detect(button_pin, GPIO.FALLING, callback=callback_worker.deferred(self.__set_preset_speed), bouncetime=500)
 
-    def __set_preset_speed(self, channel):
+    def __set_preset_speed(self, timestamp, channel):
         '''
-        DESCRIPTION: Callback function that saves the current speed_des_mps as the preset speed for any 
-        future experiments. This function also ramps the speed back down to zero.
+        DESCRIPTION: Function (run on the callback worker) that saves the current speed_des_mps as the preset
+        speed for any future experiments. This function also ramps the speed back down to zero.
 
-        ARGS: channel (the channel number the button is attached to)
+        ARGS: timestamp (time the button press was captured), channel (the channel number the button is attached to)
 
         RETURN: NONE
         '''
 
-        with self.user_input.speed_des_lock:
-            # set the preset speed (for both m/s and RPM)
-            self.user_input.preset_speed_mps = self.user_input.speed_des_mps
-            self.user_input.preset_speed_RPM = self.user_input.preset_speed_mps*(60/pi)/(2/39.3701)
+        # set the preset speed and send the motor back to zero velocity (in preparation for any trials with the preset speed)
+        state = self.user_input.savePresetSpeed()
 
-        # send the motor back to zero velocity (in preparation for any trials with the preset speed)
-        self.user_input.sendSpeedToZero()
+        # save the preset speed for the next restart
+        if self.persistent_state is not None:
+            self.persistent_state.set(preset_speed_mps=state.preset_speed_mps, preset_speed_RPM=state.preset_speed_RPM)
 
         # send message to LCD and terminal notifying of preset speed update
-        print("\nPreset speed of: %.2f m/s" % self.user_input.preset_speed_mps)
-        msg="Preset speed of:\n%.2f m/s" % self.user_input.preset_speed_mps
+        print("\nPreset speed of: %.2f m/s" % state.preset_speed_mps)
+        msg="Preset speed of:\n%.2f m/s" % state.preset_speed_mps
         self.lcd.sendtoLCDThread(target="knob", msg=msg, duration=2, clr_before=True, clr_after=True)
         
 class ExperimentButton(Button):
@@ -139,43 +141,71 @@ class ExperimentButton(Button):
 
     ARGS: button_pin (the pin that the button is attached to), camera_pin (the pin the camera will
     be attached to), data_collector (object from the Data_Collection_Class), user_input (object
-    of the User_Input_Class), lcd (object of the LCD_Class)
+    of the User_Input_Class), lcd (object of the LCD_Class), callback_worker (CallbackWorker object
+    from the Callback_Worker_Class), state_store (StateStore object from the State_Store_Class that holds
+    the trial_started and trial_ramp_down flags)
     '''
 
-    def __init__(self, button_pin, camera_pin, data_collector, user_input, lcd):
+    def __init__(self, button_pin, camera_pin, data_collector, user_input, lcd, callback_worker, state_store):
         # initializaition function for the StartStopButton class
 
         # obtain original init function
         super().__init__(button_pin)
 
         self.camera_pin = camera_pin            # pin that will trigger the camera to start when the button is pressed
-        self.trial_started = False              # boolean flag that indicates whether a trial is started or not
-        self.trial_ramp_down = False            # boolean flag used to notify the PID_Controller_Class to save data when the system is ramping down
+        self.state_store = state_store          # StateStore object (trial_started and trial_ramp_down are read by the PID_Controller_Class from its snapshot)
         self.data_collector = data_collector    # allow access to the data_collector object to create csv files
         self.user_input = user_input            # allow access to the user_input object to allow the button to change speeds
         self.lcd = lcd                          # allow access to the lcd object to print important messages to the LCD
+        self.callback_worker = callback_worker  # allow access to the callback_worker to start/stop trials from other threads
 
         # set up camera pin to be default low (safer)
         GPIO.setup(camera_pin, GPIO.OUT, initial=GPIO.LOW)
 
-        # set up the button as an interrupt
-        GPIO.add_event_detect(button_pin, GPIO.FALLING, callback=self.__start_stop_experiment, bouncetime=500)
+        # set up the button as an interrupt (the callback only captures the event for the worker)
+        GPIO.add_event_detect(button_pin, GPIO.FALLING, callback=callback_worker.deferred(self.__start_stop_experiment), bouncetime=500)
+
+    def request_trial(self, started):
+        '''
+        DESCRIPTION: Function that starts or stops a trial without the button (i.e. from the ControlServer). The
+        request is handled by the callback worker in order with any button presses.
+
+        ARGS: started (True to start a trial, False to stop the current trial)
+
+        RETURN: NONE
+        '''
+
+        self.callback_worker.post(self.__request_trial, started)
 
-    def __start_stop_experiment(self, channel):
+    def __request_trial(self, timestamp, started):
         '''
-        DESCRIPTION: Callback function that starts/stops an experiment (triggers a boolean flag that indicates
-        the trial has started or stopped, triggers the camera, and creates a new file to save data to)
+        DESCRIPTION: Function (run on the callback worker) that starts or stops a trial if it is not already
+        in the requested state
 
-        ARGS: channel (the pin number the button is attached to)
+        ARGS: timestamp (time the request was made), started (True to start a trial, False to stop it)
 
         RETURN: NONE
         '''
 
-        # First trigger a change in the experiment boolean flag
-        self.trial_started = not self.trial_started
+        if started != self.state_store.snapshot.trial_started:
+            self.__start_stop_experiment(timestamp, self.button_pin)
 
-        # if the experiment has started, perform the following
-        if self.trial_started == True:
+    def __start_stop_experiment(self, timestamp, channel):
+        '''
+        DESCRIPTION: Function (run on the callback worker) that starts/stops an experiment (triggers a boolean
+        flag that indicates the trial has started or stopped, triggers the camera, and creates a new file to
+        save data to)
+
+        ARGS: timestamp (time the button press was captured), channel (the pin number the button is attached to)
+
+        RETURN: NONE
+        '''
+
+        # NOTE: trials are only started/stopped on the callback worker, so the trial_started flag cannot
+        #       change between reading it here and writing it below
+
+        # if the experiment is starting, perform the following
+        if self.state_store.snapshot.trial_started == False:
             # trigger the camera by setting the GPIO to HIGH
             GPIO.output(self.camera_pin, GPIO.HIGH)
 
@@ -185,39 +215,39 @@ class ExperimentButton(Button):
             # set the start time for data collected
             self.data_collector.set_start_time()
 
-            # update the desired speeds with the preset speeds
-            with self.user_input.speed_des_lock:
-                self.user_input.speed_des_mps = self.user_input.preset_speed_mps
-                self.user_input.speed_des_RPM = self.user_input.speed_des_mps*(60/pi)/(2/39.3701)
-                self.user_input.user_changed_velocity = True            # flag used to indicate speed should be ramped
+            # start the trial and update the desired speeds with the preset speeds (ramped to by the main loop)
+            # NOTE: the trial is only flagged as started once the file exists, so no sample is logged before it
+            state = self.state_store.modify(lambda state: {'trial_started': True,
+                                                            'speed_des_mps': state.preset_speed_mps,
+                                                            'speed_des_RPM': state.preset_speed_RPM,
+                                                            'user_changed_velocity': True})
 
             # print important messages to the terminal and the LCD
             print("\nExperiment started")
-            print("To speed: %.2f m/s" % self.user_input.preset_speed_mps)
-            msg = "Trial started\nTo spd: %.2f m/s" % self.user_input.preset_speed_mps
+            print("To speed: %.2f m/s" % state.preset_speed_mps)
+            msg = "Trial started\nTo spd: %.2f m/s" % state.preset_speed_mps
             self.lcd.sendtoLCDThread(target="knob", msg=msg, duration=2, clr_before=True, clr_after=True)
         
         # if the user has stopped the experiment, execute the following
-        elif self.trial_started == False:
-            # update the ramp_down flag to save data as the speed is ramping back to zero
-            self.trial_ramp_down = True
+        else:
+            # stop the trial, update the ramp_down flag to save data as the speed is ramping back to zero
+            # and send the speed back to zero (all in one update so no sample of the ramp down is missed)
+            self.state_store.update(trial_started=False, trial_ramp_down=True, speed_des_mps=0, speed_des_RPM=0,
+                                    user_changed_velocity=True)
 
             # reset the camera pin (NOTE: the camera is based on a rising or falling edge and has a time out)
             GPIO.output(self.camera_pin, GPIO.LOW)
 
-            # NOTE: the file automatically closes after every line is saved
-
-            # send the speed back to zero
-            self.user_input.sendSpeedToZero()
+            # NOTE: the data logger flushes the file periodically, and closes it when the next file is created
 
             # NOTE: In order to save the speeds when the trial is on the "ramp down," there needs to be
             #       an additional flag for the PID_Controller_Class that allows data to be saved to the
             #       .csv file when the system ramps down
 
             # NOTE: in order for the order of messages to make sense, the messages that indicate the trial
-            #       has ended are printed in the PID_Controller_Class after the ramp_down has been performed
+            #       has ended are printed by the main loop after the ramp_down has been performed
 
-            # print message that the trial is ending (not ended, which occurs in the PID_Controller_Class)
+            # print message that the trial is ending (not ended, which is printed by the main loop)
             print("\nExperiment stopping")
             msg = "Trial stopping"
             self.lcd.sendtoLCDThread(target="knob", msg=msg, duration=2, clr_before=True, clr_after=True)
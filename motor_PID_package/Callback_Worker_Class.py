@@ -0,0 +1,87 @@
+'''
+ * @file    Callback_Worker_Class.py
+ * @author  William Wang
+ * @brief   This script contains a class that runs the
+            handling of button and knob events outside of
+            the RPi.GPIO callback thread
+'''
+
+# import the required libraries
+import queue
+import threading
+import time
+from Tracer_Class import tracer
+
+class CallbackWorker(object):
+    '''
+    DESCRIPTION: This class runs a worker thread that executes the "real" handling of button and knob
+    events. RPi.GPIO runs every edge callback (including the encoder callbacks) on a single shared thread,
+    so any slow work done inside a callback (file creation, prints, LCD messages, taking locks) delays
+    the encoder callbacks that are queued behind it. The GPIO callbacks should therefore only capture
+    the event and a timestamp via post() and let this worker do the rest.
+
+    ARGS: NONE
+    '''
+
+    def __init__(self):
+        # instantiation function for the callback worker
+
+        self.work_q = queue.SimpleQueue()       # unbounded queue of captured events (put() never blocks the GPIO thread)
+
+        # create and start the worker thread
+        # NOTE: daemon thread so that the worker is killed with the main program
+        self.worker_thread = threading.Thread(target=self.__workerThread, name='callback_worker', daemon=True)
+        self.worker_thread.start()
+
+    def post(self, handler, *args):
+        '''
+        DESCRIPTION: Function that captures an event from a GPIO callback and places it on the work queue.
+        This is the only thing that should be done inside the GPIO callback context.
+
+        ARGS: handler (function to be called by the worker as handler(timestamp, *args)), args (any data
+        captured in the callback, i.e. the channel or pin states)
+
+        RETURN: NONE
+        '''
+
+        self.work_q.put((handler, time.perf_counter(), args))
+
+    def deferred(self, handler):
+        '''
+        DESCRIPTION: Function that wraps a handler into a GPIO callback which only captures the channel
+        and a timestamp and defers the handler to the worker thread
+
+        ARGS: handler (function to be called by the worker as handler(timestamp, channel))
+
+        RETURN: callback (function to be passed as the callback to GPIO.add_event_detect())
+        '''
+
+        def callback(channel):
+            self.post(handler, channel)
+
+        return callback
+
+    def __workerThread(self):
+        '''
+        DESCRIPTION: Function running in the worker thread that executes the captured events in the order
+        they were received
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        # always waiting for events from the GPIO callbacks
+        while True:
+            handler, timestamp, args = self.work_q.get()
+
+            # execute the handler (an exception should not kill the worker and every button with it)
+            start = time.perf_counter_ns()
+            try:
+                handler(timestamp, *args)
+            except Exception as e:
+                print("\nError while handling GPIO event: %r" % e)
+
+            # record the handler in the trace
+            if tracer.enabled:
+                tracer.complete(handler.__qualname__, start, time.perf_counter_ns())
@@ -0,0 +1,515 @@
+'''
+ * @file    Control_Process_Class.py
+ * @author  William Wang
+ * @brief   This script contains the classes that run the
+            control loop (encoder, PID controller and safety
+            checks) in its own process, pinned to its own CPU,
+            and connect it to the rest of the treadmill
+'''
+
+# import the required libraries
+import multiprocessing
+import os
+import signal
+import time
+from Shared_Ring_Class import SharedRing
+from State_Store_Class import TreadmillState, StateStore
+from PID_Controller_Class import MotorPID
+from Realtime_Class import RealtimeMode
+from Watchdog_Class import Watchdog
+from Stall_Detector_Class import StallDetector
+import Exceptions
+import Metrics_Class
+import RPi.GPIO as GPIO
+
+# fields of the TreadmillState sent to the control process (the IR sensors are checked by the control process itself)
+SETPOINT_FIELDS = TreadmillState._fields[:-1]
+
+# kinds of the records sent by the control process, each record is (kind, 6 values):
+#   SAMPLE          (time, desired speed in m/s, measured speed in m/s, control signal, loop time, encoder count)
+#   ROW             (time, desired speed in m/s, measured speed in m/s, channel) row of the data log of a trial (of
+#                   the channel of that index with --channels, 0 otherwise)
+#   RAMP_STARTED    (desired speed in RPM, desired speed in m/s)
+#   RAMP_COMPLETED  (desired speed in RPM)
+#   STOPPED         (reason, driver/pin number, stall time in sec or control signal) the control loop has stopped (the motor is halted afterwards)
+#   IDLE            the control process has been set up (or the motor has been halted) and waits for the next run
+KIND_SAMPLE, KIND_ROW, KIND_RAMP_STARTED, KIND_RAMP_COMPLETED, KIND_STOPPED, KIND_IDLE = range(6)
+RECORD_SIZE = 7
+
+# reasons for the STOPPED record
+STOP_KEYBOARD, STOP_PROGRAM, STOP_DRIVER, STOP_BEAM, STOP_WATCHDOG, STOP_STALL = range(6)
+
+# time between the checks of an idle control process (and of the main process waiting for it) (sec)
+IDLE_POLL_DELAY = 0.001
+
+def pinToCPUs(tid, cpus):
+    '''
+    DESCRIPTION: Function that pins a thread (or the calling thread if tid is 0) to a set of CPUs
+
+    ARGS: tid (id of the thread), cpus (set of CPU numbers)
+
+    RETURN: True if the thread has been pinned
+    '''
+    try:
+        os.sched_setaffinity(tid, cpus)
+    except OSError:
+        return False
+    return True
+
+def raiseIfStopped(record):
+    '''
+    DESCRIPTION: Function that raises the exception the control process stopped with, so that the main loop
+    handles it as if the control loop was running in the same process
+
+    ARGS: record (record received from the control process)
+
+    RETURN: NONE
+    '''
+    if record[0] != KIND_STOPPED:
+        return
+
+    reason = record[1]
+    if reason == STOP_KEYBOARD:
+        raise KeyboardInterrupt
+    elif reason == STOP_DRIVER:
+        raise Exceptions.DriverFault(driver_num=int(record[2]))
+    elif reason == STOP_BEAM:
+        raise Exceptions.BeamFault(pin_num=int(record[2]))
+    elif reason == STOP_WATCHDOG:
+        raise Exceptions.WatchdogFault(stall_time=record[2])
+    elif reason == STOP_STALL:
+        raise Exceptions.StallFault(control_sig=record[2])
+    raise Exceptions.ProgramStopped
+
+class ControlProcess(object):
+    '''
+    DESCRIPTION: This class starts and talks to the control process (python main.py --isolated). The control
+    process owns the motor, the encoder and the IR sensors, and runs the PID controller and the safety checks
+    on its own CPU, so the terminal input, LCD, logging and servers of this process can never delay it (they
+    do not share its GIL, and the threads of this process are moved off its CPU).
+    Both directions use a SharedRing, so nothing is pickled per sample:
+        - the setpoint ring carries the TreadmillState (without beam_tripped) whenever its version changes
+        - the record ring carries the samples, data log rows, ramps and the reason the control loop stopped
+    NOTE: the control process is started with the "spawn" method (it does not inherit the threads and the
+    GPIO callbacks of this process). hardware_factory must be a module-level function (or a functools.partial
+    of one), called in the control process with a StateStore for the IR sensors, that returns (motor, motors,
+    encoder, IR_array), or the lists of the motors and encoders of the channels and a MotorGroup with channels.
+
+    ARGS: hardware_factory (function that creates the hardware of the control loop), cpu (CPU of the control
+    process, the last CPU if None), realtime (whether the control process uses the real-time mode), capacity
+    (number of records in the record ring), gains (tuning constants of the PID controller (k_p, k_i, k_d)),
+    watchdog_deadline (deadline of the watchdog of the control loop in sec, no watchdog if 0), stall_time (time
+    in sec before a motor that does not move with a high control signal is cut, no stall detection if 0), channels
+    (list of ChannelConfig from the Motor_Channels_Class to run a controller for each channel, or None)
+    '''
+
+    def __init__(self, hardware_factory, cpu=None, realtime=False, capacity=4096, gains=(0.1, 0, 0),
+                    watchdog_deadline=0.5, stall_time=0.25, channels=None):
+        # instantiation function for the control process
+
+        self.hardware_factory = hardware_factory                                # creates the hardware in the control process
+        self.cpu = cpu if cpu is not None else os.cpu_count() - 1              # CPU of the control process
+        self.realtime = realtime                                                # whether the control process uses the real-time mode
+        self.gains = tuple(gains)                                               # tuning constants of the PID controller
+        self.watchdog_deadline = watchdog_deadline                              # deadline of the watchdog of the control loop
+        self.stall_time = stall_time                                            # time before a stalled motor is cut
+        self.channels = channels                                                # configuration of the motor channels
+        self.process = None                                                     # multiprocessing.Process of the control loop
+        self.published_version = None                                           # version of the last TreadmillState sent
+        self.read_count = 0                                                     # number of records received
+
+        # rings shared with the control process
+        self.setpoints = SharedRing(record_size=len(SETPOINT_FIELDS), capacity=16)
+        self.records = SharedRing(record_size=RECORD_SIZE, capacity=capacity)
+
+        self.records_dropped = Metrics_Class.registry.counter('treadmill_control_records_dropped_total',
+                                                                'Number of records from the control process overwritten before they were read')
+
+    def start(self, state):
+        '''
+        DESCRIPTION: Function that sends the first setpoint, starts the control process and moves the threads of
+        this process off the CPU of the control process
+
+        ARGS: state (TreadmillState snapshot from the State_Store_Class)
+
+        RETURN: NONE
+        '''
+
+        self.publishState(state=state)
+
+        context = multiprocessing.get_context('spawn')
+        self.process = context.Process(target=controlProcessMain, name='treadmill control', daemon=True,
+                                        args=(self.hardware_factory, self.setpoints.name, self.records.name,
+                                                self.records.capacity, self.cpu, self.realtime, self.gains,
+                                                self.watchdog_deadline, self.stall_time, self.channels))
+        self.process.start()
+
+        # every thread of this process (and the threads it creates later) runs on the other CPUs
+        cpus = os.sched_getaffinity(0) - {self.cpu}
+        if cpus:
+            for tid in os.listdir('/proc/self/task'):
+                pinToCPUs(int(tid), cpus)
+
+    def publishState(self, state):
+        '''
+        DESCRIPTION: Function called from the main loop that sends the shared state to the control process
+        (only when it has changed)
+
+        ARGS: state (TreadmillState snapshot from the State_Store_Class)
+
+        RETURN: NONE
+        '''
+
+        if state.version == self.published_version:
+            return
+
+        i = self.setpoints.reserve()
+        for j in range(len(SETPOINT_FIELDS)):
+            self.setpoints.records[i + j] = state[j]
+        self.setpoints.commit()
+        self.published_version = state.version
+
+    def receive(self):
+        '''
+        DESCRIPTION: Generator called from the main loop that yields the records sent by the control process
+        since the last call
+
+        ARGS: NONE
+
+        RETURN: records (lists of the kind and the 5 values of each record)
+        '''
+
+        count = self.records.count()
+
+        # skip the records that have already been overwritten
+        if count - self.read_count > self.records.capacity:
+            self.records_dropped.inc(count - self.read_count - self.records.capacity)
+            self.read_count = count - self.records.capacity
+
+        while self.read_count < count:
+            record = self.records.read(self.read_count)
+            self.read_count = self.read_count + 1
+            if record is None:
+                self.records_dropped.inc()
+                continue
+            yield record
+
+    def receiveUntilIdle(self, timeout=10):
+        '''
+        DESCRIPTION: Generator called once a run has been stopped (program_started has been sent as False) that
+        yields the records sent by the control process while it halts the motor (i.e. the rows of the ramp down)
+
+        ARGS: timeout (time in seconds to wait for the control process to become idle)
+
+        RETURN: records (lists of the kind and the 5 values of each record, up to IDLE)
+        '''
+
+        end_time = time.perf_counter() + timeout
+        while self.alive() and time.perf_counter() < end_time:
+            for record in self.receive():
+                if record[0] == KIND_IDLE:
+                    return
+                yield record
+            time.sleep(IDLE_POLL_DELAY)
+
+    def alive(self):
+        '''
+        DESCRIPTION: Function that checks whether the control process is still running
+
+        ARGS: NONE
+
+        RETURN: True if the control process is running
+        '''
+        return self.process is not None and self.process.is_alive()
+
+    def stop(self, timeout=10):
+        '''
+        DESCRIPTION: Function that stops the control process (a keyboard interrupt, so it halts the motor and
+        cleans up its GPIO pins) and removes the shared rings
+
+        ARGS: timeout (time in seconds to wait for the control process before it is terminated)
+
+        RETURN: NONE
+        '''
+
+        if self.process is not None:
+            if self.process.is_alive():
+                os.kill(self.process.pid, signal.SIGINT)
+            self.process.join(timeout)
+            if self.process.is_alive():
+                print("Control process did not stop, terminating it")
+                self.process.terminate()
+                self.process.join()
+
+        self.setpoints.close()
+        self.records.close()
+
+class ControlLink(object):
+    '''
+    DESCRIPTION: This class is the end of the shared rings in the control process. It stands in for the
+    StateStore (snapshot) and the DataLogger (det_elasped_time() and save_data()) of the MotorPID object, and
+    sends the records to the main process.
+    NOTE: the rows of the data log are sent with the perf_counter() time, the main process subtracts the start
+    time of the trial (perf_counter() is the same clock in both processes)
+
+    ARGS: setpoint_name (name of the setpoint ring), record_name (name of the record ring), capacity (number
+    of records in the record ring)
+    '''
+
+    def __init__(self, setpoint_name, record_name, capacity):
+        # instantiation function for the link
+
+        self.setpoints = SharedRing(record_size=len(SETPOINT_FIELDS), capacity=16, name=setpoint_name)
+        self.records = SharedRing(record_size=RECORD_SIZE, capacity=capacity, name=record_name)
+        self.setpoint_count = 0         # number of setpoints written when the state was last read
+        self.state = None               # latest TreadmillState (rebuilt only when a new setpoint arrives)
+
+    @property
+    def snapshot(self):
+        '''
+        DESCRIPTION: Property that returns the latest TreadmillState sent by the main process (beam_tripped is
+        always None, the IR sensors are checked by the control process)
+
+        ARGS: NONE
+
+        RETURN: state (TreadmillState)
+        '''
+
+        count = self.setpoints.count()
+        if count != self.setpoint_count:
+            values = self.setpoints.read(count - 1)
+            if values is not None:
+                self.setpoint_count = count
+                self.state = TreadmillState(version=int(values[0]), speed_des_mps=values[1], speed_des_RPM=values[2],
+                                            user_changed_velocity=(values[3] != 0), preset_speed_mps=values[4],
+                                            preset_speed_RPM=values[5], trial_started=(values[6] != 0),
+                                            trial_ramp_down=(values[7] != 0), program_started=(values[8] != 0),
+                                            run=int(values[9]), beam_tripped=None)
+        return self.state
+
+    def send(self, kind, v0=0, v1=0, v2=0, v3=0, v4=0, v5=0):
+        '''
+        DESCRIPTION: Function that sends a record to the main process
+
+        ARGS: kind (kind of the record, i.e. KIND_SAMPLE), v0 to v5 (values of the record)
+
+        RETURN: NONE
+        '''
+
+        i = self.records.reserve()
+        records = self.records.records
+        records[i] = kind
+        records[i + 1] = v0
+        records[i + 2] = v1
+        records[i + 3] = v2
+        records[i + 4] = v3
+        records[i + 5] = v4
+        records[i + 6] = v5
+        self.records.commit()
+
+    def det_elasped_time(self):
+        # time stamp of a row of the data log (see the NOTE of the class)
+        return time.perf_counter()
+
+    def save_data(self, time_elapsed, desired_speed, actual_speed):
+        # send a row of the data log to the main process
+        self.send(KIND_ROW, time_elapsed, desired_speed, actual_speed)
+
+    def close(self):
+        # detach from the shared rings
+        self.setpoints.close()
+        self.records.close()
+
+class ChannelLog(object):
+    '''
+    DESCRIPTION: This class stands in for the DataLogger of a motor channel in the control process (python main.py
+    --isolated --channels), and sends the rows of the channel to the main process through the ControlLink
+
+    ARGS: link (ControlLink object), channel (index of the channel)
+    '''
+
+    def __init__(self, link, channel):
+        # instantiation function for the log of the channel
+
+        self.link = link                # link to the main process
+        self.channel = channel          # index of the channel
+
+    def det_elasped_time(self):
+        # time stamp of a row of the data log (see the NOTE of the ControlLink)
+        return time.perf_counter()
+
+    def save_data(self, time_elapsed, desired_speed, actual_speed):
+        # send a row of the data log of the channel to the main process
+        self.link.send(KIND_ROW, time_elapsed, desired_speed, actual_speed, self.channel)
+
+def rampDown(link, motor_control):
+    '''
+    DESCRIPTION: Function that slows the motor down to a halt once the control loop has stopped. The watchdog and
+    the stall detector are still armed during the ramp down, so a fault during the ramp is sent as a second
+    STOPPED (the motor has already been stopped) instead of escaping the control process
+
+    ARGS: link (ControlLink object), motor_control (MotorPID or MotorChannels object)
+
+    RETURN: NONE
+    '''
+
+    try:
+        motor_control.changeMotorVelocity(ramp_time=2, speed_des=0)
+    except Exceptions.WatchdogFault as w:
+        link.send(KIND_STOPPED, STOP_WATCHDOG, w.stall_time)
+    except Exceptions.StallFault as s:
+        link.send(KIND_STOPPED, STOP_STALL, s.control_sig)
+
+def runControlLoop(link, motors, motor_control, IR_array, realtime):
+    '''
+    DESCRIPTION: Function that runs the control loop in the control process for one run of the treadmill. The
+    loop follows the setpoints of the main process, ramps whenever user_changed_velocity is set in a new
+    TreadmillState (the main process resets the flag once it receives RAMP_COMPLETED), and stops on the same
+    conditions as the main loop of main.py. STOPPED is sent as soon as the loop stops, and the motor is then
+    halted by the control process (a fault during the ramp down is sent as a second STOPPED).
+
+    ARGS: link (ControlLink object), motors (motors object), motor_control (MotorPID or MotorChannels object), IR_array
+    (IRBreakBeamArray object), realtime (RealtimeMode object)
+
+    RETURN: NONE (a KeyboardInterrupt is raised again once the motor has been halted)
+    '''
+
+    # version of the TreadmillState the last ramp was done for
+    ramped_version = None
+    iter_start_time = time.perf_counter()
+
+    try:
+        while True:
+            Exceptions.raiseIfFault(motors=motors)
+
+            state = link.snapshot
+            speed_des = state.speed_des_RPM
+            realtime.trialChanged(in_trial=(state.trial_started or state.trial_ramp_down))
+
+            Exceptions.raiseIfProgramStopped(state=state)
+            Exceptions.raiseIfBeamTripped(IR_array=IR_array)
+
+            if state.user_changed_velocity and state.version != ramped_version:
+                link.send(KIND_RAMP_STARTED, speed_des, motor_control.RPMToMPS(speed_des))
+                motor_control.changeMotorVelocity(ramp_time=5, speed_des=speed_des)
+                ramped_version = state.version
+                link.send(KIND_RAMP_COMPLETED, speed_des)
+            else:
+                motor_control.maintainMotorVelocity(speed_des=speed_des, log_data=state.trial_started)
+
+            iter_stop_time = time.perf_counter()
+            link.send(KIND_SAMPLE, iter_stop_time, motor_control.RPMToMPS(speed_des),
+                        motor_control.RPMToMPS(motor_control.curr_speed), motor_control.control_sig,
+                        iter_stop_time - iter_start_time, motor_control.encoder.pos_i)
+            iter_start_time = iter_stop_time
+
+    except KeyboardInterrupt:
+        # slow the motor down so that it does not stop abruptly
+        link.send(KIND_STOPPED, STOP_KEYBOARD)
+        rampDown(link=link, motor_control=motor_control)
+        raise
+
+    except Exceptions.ProgramStopped:
+        # slow the motor down to a halt
+        link.send(KIND_STOPPED, STOP_PROGRAM)
+        rampDown(link=link, motor_control=motor_control)
+
+    except Exceptions.DriverFault as e:
+        link.send(KIND_STOPPED, STOP_DRIVER, e.driver_num)
+
+    except Exceptions.BeamFault as b:
+        # slow the motor down to a halt
+        link.send(KIND_STOPPED, STOP_BEAM, b.pin_num)
+        rampDown(link=link, motor_control=motor_control)
+
+    except Exceptions.WatchdogFault as w:
+        # the motor has already been stopped by the watchdog
+        link.send(KIND_STOPPED, STOP_WATCHDOG, w.stall_time)
+
+    except Exceptions.StallFault as s:
+        # the motor has already been cut by the stall detector
+        link.send(KIND_STOPPED, STOP_STALL, s.control_sig)
+
+    finally:
+        motors.forceStop()
+
+def controlProcessMain(hardware_factory, setpoint_name, record_name, capacity, cpu, realtime_enabled, gains,
+                        watchdog_deadline, stall_time, channels=None):
+    '''
+    DESCRIPTION: Function that runs the control process (started by ControlProcess). The hardware is set up
+    once (followed by IDLE), and the process then stays idle until the main process starts a new run (a
+    TreadmillState with a new run number and program_started set), runs the control loop until it stops, sends
+    IDLE once the motor has been halted and waits for the next run. The process exits on a keyboard interrupt
+    (ControlProcess.stop()).
+
+    ARGS: hardware_factory, cpu, realtime_enabled, gains, watchdog_deadline, stall_time and channels (see ControlProcess),
+    setpoint_name, record_name and capacity (names of the shared rings and the number of records in the record ring)
+
+    RETURN: NONE
+    '''
+
+    # pin the process to its CPU before the hardware (and the RPi.GPIO callback thread) is created
+    realtime = RealtimeMode(enabled=realtime_enabled, cpu=cpu)
+    pinToCPUs(0, {cpu})
+
+    link = ControlLink(setpoint_name=setpoint_name, record_name=record_name, capacity=capacity)
+    beam_store = StateStore()
+    try:
+        motor1, motors, encoder, IR_array = hardware_factory(beam_store)
+    except BaseException:
+        # the main process finds the control process has exited and stops
+        link.close()
+        raise
+    watchdog = Watchdog(motors=motors, deadline=watchdog_deadline, cpu=cpu, enabled=(watchdog_deadline > 0))
+    if channels is None:
+        stall_detector = StallDetector(motors=motors, encoder=encoder, stall_time=stall_time, cpu=cpu,
+                                        enabled=(stall_time > 0))
+        motor_control = MotorPID(motor=motor1, encoder=encoder, data_logger=link, state_store=link, gains=gains,
+                                    watchdog=watchdog, stall_detector=stall_detector)
+    else:
+        from Motor_Channels_Class import createChannelControl
+        motor_control, stall_detector = createChannelControl(channels=channels, motor_list=motor1, motors=motors,
+                                                                encoders=encoder,
+                                                                data_loggers=[ChannelLog(link=link, channel=i) for i in range(len(channels))],
+                                                                state_store=link, gains=gains, watchdog=watchdog,
+                                                                stall_time=stall_time, cpu=cpu)
+
+    realtime.lockMemory()
+    realtime.freezeStartup()
+    realtime.setupControlThread()
+
+    # tell the main process the control process is ready (the hardware has been set up)
+    link.send(KIND_IDLE)
+
+    # number of the last run of the treadmill
+    run = link.snapshot.run
+
+    try:
+        while True:
+            # idle until the main process starts a new run
+            state = link.snapshot
+            if state.run == run or not state.program_started:
+                time.sleep(IDLE_POLL_DELAY)
+                continue
+            run = state.run
+
+            # forget the trips of the IR sensors from before the run
+            beam_store.update(beam_tripped=None)
+            IR_array.reset()
+            watchdog.arm()
+            stall_detector.arm()
+            try:
+                runControlLoop(link=link, motors=motors, motor_control=motor_control, IR_array=IR_array,
+                                realtime=realtime)
+            finally:
+                watchdog.disarm()
+                stall_detector.disarm()
+            link.send(KIND_IDLE)
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        motors.forceStop()
+        GPIO.cleanup()
+        link.close()
@@ -0,0 +1,284 @@
+'''
+ * @file    Control_Server_Class.py
+ * @author  William Wang
+ * @brief   This script contains a class that runs a local
+            control and query server for the treadmill over
+            a Unix domain socket
+'''
+
+# import the required libraries
+import asyncio
+import os
+import time
+from array import array
+import Metrics_Class
+from Tracer_Class import tracer
+from Instrumented_Lock_Class import lock_stats
+
+class ControlServer(object):
+    '''
+    DESCRIPTION: This class runs a Unix domain socket server on the IOLoop which allows automation scripts
+    to command and query the treadmill without a terminal or the knob and buttons. The protocol is line
+    based (one command per line, one reply per line starting with "OK" or "ERR"):
+
+        SPEED <m/s>             set the desired speed (same setpoint path as the terminal input)
+        TRIAL START|STOP        start or stop a trial (same as pressing the experiment button)
+        STATUS                  reply with the current setpoint, preset, trial state and latest sample (and the
+                                distance of the ultrasonic sensor if there is one)
+        METRICS                 reply "OK <n>" followed by n lines of metrics in the Prometheus text format
+        PROFILE                 reply "OK <n>" followed by n lines of the loop profiler summary
+        LOCKS                   reply "OK <n>" followed by n lines of the lock statistics
+        TRACE <path>            write the events in the trace buffer to a Chrome trace JSON file
+        DUMP                    save the last seconds of the flight recorder to a .csv file (replies with its path)
+        STREAM <Hz>             stream the latest samples at the given rate until the client sends a line
+                                (each sample is "SAMPLE <time> <desired m/s> <actual m/s> <control signal>")
+
+    ARGS: io_loop (IOLoop object from the IO_Loop_Class), user_input (object of the User_Input_Class),
+    exp_button (ExperimentButton object from the Buttons_Class), state_store (StateStore object from the
+    State_Store_Class), profiler (LoopProfiler object from the Loop_Profiler_Class), recorder (FlightRecorder
+    object from the Flight_Recorder_Class, or None), ultrasonic (Ultrasonic object from the Ultrasonic_Class,
+    or None), socket_path (path of the Unix domain socket)
+    '''
+
+    def __init__(self, io_loop, user_input, exp_button, state_store, profiler, recorder=None, ultrasonic=None,
+                    socket_path='/tmp/treadmill.sock'):
+        # instantiation function for the control server
+
+        self.io_loop = io_loop                  # IOLoop object (the server runs on this loop)
+        self.user_input = user_input            # access the user_input object to change the desired speed
+        self.exp_button = exp_button            # access the exp_button object to start/stop trials
+        self.state_store = state_store          # access the state_store object to report the setpoint and flags
+        self.profiler = profiler                # access the profiler object to report the loop profile
+        self.recorder = recorder                # access the recorder object to save the flight recorder
+        self.ultrasonic = ultrasonic            # access the ultrasonic object to report the distance
+        self.socket_path = socket_path          # path of the Unix domain socket
+
+        # latest sample from the main loop in the form of (time, desired m/s, actual m/s, control signal)
+        # NOTE: the sample is written in place (no new objects) and guarded by a sequence number that is odd
+        #       while the main loop is writing it, so the server can tell if it has read a half-written sample
+        self.latest_sample = array('d', bytes(8*4))
+        self.sample_seq = 0                     # sequence number of the latest sample (0 if no sample has been published)
+
+        # start the server on the I/O loop
+        self.server_task = self.io_loop.run_task(self.__startServer())
+
+    async def __startServer(self):
+        '''
+        DESCRIPTION: Coroutine that creates the Unix domain socket and starts accepting clients
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        # remove a socket left over from a previous run
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        self.server = await asyncio.start_unix_server(self.__handleClient, path=self.socket_path)
+
+        # only the owner and group can command the treadmill
+        os.chmod(self.socket_path, 0o660)
+
+    def publish_sample(self, elapsed_time, speed_des_mps, curr_speed_mps, control_sig):
+        '''
+        DESCRIPTION: Function called from the main loop that stores the latest sample for STATUS and STREAM
+        NOTE: this only writes into a preallocated array, so the main loop never waits on the server
+
+        ARGS: elapsed_time (time of the sample in seconds), speed_des_mps (desired speed in m/s),
+        curr_speed_mps (measured speed in m/s), control_sig (PWM control signal sent to the motor)
+
+        RETURN: NONE
+        '''
+
+        sample = self.latest_sample
+        self.sample_seq = self.sample_seq + 1       # odd while the sample is being written
+        sample[0] = elapsed_time
+        sample[1] = speed_des_mps
+        sample[2] = curr_speed_mps
+        sample[3] = control_sig
+        self.sample_seq = self.sample_seq + 1
+
+    def __readSample(self):
+        '''
+        DESCRIPTION: Function (run on the I/O loop) that takes a consistent copy of the latest sample
+
+        ARGS: NONE
+
+        RETURN: seq (sequence number of the sample, 0 if no sample has been published), sample (tuple of
+        (time, desired m/s, actual m/s, control signal), None if no sample has been published)
+        '''
+
+        while True:
+            seq = self.sample_seq
+            if seq == 0:
+                return 0, None
+
+            # copy the sample and keep it if the main loop was not writing it in the meantime
+            if not seq & 1:
+                sample = tuple(self.latest_sample)
+                if self.sample_seq == seq:
+                    return seq, sample
+
+            # let the main loop finish writing the sample
+            time.sleep(0)
+
+    async def __handleClient(self, reader, writer):
+        '''
+        DESCRIPTION: Coroutine that handles the commands from a single client until it disconnects
+
+        ARGS: reader, writer (asyncio streams for the client connection)
+
+        RETURN: NONE
+        '''
+
+        try:
+            while True:
+                line = await reader.readline()
+
+                # the client has disconnected
+                if not line:
+                    break
+
+                words = line.decode('ascii', errors='replace').split()
+                if not words:
+                    continue
+
+                # streaming keeps the connection busy until the client sends another line
+                if words[0].upper() == 'STREAM':
+                    await self.__stream(words, reader, writer)
+                else:
+                    # a reply can contain a path from the request (replaced characters are not ASCII)
+                    writer.write((self.__execute(words) + '\n').encode('ascii', errors='replace'))
+                    await writer.drain()
+
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def __execute(self, words):
+        '''
+        DESCRIPTION: Function that executes a single command (other than STREAM) and creates the reply
+
+        ARGS: words (the command split into words)
+
+        RETURN: reply (reply line to be sent back to the client)
+        '''
+
+        command = words[0].upper()
+
+        if command == 'SPEED' and len(words) == 2:
+            try:
+                speed = float(words[1])
+            except ValueError:
+                return 'ERR speed is not a number'
+
+            # check the number to see if it is in the correct range
+            if not ((speed >= -1.5) and (speed <= 1.5)):
+                return 'ERR speed must be within [-1.5, 1.5] m/s'
+
+            self.user_input.setDesiredSpeed(speed)
+            return 'OK'
+
+        elif command == 'TRIAL' and len(words) == 2 and words[1].upper() in ('START', 'STOP'):
+            self.exp_button.request_trial(started=(words[1].upper() == 'START'))
+            return 'OK'
+
+        elif command == 'STATUS':
+            return 'OK ' + self.__status()
+
+        elif command == 'METRICS':
+            lines = Metrics_Class.registry.render().splitlines()
+            return '\n'.join(['OK %d' % len(lines)] + lines)
+
+        elif command == 'PROFILE':
+            if not self.profiler.enabled:
+                return 'ERR the loop profiler is not enabled (--profile)'
+            lines = self.profiler.summary().splitlines()
+            return '\n'.join(['OK %d' % len(lines)] + lines)
+
+        elif command == 'LOCKS':
+            if not lock_stats.enabled:
+                return 'ERR the lock statistics are not enabled (--lock-stats)'
+            lines = lock_stats.summary().splitlines()
+            return '\n'.join(['OK %d' % len(lines)] + lines)
+
+        elif command == 'TRACE' and len(words) == 2:
+            if not tracer.enabled:
+                return 'ERR the tracer is not enabled (--trace)'
+            try:
+                return 'OK %d events' % tracer.dump(words[1])
+            except OSError as e:
+                return 'ERR %s' % e
+
+        elif command == 'DUMP':
+            if self.recorder is None:
+                return 'ERR there is no flight recorder'
+            return 'OK ' + self.recorder.dump(reason='request')
+
+        return 'ERR unknown command'
+
+    def __status(self):
+        '''
+        DESCRIPTION: Function that creates the status line of the treadmill
+
+        ARGS: NONE
+
+        RETURN: status (string of key=value pairs)
+        '''
+
+        # every value is taken from the same snapshot, so the status is always consistent
+        state = self.state_store.snapshot
+        status = "running=%d trial=%d ramping=%d speed_des=%.3f preset=%.3f version=%d" % (state.program_started,
+                    state.trial_started, state.user_changed_velocity, state.speed_des_mps, state.preset_speed_mps,
+                    state.version)
+
+        # add the latest sample from the main loop
+        seq, sample = self.__readSample()
+        if sample is not None:
+            status = status + " speed_act=%.3f control=%.1f" % (sample[2], sample[3])
+
+        # add the distance of the ultrasonic sensor (once it has a reading)
+        if self.ultrasonic is not None and self.ultrasonic.distance is not None:
+            status = status + " distance=%.1f" % self.ultrasonic.distance
+
+        return status
+
+    async def __stream(self, words, reader, writer):
+        '''
+        DESCRIPTION: Coroutine that streams the latest samples to the client at the requested rate until
+        the client sends another line (or disconnects)
+
+        ARGS: words (the STREAM command split into words), reader, writer (asyncio streams for the client)
+
+        RETURN: NONE
+        '''
+
+        try:
+            rate = float(words[1]) if len(words) == 2 else 10
+        except ValueError:
+            rate = 0
+        if not (0 < rate <= 1000):
+            writer.write(b'ERR rate must be within (0, 1000] Hz\n')
+            await writer.drain()
+            return
+
+        writer.write(b'OK\n')
+
+        # any line from the client stops the stream
+        stop = asyncio.ensure_future(reader.readline())
+        last_seq = 0
+
+        try:
+            while not stop.done():
+                # only send samples that have not been sent yet
+                seq, sample = self.__readSample()
+                if sample is not None and seq != last_seq:
+                    writer.write(("SAMPLE %.4f %.3f %.3f %.1f\n" % sample).encode('ascii'))
+                    last_seq = seq
+                await writer.drain()
+
+                await asyncio.wait((stop,), timeout=1/rate)
+        finally:
+            stop.cancel()
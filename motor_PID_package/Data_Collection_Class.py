@@ -7,21 +7,34 @@
 '''
 
 # import the required libraries
+import asyncio
+import collections
 import csv
 import os
+import threading
 from datetime import datetime
 import time
+from array import array
+import Metrics_Class
 
 class DataLogger(object):
     '''
     DESCRIPTION: This class ontains various functions that allow the user to store
     time and speed data into a .csv file for future use (i.e. opening a new file, 
     saving data to the file, closing the file, etc.)
+    NOTE: the rows are not written by the caller. They are written into a preallocated ring buffer and a
+    task on the IOLoop flushes them to the file periodically, so the control loop never waits on the SD
+    card and never allocates a new row.
 
-    ARGS: NONE
+    ARGS: io_loop (IOLoop object from the IO_Loop_Class), ring_size (number of rows kept in the ring buffer),
+    name (added to the names of the files and to the labels of the metrics to tell the logs of several motor
+    channels apart, or None)
     '''
 
-    def __init__(self):
+    # number of values in each row (time_elapsed, desired_speed, actual_speed)
+    ROW_SIZE = 3
+
+    def __init__(self, io_loop, ring_size=8192, name=None):
         # initialization function for the class
         
         self.file_header = ['time_elapsed', 'desired_speed', 'actual_speed']            # header for the .csv data
@@ -29,10 +42,30 @@ class DataLogger(object):
         self.file_path = ''                                                     # variable that stores the file path to save the data to
         self.logs_path = ''                                                     # variable that stores the path for the data logs
         self.start_time = time.perf_counter()                                   # start time for the experiment
+        self.file_q = collections.deque()                                       # queue of new file paths (with the first row of each file) waiting to be created
+        self.flush_period = 0.1                                                 # time between flushes of the rows to the file (sec)
+        self.name = name                                                        # name added to the file names (None for no name)
+        self.closing = False                                                    # whether the flush task writes the last rows and closes the file
+        self.closed = threading.Event()                                         # set by the flush task once the file has been closed
+
+        # preallocated ring buffer of the rows (written only by the control loop)
+        self.ring_size = ring_size
+        self.ring = array('d', bytes(8*self.ROW_SIZE*ring_size))
+        self.write_count = 0                                                    # total number of rows written (the ring index is write_count % ring_size)
+
+        # counters for the logged data (labelled with the name of the log if it has one)
+        labels = {'log': name} if name is not None else None
+        self.samples_logged = Metrics_Class.registry.counter('treadmill_samples_logged_total', 'Number of samples queued to be logged', labels)
+        self.rows_written = Metrics_Class.registry.counter('treadmill_log_rows_written_total', 'Number of rows written to the .csv files', labels)
+        self.files_created = Metrics_Class.registry.counter('treadmill_log_files_total', 'Number of .csv files created', labels)
+        self.rows_dropped = Metrics_Class.registry.counter('treadmill_log_rows_dropped_total', 'Number of rows overwritten in the ring buffer before they were written', labels)
 
         # create a data_logs directory if it does not already exits
         self.__create_log_directory()
 
+        # start the task that flushes the data to the file on the I/O loop
+        self.flush_task = io_loop.run_task(self.__flushTask())
+
     def __create_log_directory(self):
         '''
         DESCRIPTION: This function is used when the object is initialized and creates a data_logs
@@ -70,34 +103,118 @@ class DataLogger(object):
         # First get the date and time for the file name (in the form of a string)
         self.date_and_time = datetime.now().strftime('%Y_%m_%d-%I_%M_%S_%p')
 
-        # Create the file path to save to
-        self.file_path = self.logs_path + self.date_and_time + '.csv'
+        # Create the file path to save to (with the name of the log after the date and time)
+        if self.name is None:
+            self.file_path = self.logs_path + self.date_and_time + '.csv'
+        else:
+            self.file_path = self.logs_path + self.date_and_time + '_' + self.name + '.csv'
+
+        # Queue the new file path with the first row that belongs to it (the flush task creates the file and
+        # writes the header, in order with the rows)
+        self.file_q.append((self.file_path, self.write_count))
 
-        # Open the file and save the header to the file (the 'with' command eliminates the requirement to use file.close())
-        with open(self.file_path, 'w+', encoding='UTF8', newline='') as f:
-            # create .csv writer object
-            csv_writer = csv.writer(f)
+    def save_data(self, time_elapsed, desired_speed, actual_speed):
+        '''
+        DESCRIPTION: This function is used to save a row of data to the currently open .csv file
+        NOTE: this only writes the values into the ring buffer (no locks and no new objects), it must
+        only be called from the control loop
 
-            # write the header to the file
-            csv_writer.writerow(self.file_header)
+        ARGS: time_elapsed (time since the start of the trial), desired_speed, actual_speed (speeds in m/s)
 
-    def save_data(self, data):
+        RETURN: NONE
         '''
-        DESCRIPTION: This function is used to save data to the currently open .csv file
-        in the form of [time_elapsed, desired_speed, actual_speed]
 
-        ARGS: data (in the form of [time_elapsed, desired_speed, actual_speed])
+        i = (self.write_count % self.ring_size)*self.ROW_SIZE
+        ring = self.ring
+        ring[i] = time_elapsed
+        ring[i + 1] = desired_speed
+        ring[i + 2] = actual_speed
+
+        # publish the row (single attribute assignment, the flush task only reads rows below write_count)
+        self.write_count = self.write_count + 1
+        self.samples_logged.inc()
+
+    async def __flushTask(self):
+        '''
+        DESCRIPTION: Coroutine running on the I/O loop that writes the rows in the ring buffer into the current .csv
+        file. A queued file path (from create_new_file()) closes the current file and opens the new one before
+        the first row that belongs to it. Once close() has been called, the rows left in the ring buffer are
+        written and the file is closed.
+
+        ARGS: NONE
 
         RETURN: NONE
         '''
 
-        # Open the file and save the new data into the file
-        with open(self.file_path, 'a', encoding='UTF8', newline='') as f:
-            # create .csv writer object
-            csv_writer = csv.writer(f)
+        f = None                # currently open file
+        csv_writer = None       # .csv writer object for the open file
+        read_count = 0          # total number of rows taken from the ring buffer
+
+        # always flushing the ring buffer to the file
+        while True:
+            await asyncio.sleep(self.flush_period)
+
+            # read the flag before the rows, so the last flush has every row saved before close()
+            closing = self.closing
+
+            # skip the flush if there is nothing to write
+            write_count = self.write_count
+            if read_count == write_count and not self.file_q and not closing:
+                continue
+
+            # skip the rows that have been overwritten by the control loop (the file fell too far behind)
+            if write_count - read_count > self.ring_size:
+                self.rows_dropped.inc(write_count - read_count - self.ring_size)
+                read_count = write_count - self.ring_size
+
+            for index in range(read_count, write_count + 1):
+                # open any new file that starts at this row
+                # NOTE: the row at write_count has not been written yet, it is only used to open new files
+                while self.file_q and self.file_q[0][1] <= index:
+                    path = self.file_q.popleft()[0]
+
+                    # close the previous file and open the new one
+                    if f is not None:
+                        f.close()
+                    f = open(path, 'w+', encoding='UTF8', newline='')
+                    csv_writer = csv.writer(f)
+
+                    # write the header to the file
+                    csv_writer.writerow(self.file_header)
+                    self.files_created.inc()
+
+                if index < write_count and csv_writer is not None:
+                    # write the data to the file
+                    i = (index % self.ring_size)*self.ROW_SIZE
+                    csv_writer.writerow(self.ring[i:i + self.ROW_SIZE])
+                    self.rows_written.inc()
+
+            read_count = write_count
+
+            # make sure the data reaches the file
+            if f is not None:
+                f.flush()
+
+            # close the file after the last flush
+            if closing:
+                if f is not None:
+                    f.close()
+                self.closed.set()
+                return
+
+    def close(self, timeout=1.0):
+        '''
+        DESCRIPTION: This function writes the rows still in the ring buffer to the file and closes the file
+        (called by the main program before it exits, the I/O loop is a daemon thread so the rows would be lost)
+        NOTE: no rows are written to the file after this function has been called
+
+        ARGS: timeout (longest time to wait for the flush task in sec)
+
+        RETURN: closed (True if the file has been closed within the timeout)
+        '''
 
-            # write the header to the file
-            csv_writer.writerow(data)
+        self.closing = True
+        return self.closed.wait(timeout)
 
     def set_start_time(self):
         '''
@@ -126,3 +243,56 @@ class DataLogger(object):
         elapsed_time = current_time - self.start_time
 
         return elapsed_time
+
+class DataLoggerGroup(object):
+    '''
+    DESCRIPTION: This class stands in for the DataLogger when several motor channels are run (python main.py
+    --channels): every channel logs to its own DataLogger (its own .csv file named after the channel), and the
+    trials start the files and the start time of every log together
+    NOTE: det_elasped_time() and save_data() are those of the log of the first channel
+
+    ARGS: loggers (list of DataLogger objects, one for each channel)
+    '''
+
+    def __init__(self, loggers):
+        # initialization function for the class
+
+        self.loggers = loggers                      # log of each channel
+
+    @property
+    def start_time(self):
+        # start time of the experiment (the same for every log)
+        return self.loggers[0].start_time
+
+    def create_new_file(self):
+        '''
+        DESCRIPTION: This function creates a new .csv file for every channel
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        for logger in self.loggers:
+            logger.create_new_file()
+
+    def set_start_time(self):
+        '''
+        DESCRIPTION: This function is used to set the start time for the trial of every channel when called
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        start_time = time.perf_counter()
+        for logger in self.loggers:
+            logger.start_time = start_time
+
+    def det_elasped_time(self):
+        # elapsed time of the experiment (see DataLogger)
+        return self.loggers[0].det_elasped_time()
+
+    def save_data(self, time_elapsed, desired_speed, actual_speed):
+        # save a row to the log of the first channel (see DataLogger)
+        self.loggers[0].save_data(time_elapsed, desired_speed, actual_speed)
@@ -8,25 +8,60 @@
 
 # import the required libraries
 import RPi.GPIO as GPIO
+import mmap
 import threading
 import time
+import Metrics_Class
+from Tracer_Class import tracer
+from Instrumented_Lock_Class import make_lock
+
+# GPIO registers of the BCM2835/BCM2711 (RPi 4 and earlier) mapped by /dev/gpiomem: size of the GPIO block and
+# index of the GPLEV0 register (levels of the pins 0-31) in 32-bit words
+GPIO_BLOCK_SIZE = 0xB4
+GPLEV0_INDEX = 0x34//4
+
+# states of the encoder ((A << 1) | B) in the order they follow when the encoder count increases
+QUADRATURE_SEQUENCE = (0b00, 0b10, 0b11, 0b01)
+
+# table of the change in the encoder count for each transition (index (previous state << 2) | state), a
+# transition by two steps (None) means an edge has been missed between two samples
+STEPS = {0: 0, 1: 1, 2: None, 3: -1}
+TRANSITIONS = tuple(STEPS[(QUADRATURE_SEQUENCE.index(i & 3) - QUADRATURE_SEQUENCE.index(i >> 2)) % 4] for i in range(16))
 
 class Encoder(object):
     '''
     DESCRIPTION: This class deals with setting up and reading the encoder pins provided to
     the brushed DC motor. This class allows you to calculate the motor speed
     via a built-in function (i.e. calcMotorVelocity()).
+    By default every edge of the encoder runs a callback (__readEncoderA/B) that reads both pins. With a
+    sample_rate the callbacks are not used, and a sampling thread instead reads the levels of both pins at once
+    from the GPLEV0 register (through an mmap of /dev/gpiomem) at sample_rate samples per second. The samples
+    are decoded in batches with a transition table, and pos_i is updated once per batch. Edges can be missed
+    if the encoder changes state twice between two samples (these are counted by the missed edges metric).
+    NOTE: the sampling mode is for the GPIO of the BCM2835/BCM2711 (RPi 4 and earlier). gpio_path can be any
+    file of at least GPIO_BLOCK_SIZE bytes (i.e. to test the decoding by writing the levels to the file).
 
-    ARGS: ENCA, ENCB (encoder pin definitions on the RPi in BCM form)
+    ARGS: ENCA, ENCB (encoder pin definitions on the RPi in BCM form), sample_rate (samples per second of the
+    sampling mode, the per-edge callbacks are used if 0), batch_size (number of samples decoded at once in the
+    sampling mode), gpio_path (file mapped for the levels of the pins in the sampling mode)
     '''
 
-    def __init__(self, ENCA = 23, ENCB = 24):
+    def __init__(self, ENCA = 23, ENCB = 24, sample_rate = 0, batch_size = 64, gpio_path = '/dev/gpiomem'):
         # instantiation function (sets up the required pins for the encoder to work)
 
         self.ENCA = ENCA                        # import the two encoder pins
         self.ENCB = ENCB
         self.pos_i = 0                          # variable that keeps track of encoder counts/direction
-        self.enc_lock = threading.Lock()        # this lock is used to ensure that the pos_i variable isn't accessed by too many things at once
+        self.edge_time_ns = 0                   # time of the last edge in ns (time.perf_counter_ns(), used by the stall detector)
+        self.enc_lock = make_lock('enc_lock')   # this lock is used to ensure that the pos_i variable isn't accessed by too many things at once
+
+        # counters for the number of edges processed by each callback
+        self.edges_a = Metrics_Class.registry.counter('treadmill_encoder_edges_total', 'Number of encoder edges processed', {'pin': ENCA})
+        self.edges_b = Metrics_Class.registry.counter('treadmill_encoder_edges_total', 'Number of encoder edges processed', {'pin': ENCB})
+        self.missed_edges = Metrics_Class.registry.counter('treadmill_encoder_missed_edges_total', 'Number of encoder edges missed between two samples (sampling mode)')
+
+        self.sample_rate = sample_rate          # samples per second of the sampling mode (0 for the per-edge callbacks)
+        self.batch_size = batch_size            # number of samples decoded at once in the sampling mode
 
         # set the GPIO mode
         GPIO.setmode(GPIO.BCM)
@@ -35,6 +70,15 @@ class Encoder(object):
         GPIO.setup(ENCA, GPIO.IN)
         GPIO.setup(ENCB, GPIO.IN)
 
+        # sample both pins from a thread in the sampling mode (the mapping is only read)
+        if sample_rate > 0:
+            with open(gpio_path, 'rb') as f:
+                self.gpio_map = mmap.mmap(f.fileno(), GPIO_BLOCK_SIZE, access=mmap.ACCESS_READ)
+            self.levels = memoryview(self.gpio_map).cast('I')
+            self.sampling_thread = threading.Thread(target=self.__samplingThread, name='encoder_sampling', daemon=True)
+            self.sampling_thread.start()
+            return
+
         # set the encoder as an interrupt by default (for both pins)
         GPIO.add_event_detect(ENCA, GPIO.BOTH, callback = self.__readEncoderA)
         GPIO.add_event_detect(ENCB, GPIO.BOTH, callback = self.__readEncoderB)
@@ -49,6 +93,8 @@ class Encoder(object):
         RETURN: NONE
         '''
 
+        start = time.perf_counter_ns()          # start time of the callback (for the trace and the time of the edge)
+
         # read ENCB when ENCA has been triggered with a rising or falling signal
         a = GPIO.input(self.ENCA)
         b = GPIO.input(self.ENCB)
@@ -72,6 +118,14 @@ class Encoder(object):
         #       access the variable
         with self.enc_lock:
             self.pos_i = self.pos_i + increment
+        self.edge_time_ns = start
+
+        self.edges_a.inc()
+
+        # record the edge in the trace
+        if tracer.enabled:
+            tracer.name_current_thread('RPi.GPIO callbacks')
+            tracer.complete('encoder A edge', start, time.perf_counter_ns())
 
     def __readEncoderB(self, channel):
         '''
@@ -83,6 +137,8 @@ class Encoder(object):
         RETURN: NONE
         '''
 
+        start = time.perf_counter_ns()          # start time of the callback (for the trace and the time of the edge)
+
         # read ENCA when ENCB has been triggered with a rising or falling signal
         a = GPIO.input(self.ENCA)
         b = GPIO.input(self.ENCB)
@@ -106,6 +162,94 @@ class Encoder(object):
         #       access the variable
         with self.enc_lock:
             self.pos_i = self.pos_i + increment
+        self.edge_time_ns = start
+
+        self.edges_b.inc()
+
+        # record the edge in the trace
+        if tracer.enabled:
+            tracer.name_current_thread('RPi.GPIO callbacks')
+            tracer.complete('encoder B edge', start, time.perf_counter_ns())
+
+    def __samplingThread(self):
+        '''
+        DESCRIPTION: Function running in the sampling thread that reads the GPLEV0 register at sample_rate
+        samples per second and decodes the samples in batches (sampling mode only)
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        levels = self.levels
+        batch = [0]*self.batch_size             # levels of GPLEV0 of the batch (preallocated, refilled in place)
+        period = 1/self.sample_rate
+        level = levels[GPLEV0_INDEX]
+        state = (((level >> self.ENCA) & 1) << 1) | ((level >> self.ENCB) & 1)
+
+        next_time = time.perf_counter()
+        while True:
+            for i in range(self.batch_size):
+                batch[i] = levels[GPLEV0_INDEX]
+
+                # wait for the next sample (a late sample moves the following ones instead of being caught up)
+                next_time = next_time + period
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_time = time.perf_counter()
+
+            state = self.__decodeBatch(batch, state)
+
+    def __decodeBatch(self, batch, state):
+        '''
+        DESCRIPTION: Function that decodes a batch of samples with the transition table and updates the
+        encoder count once for the batch (sampling mode only)
+
+        ARGS: batch (levels of GPLEV0 of the batch), state (state of the encoder before the batch)
+
+        RETURN: state (state of the encoder at the end of the batch)
+        '''
+
+        a_shift = self.ENCA
+        b_shift = self.ENCB
+        count = 0
+        edges_a = 0
+        edges_b = 0
+        missed = 0
+        prev_level = None
+
+        for level in batch:
+            # most samples are unchanged (no edge)
+            if level == prev_level:
+                continue
+            prev_level = level
+
+            new_state = (((level >> a_shift) & 1) << 1) | ((level >> b_shift) & 1)
+            if new_state == state:
+                continue
+            step = TRANSITIONS[(state << 2) | new_state]
+            if step is None:
+                missed = missed + 1
+            else:
+                count = count + step
+                if (state ^ new_state) & 0b10:
+                    edges_a = edges_a + 1
+                else:
+                    edges_b = edges_b + 1
+            state = new_state
+
+        if edges_a or edges_b or missed:
+            with self.enc_lock:
+                self.pos_i = self.pos_i + count
+            self.edge_time_ns = time.perf_counter_ns()
+            self.edges_a.inc(edges_a)
+            self.edges_b.inc(edges_b)
+            if missed:
+                self.missed_edges.inc(missed)
+
+        return state
 
     def calcMotorVelocity(self):
         '''
@@ -125,7 +269,20 @@ class Encoder(object):
             pos_stop = self.pos_i                   # read the position again
         time_stop = time.perf_counter()             # end time for velocity calculation
         deltaT = time_stop - time_start             # calculate the elapsed time
-        velocity = (pos_stop - pos_start)/deltaT    # calculate the velocity
+
+        return self.countsToRPM(pos_stop - pos_start, deltaT)
+
+    def countsToRPM(self, counts, deltaT):
+        '''
+        Description: Function to convert a number of encoder counts over a time into a velocity in RPM (used to
+        measure several encoders over the same time)
+
+        Args: counts (change of pos_i), deltaT (time the counts were measured over in seconds)
+
+        Return: velocity (velocity of the motor in RPM)
+        '''
+
+        velocity = counts/deltaT                    # calculate the velocity (in counts/second)
 
         # change the velocity into RPM
         # Notes about conversion factors: 9.68 gear ratio, 48 counts/rev, 60 sec/min
@@ -11,8 +11,6 @@
 
 # ----------------- Various exception classes ----------------------- #
 # Define custom exceptions to raise if a fault is detected.
-from tracemalloc import start
-
 
 class DriverFault(Exception):
     '''
@@ -30,12 +28,21 @@ def raiseIfFault(motors):
     DESCRIPTION: Function that raises the DriverFault if a fault is detected
     for the motor driver
 
-    ARGS: motors (motors object from single_tb9051ftg_motor_driver module)
+    ARGS: motors (motors object from single_tb9051ftg_motor_driver module, or a MotorGroup object from the
+    Motor_Channels_Class with the motor of every channel in drivers)
 
     RETURN: NONE
     '''
-    if motors.motor1.getFault():
-        raise DriverFault(driver_num=1)
+    drivers = getattr(motors, 'drivers', None)
+    if drivers is None:
+        if motors.motor1.getFault():
+            raise DriverFault(driver_num=1)
+        return
+
+    # the drivers of the channels are numbered from 1 in the order of the channels
+    for i in range(len(drivers)):
+        if drivers[i].getFault():
+            raise DriverFault(driver_num=i + 1)
 
 class BeamFault(Exception):
     '''
@@ -50,21 +57,35 @@ class BeamFault(Exception):
 
 def raiseIfBeamBroken(IR_sen):
     '''
-    DESCRIPTION: Function that raises the BeamFault if the IR sensor has been
-    triggered via interrupt or via open circuit
+    DESCRIPTION: Function that raises the BeamFault if the IR sensor is broken
+    via open circuit (trips via interrupt are checked with raiseIfBeamTripped())
 
     ARGS: IR_sen (IR_sensor object from the IR_Break_Beam_Class module)
 
     RETURN: NONE
     '''
-    # check if the callback has been triggered (use lock to prevent race conditions with callback thread)
-    with IR_sen.beam_lock:
-        beam_triggered = IR_sen.triggered
-
-    # raise the fault if the beam pin is LOW or the beam has been triggered via the callback
-    if IR_sen.beam_broken() or beam_triggered:
+    # raise the fault if the beam pin is LOW
+    if IR_sen.beam_broken():
         raise BeamFault(pin_num=IR_sen.beam_pin)
 
+def raiseIfBeamTripped(IR_array):
+    '''
+    DESCRIPTION: Function that raises the BeamFault if any IR sensor of the array has been
+    triggered via interrupt or was found broken by a read of the pins (one read of the bitmask
+    of the tripped sensors, however many sensors there are, and a read of the pins every
+    level_period seconds of the array)
+
+    ARGS: IR_array (IRBreakBeamArray object from the IR_Break_Beam_Class module)
+
+    RETURN: NONE
+    '''
+    # read the pins if it is time to (trips the sensors whose beams are broken)
+    IR_array.check_levels()
+
+    # raise the fault for the first sensor that has been tripped
+    if IR_array.tripped_mask:
+        raise BeamFault(pin_num=IR_array.first_tripped())
+
 class ProgramStopped(Exception):
     '''
     DESCRIPTION: Class that defines an exception when user presses start/stop button to stop the main program
@@ -75,19 +96,39 @@ class ProgramStopped(Exception):
     def __init__(self):
         pass
 
-def raiseIfProgramStopped(start_stop_button):
+def raiseIfProgramStopped(state):
     '''
     DESCRIPTION: Function that raises the ProgramStopped exception when the user decides to stop
     the main function via the start/stop button
 
-    ARGS: start_stop_button (StartStopButton object from the Buttons_Class.py module)
+    ARGS: state (TreadmillState snapshot from the State_Store_Class module)
 
     RETURN: NONE
     '''
-    # check if the callback has been triggered (use lock to prevent race conditions with callback thread)
-    with start_stop_button.start_stop_lock:
-        program_started = start_stop_button.program_started
-
     # raise the fault if the program has been stopped via the button
-    if program_started == False:
-        raise ProgramStopped
\ No newline at end of file
+    if state.program_started == False:
+        raise ProgramStopped
+
+class WatchdogFault(Exception):
+    '''
+    DESCRIPTION: Class that defines the fault raised once the control loop continues after it has been stalled
+    for longer than the deadline of the watchdog (the motor has already been stopped by the watchdog)
+
+    ARGS: stall_time (time in seconds the control loop was stalled for)
+    '''
+
+    def __init__(self, stall_time):
+        # Initialization function for the watchdog fault
+        self.stall_time = stall_time
+
+class StallFault(Exception):
+    '''
+    DESCRIPTION: Class that defines the fault for a stalled motor (or a jammed belt), raised once the control
+    effort has been high without the motor moving (the motor has already been cut by the stall detector)
+
+    ARGS: control_sig (PWM control signal when the stall was detected)
+    '''
+
+    def __init__(self, control_sig):
+        # Initialization function for the stall fault
+        self.control_sig = control_sig
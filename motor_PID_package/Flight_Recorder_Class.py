@@ -0,0 +1,178 @@
+'''
+ * @file    Flight_Recorder_Class.py
+ * @author  William Wang
+ * @brief   This script contains a class that always records
+            the last seconds of the control loop in memory and
+            saves them to a .csv file when the treadmill stops
+'''
+
+# import the required libraries
+import csv
+import os
+import time
+from array import array
+from datetime import datetime
+import Metrics_Class
+
+# kinds of the records, each record is (time, kind, 5 values):
+#   SAMPLE      (desired speed in m/s, measured speed in m/s, control signal, encoder count, loop time)
+#   STATE       (desired speed in m/s, preset speed in m/s, flags, IR sensor pin that tripped or -1, state version)
+KIND_SAMPLE, KIND_STATE = range(2)
+RECORD_SIZE = 7
+
+# bits of the flags of a STATE record
+STATE_FLAGS = (('program_started', 1), ('trial_started', 2), ('trial_ramp_down', 4), ('user_changed_velocity', 8))
+
+class FlightRecorder(object):
+    '''
+    DESCRIPTION: This class is a flight recorder for the control loop. The main loop writes every sample
+    (setpoint, measured speed, control signal, encoder count and loop time) and every change of the shared state
+    (the inputs from the knob, buttons, terminal and control socket) into a preallocated ring of records, whether
+    or not a trial is being logged. When the treadmill stops on a fault (or on request over the control socket),
+    the last seconds of the ring are saved to a .csv file in the flight_logs directory.
+    NOTE: recording only writes values into the ring in place (no locks and no new objects) and must only be
+    done from the main loop. dump() copies the ring in one step and leaves the writing of the file to a thread
+    of the I/O loop's executor, so it can be called from the main loop or the I/O loop.
+
+    ARGS: io_loop (IOLoop object from the IO_Loop_Class), capacity (number of records in the ring), duration
+    (number of seconds before the dump that are saved)
+    '''
+
+    def __init__(self, io_loop, capacity=4096, duration=30):
+        # instantiation function for the flight recorder
+
+        self.io_loop = io_loop                  # IOLoop object (the files are written by its executor)
+        self.capacity = capacity                # number of records in the ring
+        self.duration = duration                # number of seconds before the dump that are saved
+        self.state_version = None               # version of the last TreadmillState recorded
+
+        # path of the flight_logs directory (created with the first dump)
+        self.logs_path = os.path.dirname(os.path.abspath(__file__)) + '/flight_logs/'
+
+        # preallocated ring of the records (written only by the main loop)
+        self.records = array('d', bytes(8*RECORD_SIZE*capacity))
+        self.write_count = 0                    # total number of records written (the ring index is write_count % capacity)
+
+        self.dumps = Metrics_Class.registry.counter('treadmill_flight_recorder_dumps_total', 'Number of times the flight recorder has been saved')
+
+    def recordSample(self, sample_time, speed_des_mps, curr_speed_mps, control_sig, encoder_count, loop_time):
+        '''
+        DESCRIPTION: Function called from the main loop that records a sample of the control loop
+
+        ARGS: sample_time (time.perf_counter() of the sample), speed_des_mps (desired speed in m/s), curr_speed_mps
+        (measured speed in m/s), control_sig (PWM control signal sent to the motor), encoder_count (position of
+        the encoder in counts), loop_time (time of the iteration of the control loop in sec)
+
+        RETURN: NONE
+        '''
+
+        i = (self.write_count % self.capacity)*RECORD_SIZE
+        records = self.records
+        records[i] = sample_time
+        records[i + 1] = KIND_SAMPLE
+        records[i + 2] = speed_des_mps
+        records[i + 3] = curr_speed_mps
+        records[i + 4] = control_sig
+        records[i + 5] = encoder_count
+        records[i + 6] = loop_time
+
+        # publish the record (single attribute assignment, dump() only reads records below write_count)
+        self.write_count = self.write_count + 1
+
+    def recordState(self, state):
+        '''
+        DESCRIPTION: Function called from the main loop with every snapshot it takes, that records the snapshot
+        if it has changed since the last one (only the version is compared otherwise)
+
+        ARGS: state (TreadmillState snapshot from the State_Store_Class)
+
+        RETURN: NONE
+        '''
+
+        if state.version == self.state_version:
+            return
+        self.state_version = state.version
+
+        flags = 0
+        for name, bit in STATE_FLAGS:
+            if getattr(state, name):
+                flags = flags | bit
+
+        i = (self.write_count % self.capacity)*RECORD_SIZE
+        records = self.records
+        records[i] = time.perf_counter()
+        records[i + 1] = KIND_STATE
+        records[i + 2] = state.speed_des_mps
+        records[i + 3] = state.preset_speed_mps
+        records[i + 4] = flags
+        records[i + 5] = state.beam_tripped if state.beam_tripped is not None else -1
+        records[i + 6] = state.version
+        self.write_count = self.write_count + 1
+
+    def dump(self, reason):
+        '''
+        DESCRIPTION: Function that saves the last seconds of the ring to a new .csv file (the file is written
+        in the background)
+
+        ARGS: reason (reason for the dump used in the file name, i.e. 'beam_fault')
+
+        RETURN: file_path (path of the .csv file)
+        '''
+
+        # copy the ring in one step (the oldest record may be half overwritten by the main loop and is skipped)
+        count = self.write_count
+        records = self.records[:]
+        dump_time = time.perf_counter()
+        first = max(0, count - self.capacity + 1)
+
+        file_path = self.logs_path + datetime.now().strftime('%Y_%m_%d-%I_%M_%S_%p') + '_' + reason + '.csv'
+        self.io_loop.call_soon(self.__startWrite, file_path, records, first, count, dump_time)
+        self.dumps.inc()
+        return file_path
+
+    def __startWrite(self, file_path, records, first, count, dump_time):
+        '''
+        DESCRIPTION: Function (run on the I/O loop) that writes a dump in a thread of the I/O loop's executor
+
+        ARGS: see __write()
+
+        RETURN: NONE
+        '''
+
+        self.io_loop.loop.run_in_executor(None, self.__write, file_path, records, first, count, dump_time)
+
+    def __write(self, file_path, records, first, count, dump_time):
+        '''
+        DESCRIPTION: Function that writes the records of a dump to a .csv file, with the times relative to the dump
+
+        ARGS: file_path (path of the .csv file), records (copy of the ring), first and count (numbers of the first
+        record and of the record after the last one in the copy), dump_time (time.perf_counter() of the dump)
+
+        RETURN: NONE
+        '''
+
+        try:
+            os.makedirs(self.logs_path, exist_ok=True)
+            with open(file_path, 'w', newline='') as f:
+                csv_writer = csv.writer(f)
+                csv_writer.writerow(['time', 'record', 'speed_des_mps', 'speed_act_mps', 'control_signal', 'encoder_count',
+                                        'loop_time', 'preset_speed_mps', 'flags', 'beam_tripped', 'version'])
+
+                for number in range(first, count):
+                    i = (number % self.capacity)*RECORD_SIZE
+                    record_time = records[i] - dump_time
+                    if record_time < -self.duration:
+                        continue
+
+                    if records[i + 1] == KIND_SAMPLE:
+                        csv_writer.writerow(['%.6f' % record_time, 'sample', records[i + 2], records[i + 3], records[i + 4],
+                                                int(records[i + 5]), records[i + 6], '', '', '', ''])
+                    else:
+                        flags = '|'.join(name for name, bit in STATE_FLAGS if int(records[i + 4]) & bit)
+                        beam_tripped = int(records[i + 5]) if records[i + 5] >= 0 else ''
+                        csv_writer.writerow(['%.6f' % record_time, 'state', records[i + 2], '', '', '', '', records[i + 3],
+                                                flags, beam_tripped, int(records[i + 6])])
+
+            self.io_loop.console_print("Flight recorder saved to %s" % file_path)
+        except OSError as e:
+            self.io_loop.console_print("Flight recorder could not be saved to %s (%s)" % (file_path, e))
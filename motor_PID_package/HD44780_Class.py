@@ -0,0 +1,210 @@
+'''
+ * @file    HD44780_Class.py
+ * @author  William Wang
+ * @brief   This script contains a class that writes to an
+            HD44780 LCD (i.e. the 1602a LCD module) in 4-bit
+            mode through the GPIO set/clear registers
+'''
+
+# import the required libraries
+import mmap
+import os
+import time
+
+# GPIO registers of the BCM2835/BCM2711 (RPi 4 and earlier) mapped by /dev/gpiomem: size of the GPIO block and
+# indexes of the GPSET0 and GPCLR0 registers (set/clear the outputs of the pins 0-31) in 32-bit words
+GPIO_BLOCK_SIZE = 0xB4
+GPSET0_INDEX = 0x1C//4
+GPCLR0_INDEX = 0x28//4
+
+# minimum timings of the HD44780 datasheet (ns): width of the enable pulse, cycle time of the enable pulse,
+# execution time of an instruction or a data write, and execution time of the clear and return home instructions
+ENABLE_PULSE_NS = 450
+ENABLE_CYCLE_NS = 1000
+EXEC_NS = 37000
+LONG_EXEC_NS = 1520000
+
+# instructions of the HD44780 (the long ones are clear display and return home)
+LCD_SETDDRAMADDR = 0x80
+LONG_INSTRUCTIONS = (0x01, 0x02, 0x03)
+
+# DDRAM address of the first column of each row
+ROW_OFFSETS = (0x00, 0x40, 0x14, 0x54)
+
+# a wait longer than this sleeps, a shorter wait spins (sec)
+SPIN_LIMIT = 0.0002
+
+class HD44780(object):
+    '''
+    DESCRIPTION: This class is a fast write path for an HD44780 LCD that has already been set up in 4-bit mode
+    (i.e. by the Adafruit character LCD class). Instead of setting each pin through digitalio with a 1 ms sleep
+    before every byte, each nibble is written with one write to the clear register and one to the set register
+    for RS and the data pins (then the enable pulse), and the datasheet timings are waited for only when the
+    next write would come too early. The class keeps a copy of the characters shown on the display, so only
+    the cells that change are written (the cursor is only moved when the changed cells are not next to each
+    other). The RW pin of the LCD must be tied to ground (the busy flag is never read).
+    NOTE: the registers are those of the BCM2835/BCM2711 (RPi 4 and earlier). Any object that accepts writes of
+    32-bit words by index (i.e. a simulator of the display) can be used instead of the mapping of /dev/gpiomem.
+
+    ARGS: rs, en, d4, d5, d6, d7 (pins of the LCD in BCM form), columns and rows (size of the LCD), registers
+    (32-bit GPIO registers written by index, the mapping of gpio_path if None), gpio_path (file mapped for
+    the registers)
+    '''
+
+    def __init__(self, rs, en, d4, d5, d6, d7, columns, rows, registers=None, gpio_path='/dev/gpiomem'):
+        # instantiation function for the HD44780 write path
+
+        self.columns = columns                  # size of the LCD
+        self.rows = rows
+
+        # map the GPIO registers (writes only)
+        if registers is None:
+            fd = os.open(gpio_path, os.O_RDWR | os.O_SYNC)
+            try:
+                self.gpio_map = mmap.mmap(fd, GPIO_BLOCK_SIZE)
+            finally:
+                os.close(fd)
+            registers = memoryview(self.gpio_map).cast('I')
+        self.registers = registers
+
+        # masks of the pins, and the set/clear masks of RS and the data pins for each nibble in each mode
+        # (index (char_mode << 4) | nibble)
+        self.en_mask = 1 << en
+        data_pins = (d4, d5, d6, d7)
+        all_mask = sum(1 << pin for pin in data_pins) | (1 << rs)
+        self.set_masks = []
+        self.clr_masks = []
+        for char_mode in (0, 1):
+            for nibble in range(16):
+                set_mask = sum(1 << pin for bit, pin in enumerate(data_pins) if nibble & (1 << bit))
+                set_mask = set_mask | ((1 << rs) if char_mode else 0)
+                self.set_masks.append(set_mask)
+                self.clr_masks.append((all_mask & ~set_mask) | self.en_mask)
+
+        self.enable_ns = 0                      # time.perf_counter_ns() of the last rising edge of the enable pin
+        self.ready_ns = 0                       # time.perf_counter_ns() the LCD can take the next byte
+
+        # copy of the characters on the display (the display has been cleared by its setup) and the address
+        # counter of the LCD (None when it is unknown, i.e. after a write to the CGRAM)
+        self.cells = [[' ']*columns for row in range(rows)]
+        self.address = 0
+
+    def __wait(self, until_ns):
+        '''
+        DESCRIPTION: Function that waits until a time (sleeps if the wait is long, spins otherwise)
+
+        ARGS: until_ns (time.perf_counter_ns() to wait for)
+
+        RETURN: NONE
+        '''
+
+        remaining = (until_ns - time.perf_counter_ns())*1e-9
+        if remaining > SPIN_LIMIT:
+            time.sleep(remaining - SPIN_LIMIT)
+        while time.perf_counter_ns() < until_ns:
+            pass
+
+    def __writeNibble(self, index):
+        '''
+        DESCRIPTION: Function that writes a nibble to the LCD (RS and the data pins in one clear and one set, then
+        the enable pulse)
+
+        ARGS: index (index of the set/clear masks, (char_mode << 4) | nibble)
+
+        RETURN: NONE
+        '''
+
+        registers = self.registers
+        registers[GPCLR0_INDEX] = self.clr_masks[index]
+        registers[GPSET0_INDEX] = self.set_masks[index]
+
+        # the enable pulses must be ENABLE_CYCLE_NS apart
+        if time.perf_counter_ns() - self.enable_ns < ENABLE_CYCLE_NS:
+            self.__wait(self.enable_ns + ENABLE_CYCLE_NS)
+        registers[GPSET0_INDEX] = self.en_mask
+        self.enable_ns = time.perf_counter_ns()
+
+        # the data is taken on the falling edge of a pulse of at least ENABLE_PULSE_NS
+        while time.perf_counter_ns() - self.enable_ns < ENABLE_PULSE_NS:
+            pass
+        registers[GPCLR0_INDEX] = self.en_mask
+
+    def write8(self, value, char_mode=False):
+        '''
+        DESCRIPTION: Function that writes a byte to the LCD (waits for the previous byte to be executed first)
+
+        ARGS: value (byte to write), char_mode (True for data, False for an instruction)
+
+        RETURN: NONE
+        '''
+
+        if time.perf_counter_ns() < self.ready_ns:
+            self.__wait(self.ready_ns)
+
+        mode = 16 if char_mode else 0
+        self.__writeNibble(mode | (value >> 4))
+        self.__writeNibble(mode | (value & 0x0F))
+
+        if not char_mode and value in LONG_INSTRUCTIONS:
+            self.ready_ns = time.perf_counter_ns() + LONG_EXEC_NS
+        else:
+            self.ready_ns = time.perf_counter_ns() + EXEC_NS
+
+        # the address counter is only followed for the writes of show() and clear()
+        self.address = None
+
+    def show(self, column, row, text):
+        '''
+        DESCRIPTION: Function that shows a message from a position of the display like the message of the
+        Adafruit class (a newline starts the next row at its first column), writing only the cells that change
+        NOTE: characters past the last column of a row are not shown
+
+        ARGS: column and row (position of the first character), text (message to show)
+
+        RETURN: NONE
+        '''
+
+        for line in text.split('\n'):
+            if row >= self.rows:
+                break
+            cells = self.cells[row]
+            for character in line[:max(0, self.columns - column)]:
+                if cells[column] != character:
+                    # move the cursor only if the cell does not follow the last one written
+                    address = ROW_OFFSETS[row] + column
+                    if self.address != address:
+                        self.write8(LCD_SETDDRAMADDR | address)
+                    self.write8(ord(character), char_mode=True)
+                    cells[column] = character
+                    self.address = address + 1
+                column = column + 1
+            row = row + 1
+            column = 0
+
+    def showScreen(self, text):
+        '''
+        DESCRIPTION: Function that shows a message on a clear display (the same as clear() and show() from the
+        first cell, but each cell is written at most once)
+
+        ARGS: text (message to show)
+
+        RETURN: NONE
+        '''
+
+        lines = text.split('\n')
+        for row in range(self.rows):
+            line = lines[row] if row < len(lines) else ''
+            self.show(0, row, line[:self.columns].ljust(self.columns))
+
+    def clear(self):
+        '''
+        DESCRIPTION: Function that clears the display (only the cells that are not blank are written)
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        blank = ' '*self.columns
+        for row in range(self.rows):
+            self.show(0, row, blank)
@@ -0,0 +1,91 @@
+'''
+ * @file    IO_Loop_Class.py
+ * @author  William Wang
+ * @brief   This script contains a class that runs a single
+            asyncio event loop thread for all the non-real-time
+            I/O of the treadmill (terminal input, LCD, console
+            and data logging)
+'''
+
+# import the required libraries
+import asyncio
+import threading
+
+class IOLoop(object):
+    '''
+    DESCRIPTION: This class runs an asyncio event loop on a single daemon thread. The terminal input
+    (UserInput), the LCD messages (LCD), the console prints and the data logging (DataLogger) all run
+    as tasks/timers on this loop instead of each owning a polling thread, which leaves fewer threads
+    competing with the encoder and the control loop for the GIL.
+    NOTE: the control loop never blocks on this loop; it hands data over with the thread-safe functions
+    below (call_soon(), run_task(), console_print())
+
+    ARGS: NONE
+    '''
+
+    def __init__(self):
+        # instantiation function for the I/O loop
+
+        self.loop = asyncio.new_event_loop()        # event loop that runs all the I/O tasks
+
+        # create and start the I/O thread
+        # NOTE: daemon thread so that the loop is killed with the main program
+        self.io_thread = threading.Thread(target=self.__ioThread, name='io_loop', daemon=True)
+        self.io_thread.start()
+
+    def __ioThread(self):
+        '''
+        DESCRIPTION: Function running in the I/O thread that runs the event loop forever
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def call_soon(self, callback, *args):
+        '''
+        DESCRIPTION: Function that schedules a callback to be run on the I/O loop (can be called from any thread)
+
+        ARGS: callback (function to be called on the I/O loop), args (arguments for the callback)
+
+        RETURN: NONE
+        '''
+
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def run_task(self, coro):
+        '''
+        DESCRIPTION: Function that starts a coroutine as a task on the I/O loop (can be called from any thread)
+
+        ARGS: coro (coroutine to be run on the I/O loop)
+
+        RETURN: future (concurrent.futures.Future that can be used to wait for the result of the coroutine)
+        '''
+
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def console_print(self, *args):
+        '''
+        DESCRIPTION: Function that prints a message to the terminal from the I/O loop, so that a slow terminal
+        (i.e. an SSH session) never blocks the thread that is printing
+
+        ARGS: args (objects to be printed, same as the built-in print())
+
+        RETURN: NONE
+        '''
+
+        self.loop.call_soon_threadsafe(self.__print, args)
+
+    def __print(self, args):
+        '''
+        DESCRIPTION: Function that runs on the I/O loop and prints the message for console_print()
+
+        ARGS: args (objects to be printed)
+
+        RETURN: NONE
+        '''
+
+        print(*args, flush=True)
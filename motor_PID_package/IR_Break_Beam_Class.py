@@ -3,27 +3,32 @@
  * @author  William Wang
  * @brief   This script entails a class that covers the 
             various functionalities of the Adafruit IR
-            break beam sensor
+            break beam sensor (on its own or as an array of
+            sensors)
 '''
 
 # import required libraries
-import RPi.GPIO as GPIO
 import threading
+import time
+import RPi.GPIO as GPIO
+import Metrics_Class
+from Tracer_Class import tracer
 
 class IRBreakBeam(object):
     '''
     DESCRIPTION: This class deals with setting up and operating the IR break beam sensor.
     It contains various functions that are/can be called if IR sensor is tripped or broken.
 
-    ARGS: beam_pin (the pin the IR sensor is connected to on the RPi)
+    ARGS: beam_pin (the pin the IR sensor is connected to on the RPi), state_store (StateStore object from
+    the State_Store_Class where a trip of the sensor is recorded)
     '''
 
-    def __init__(self, beam_pin=21):
+    def __init__(self, state_store, beam_pin=21):
         # Instantiation function for the IR Bream Beam object
 
         self.beam_pin = beam_pin        # store the pin the IR sensor is on
-        self.triggered = False          # variable that indicates whether the IR sensor has been triggered
-        self.beam_lock = threading.Lock()   # create a lock so that the main thread and the callback function aren't accessing the self.triggered pin at once
+        self.state_store = state_store  # StateStore object (the main loop reads beam_tripped from its snapshot)
+        self.trips = Metrics_Class.registry.counter('treadmill_beam_trips_total', 'Number of times the IR beam has been triggered', {'pin': beam_pin})
 
         # set up the RPi as BCM numbering
         GPIO.setmode(GPIO.BCM)
@@ -54,6 +59,143 @@ class IRBreakBeam(object):
 
         RETURN: NONE
         '''
-        with self.beam_lock:            # make sure main thread and callback thread aren't racing
-            self.triggered = True
+        # record the trip (only the first sensor to trip is kept, which is the one reported by the BeamFault)
+        self.state_store.modify(lambda state: {'beam_tripped': self.beam_pin} if state.beam_tripped is None else None)
+        self.trips.inc()
+        if tracer.enabled:
+            tracer.name_current_thread('RPi.GPIO callbacks')
+            tracer.instant('beam %d triggered' % self.beam_pin)
+        print("\nThe beam has been triggered!")
+
+class IRBreakBeamArray(object):
+    '''
+    DESCRIPTION: This class deals with setting up and operating any number of IR break beam sensors (i.e. around
+    the belt) as one. The callbacks of the sensors set a bit in a single bitmask of the tripped sensors (bit i for
+    beam_pins[i]) and record the time each sensor was first tripped, so the main loop checks all of the sensors
+    with one read of tripped_mask, however many sensors there are. A trip stays in the bitmask until reset() is
+    called at the start of a run, which also reads the pins once so that a beam that is already broken (i.e. open
+    loop, which has no falling edge) is tripped straight away. The pins are read again every level_period seconds
+    (check_levels()), since a beam broken again within the bouncetime of its last edge has no callback.
+
+    ARGS: state_store (StateStore object from the State_Store_Class where the first trip is recorded), beam_pins
+    (the pins the IR sensors are connected to on the RPi), level_period (time between the reads of the pins in sec)
+    '''
+
+    def __init__(self, state_store, beam_pins=(18, 23), level_period=0.1):
+        # Instantiation function for the IR break beam array object
+
+        self.beam_pins = tuple(beam_pins)               # store the pins the IR sensors are on
+        self.state_store = state_store                  # StateStore object (the first trip is recorded in beam_tripped)
+        self.bits = {pin: 1 << i for i, pin in enumerate(self.beam_pins)}    # bit of each sensor in the bitmask
+        self.tripped_mask = 0                           # bitmask of the sensors tripped since the last reset
+        self.trip_times = [0.0]*len(self.beam_pins)     # time.perf_counter() of the first trip of each sensor (0 if not tripped)
+        self.trip_lock = threading.Lock()               # only taken by the writers (the callbacks and reset), never by the main loop
+        self.level_period = level_period                # time between the reads of the pins (sec)
+        self.level_time = 0.0                           # time.perf_counter() of the next read of the pins
+        self.trips = {pin: Metrics_Class.registry.counter('treadmill_beam_trips_total', 'Number of times the IR beam has been triggered',
+                        {'pin': pin}) for pin in self.beam_pins}
+
+        # set up the RPi as BCM numbering
+        GPIO.setmode(GPIO.BCM)
+
+        for pin in self.beam_pins:
+            # change the pin to an input
+            GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+
+            # have the IR sensor operate as an interrupt function so that we don't miss any triggers
+            GPIO.add_event_detect(pin, GPIO.FALLING, callback = self.__beam_triggered, bouncetime = 100)
+
+    def reset(self):
+        '''
+        DESCRIPTION: Function that forgets the trips from before a run and trips the sensors whose beams are
+        already broken (called at the start of each run)
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        with self.trip_lock:
+            self.tripped_mask = 0
+            self.trip_times = [0.0]*len(self.beam_pins)
+
+        self.__readLevels()
+
+    def check_levels(self):
+        '''
+        DESCRIPTION: Function called by the control loop every iteration that reads the pins again once every
+        level_period seconds, and trips the sensors whose beams are broken (a beam that is broken again within the
+        bouncetime after it was restored has its falling edge debounced, so it has no callback)
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        if time.perf_counter() >= self.level_time:
+            self.__readLevels()
+
+    def __readLevels(self):
+        '''
+        DESCRIPTION: Function that reads the pins and trips the sensors whose beams are broken
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        self.level_time = time.perf_counter() + self.level_period
+
+        # a broken beam is set LOW
+        for pin in self.beam_pins:
+            if not GPIO.input(pin):
+                self.__trip(pin)
+
+    def first_tripped(self):
+        '''
+        DESCRIPTION: Function that finds the sensor that was tripped first since the last reset
+
+        ARGS: NONE
+
+        RETURN: pin (pin of the first sensor to trip, None if no sensor has been tripped)
+        '''
+
+        tripped_mask = self.tripped_mask
+        tripped = [(self.trip_times[i], pin) for i, pin in enumerate(self.beam_pins) if tripped_mask & (1 << i)]
+        return min(tripped)[1] if tripped else None
+
+    def __trip(self, pin):
+        '''
+        DESCRIPTION: Function that sets the bit of a sensor in the bitmask (the time is only kept for its first trip)
+
+        ARGS: pin (pin of the sensor that has been tripped)
+
+        RETURN: NONE
+        '''
+
+        bit = self.bits[pin]
+        with self.trip_lock:
+            if self.tripped_mask & bit:
+                return
+            # the time is written before the bit is published (the main loop only reads the times of set bits)
+            self.trip_times[self.beam_pins.index(pin)] = time.perf_counter()
+            self.tripped_mask = self.tripped_mask | bit
+
+        # record the trip (only the first sensor to trip is kept, which is the one reported by the BeamFault)
+        self.state_store.modify(lambda state: {'beam_tripped': pin} if state.beam_tripped is None else None)
+
+    def __beam_triggered(self, channel):
+        '''
+        DESCRIPTION: Callback function that triggers whenever one of the IR sensors trips with a falling signal
+
+        ARGS: channel (channel number for the IR sensor)
+
+        RETURN: NONE
+        '''
+
+        self.__trip(channel)
+        self.trips[channel].inc()
+        if tracer.enabled:
+            tracer.name_current_thread('RPi.GPIO callbacks')
+            tracer.instant('beam %d triggered' % channel)
         print("\nThe beam has been triggered!")
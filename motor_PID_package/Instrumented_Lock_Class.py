@@ -0,0 +1,155 @@
+'''
+ * @file    Instrumented_Lock_Class.py
+ * @author  William Wang
+ * @brief   This script contains a drop-in lock wrapper that
+            records how often the shared-state locks of the
+            treadmill are taken, how long threads wait for
+            them and how long they are held
+'''
+
+# import the required libraries
+import threading
+import time
+from Tracer_Class import tracer
+
+class LockStats(object):
+    '''
+    DESCRIPTION: This class keeps every instrumented lock and creates the summary of their statistics.
+    NOTE: the instrumentation is decided when a lock is created (see make_lock()), so "enabled" (and
+    the tracer) must be set before the objects that own the locks are created
+
+    ARGS: NONE
+    '''
+
+    def __init__(self):
+        # instantiation function for the lock statistics
+        self.enabled = False            # whether new locks are instrumented
+        self.locks = []                 # every instrumented lock that has been created
+
+    def summary(self):
+        '''
+        DESCRIPTION: Function that creates a table of the statistics of every instrumented lock
+
+        ARGS: NONE
+
+        RETURN: summary (multi-line string of the table, times in microseconds)
+        '''
+
+        lines = ["%-18s %10s %10s %12s %10s %12s %10s" % ("lock", "acquired", "contended",
+                    "wait total", "wait max", "hold total", "hold max")]
+        for lock in self.locks:
+            lines.append("%-18s %10d %10d %12.1f %10.1f %12.1f %10.1f" % (lock.name, lock.acquisitions,
+                            lock.contended, lock.wait_total/1000, lock.wait_max/1000,
+                            lock.hold_total/1000, lock.hold_max/1000))
+
+        return '\n'.join(lines)
+
+# shared statistics of the treadmill locks
+lock_stats = LockStats()
+
+class InstrumentedLock(object):
+    '''
+    DESCRIPTION: This class is a drop-in replacement for threading.Lock that counts the acquisitions and
+    measures the wait and hold times of the lock. Waits longer than tracer.lock_wait_threshold are also
+    recorded in the trace when the tracer is enabled.
+
+    ARGS: name (name of the lock in the statistics and the trace)
+    '''
+
+    def __init__(self, name):
+        # instantiation function for the instrumented lock
+        self.name = name
+        self.wait_name = 'wait ' + name         # name of the lock wait spans in the trace (created once)
+        self.lock = threading.Lock()
+
+        self.acquisitions = 0                   # number of times the lock has been acquired
+        self.contended = 0                      # number of times the lock was already held when acquiring it
+        self.wait_total = 0                     # total time spent waiting for the lock (ns)
+        self.wait_max = 0                       # longest wait for the lock (ns)
+        self.hold_total = 0                     # total time the lock has been held (ns)
+        self.hold_max = 0                       # longest time the lock has been held (ns)
+        self.acquired_at = 0                    # time the lock was last acquired (only one thread holds it at a time)
+
+        lock_stats.locks.append(self)
+
+    def acquire(self, blocking=True, timeout=-1):
+        '''
+        DESCRIPTION: Function that acquires the lock (same as threading.Lock.acquire())
+
+        ARGS: blocking, timeout (same as threading.Lock.acquire())
+
+        RETURN: True if the lock has been acquired
+        '''
+
+        # the uncontended case does not need to be timed
+        if self.lock.acquire(False):
+            self.acquired_at = time.perf_counter_ns()
+            self.acquisitions += 1
+            return True
+
+        if not blocking:
+            return False
+
+        # wait for the lock and record the wait
+        start = time.perf_counter_ns()
+        if not self.lock.acquire(True, timeout):
+            return False
+        stop = time.perf_counter_ns()
+        self.acquired_at = stop
+
+        wait = stop - start
+        self.acquisitions += 1
+        self.contended += 1
+        self.wait_total += wait
+        if wait > self.wait_max:
+            self.wait_max = wait
+        if tracer.enabled and wait >= tracer.lock_wait_threshold:
+            tracer.complete(self.wait_name, start, stop)
+
+        return True
+
+    def release(self):
+        '''
+        DESCRIPTION: Function that releases the lock and records how long it was held
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        hold = time.perf_counter_ns() - self.acquired_at
+        self.hold_total += hold
+        if hold > self.hold_max:
+            self.hold_max = hold
+        self.lock.release()
+
+    def locked(self):
+        '''
+        DESCRIPTION: Function that checks whether the lock is held
+
+        ARGS: NONE
+
+        RETURN: True if the lock is held
+        '''
+        return self.lock.locked()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+def make_lock(name):
+    '''
+    DESCRIPTION: Function that creates the lock for shared state of the treadmill. When neither the lock
+    statistics nor the tracer are enabled, this is a plain threading.Lock, so the instrumentation costs
+    nothing unless it has been asked for.
+
+    ARGS: name (name of the lock in the statistics and the trace)
+
+    RETURN: lock (InstrumentedLock or threading.Lock object)
+    '''
+
+    if lock_stats.enabled or tracer.enabled:
+        return InstrumentedLock(name)
+    return threading.Lock()
@@ -11,6 +11,12 @@
 import RPi.GPIO as GPIO
 from math import pi
 
+# quadrature transition table for the knob, indexed by (previous state << 2) | current state where the state
+# is (clk << 1) | dt. +1 is a quarter step in the increasing direction (dt falls first), -1 is a quarter step in
+# the decreasing direction (clk falls first), and 0 is no movement or an invalid transition (both lines changed,
+# which can only be noise or a missed edge)
+KNOB_TRANSITIONS = (0, 1, -1, 0, -1, 0, 0, 1, 1, 0, 0, -1, 0, -1, 1, 0)
+
 class Knob(object):
     '''
     DESCRIPTION: This class deals with setting up the rotary encoder, which is used
@@ -18,20 +24,47 @@ class Knob(object):
     to ensure continuity between the speed dictated by this encoder and the
     speed dictated by the user inputs from the terminal, it is necessary to
     pass in a UserInput object.
+    The knob is decoded with a quadrature state machine (both lines on both edges, no RPi.GPIO
+    bouncetime): contact bounce shows up as quarter steps that cancel out, and a detent is only
+    counted once the knob returns to its rest state. The step size is scaled with the rotation rate
+    (turning fast moves the speed further per detent), and a burst of detents is coalesced into a
+    single update of the desired speed.
     ARGS: user_input (object from User_Input_Class.py), lcd (LCD pin on encoder),
-    clk (clock pin on encoder), dt (direction pin on encoder), sw (switch pin on encoder)
+    clk (clock pin on encoder), dt (direction pin on encoder), sw (switch pin on encoder),
+    callback_worker (CallbackWorker object from Callback_Worker_Class.py), persistent_state (PersistentState
+    object from Persistent_State_Class.py that keeps the step size between restarts, or None)
     '''
 
-    def __init__(self, user_input, lcd, clk=18, dt=25, sw=20):
+    def __init__(self, user_input, lcd, callback_worker, clk=18, dt=25, sw=20, persistent_state=None):
         # instantiation function for the rotary encoder
         
         self.user_input = user_input        # receive UserInput object (access the speed_des variable)
         self.lcd = lcd                      # receive LCD object (to be able to print to the LCD)
+        self.callback_worker = callback_worker  # receive CallbackWorker object (handles the knob events outside of the GPIO thread)
         self.clk = clk                      # pin for the clock
         self.dt = dt                        # pin for the direction
         self.sw = sw                        # pin for the push button switch
+        self.persistent_state = persistent_state    # receive PersistentState object (saves the step size)
         self.step_size = 0.1                # setup default step size for the encoder (0.1 m/s)
-        self.button_pressed = False         # default state for the button is false
+
+        # use the step size from before the last restart
+        if persistent_state is not None:
+            self.step_size = persistent_state.get('knob_step_size')
+        self.button_pressed = (self.step_size == 0.01)  # the button selects the 0.01 m/s step size
+
+        # variables for the quadrature decoder
+        self.quarter_steps = 0              # quarter steps counted since the knob was last at rest
+        self.detent_time = 0                # time of the last counted detent (used for debouncing and acceleration)
+        self.debounce_time = 0.002          # detents closer together than this (sec) are treated as contact chatter
+
+        # variables for the acceleration of the step size
+        self.accel_min_rate = 8             # rotation rate (detents/sec) below which the step size is not scaled
+        self.accel_max_rate = 40            # rotation rate (detents/sec) at which the maximum scaling is reached
+        self.accel_max_mult = 10            # maximum multiplier applied to the step size
+
+        # variables used to coalesce a burst of detents into one update of the desired speed
+        self.pending_delta = 0              # change in speed (m/s) that has not been applied yet
+        self.update_pending = False         # whether an update of the desired speed has been posted to the worker
 
         # set the GPIO mode
         GPIO.setmode(GPIO.BCM)
@@ -41,57 +74,111 @@ class Knob(object):
         GPIO.setup(dt, GPIO.IN)
         GPIO.setup(sw, GPIO.IN, pull_up_down=GPIO.PUD_UP)
 
-        #set up the interrupts for each pin
-        GPIO.add_event_detect(clk, GPIO.FALLING, callback=self.__clkClicked, bouncetime=100)
-        GPIO.add_event_detect(dt, GPIO.FALLING, callback=self.__dtClicked, bouncetime=100)
-        GPIO.add_event_detect(sw, GPIO.FALLING, callback=self.__swClicked, bouncetime=300)
+        # obtain the starting state of the knob
+        self.knob_state = (GPIO.input(clk) << 1) | GPIO.input(dt)
+
+        #set up the interrupts for each pin (debouncing is done by the decoder, not by RPi.GPIO)
+        GPIO.add_event_detect(clk, GPIO.BOTH, callback=self.__knobCapture)
+        GPIO.add_event_detect(dt, GPIO.BOTH, callback=self.__knobCapture)
+        GPIO.add_event_detect(sw, GPIO.FALLING, callback=callback_worker.deferred(self.__swClicked), bouncetime=300)
 
-    def __clkClicked(self, channel):
+    def __knobCapture(self, channel):
         '''
-        DESCRIPTION: Callback function to be called whenever the clk pin is triggered with a falling signal.
-        ARGS: channel (pin number for the clk pin)
+        DESCRIPTION: Callback function to be called whenever the clk or dt pin changes state.
+        This function only captures the pin states and passes them to the callback worker.
+        ARGS: channel (pin number for the clk or dt pin)
         RETURN: NONE
         '''
 
-        # obtain the current states of both clk and dt
-        clkState = GPIO.input(self.clk)
-        dtState = GPIO.input(self.dt)
-
-        # update the desired speed if we meet the following states
-        if clkState == 0 and dtState == 1:
-            with self.user_input.speed_des_lock:         # access with lock to prevent racing with main loop
-                if ((self.user_input.speed_des_mps - self.step_size) < -1.5001):    # set lower limit/warning to lcd
-                    msg = "Exceeding lower\nlim of -1.5 m/s"
-                    self.lcd.sendtoLCDThread(target="knob", msg=msg, duration=2, clr_before=True, clr_after=True)
-                else:
-                    self.user_input.speed_des_mps = self.user_input.speed_des_mps - self.step_size      # speed in m/s
-                    self.user_input.speed_des_RPM = self.user_input.speed_des_mps*(60/pi)/(2/39.3701)   # convert to RPM
-
-    def __dtClicked(self, channel):
+        # obtain the current states of both clk and dt (these need to be read at the time of the edge)
+        self.callback_worker.post(self.__knobChanged, GPIO.input(self.clk), GPIO.input(self.dt))
+
+    def __knobChanged(self, timestamp, clkState, dtState):
         '''
-        DESCRIPTION: Callback function to be called when the dt pin is triggered with a falling signal
-        ARGS: channel (pin number for the dt pin)
+        DESCRIPTION: Function (run on the callback worker) that steps the quadrature decoder with the captured
+        pin states and counts a detent whenever the knob returns to its rest state (both lines HIGH)
+        ARGS: timestamp (time the edge was captured), clkState/dtState (pin states captured at the edge)
         RETURN: NONE
         '''
 
-        # check the states of the clk and dt pins
-        clkState = GPIO.input(self.clk)
-        dtState = GPIO.input(self.dt)
-
-        # update the desired speed if we meet the following states for the pins
-        if clkState == 1 and dtState == 0:
-            with self.user_input.speed_des_lock:        # access with lock to prevent racing on speed_des variables
-                if ((self.user_input.speed_des_mps + self.step_size) > 1.5001):       # set upper limit/warning to lcd
-                    msg = "Exceeding upper\nlim of 1.5 m/s"
-                    self.lcd.sendtoLCDThread(target="knob", msg=msg, duration=2, clr_before=True, clr_after=True)
-                else:
-                    self.user_input.speed_des_mps = self.user_input.speed_des_mps + self.step_size              # speed in m/s
-                    self.user_input.speed_des_RPM = self.user_input.speed_des_mps*(60/pi)/(2/39.3701)   # convert to RPM
-
-    def __swClicked(self, channel):
+        # step the state machine (repeated or invalid states do not move the count)
+        state = (clkState << 1) | dtState
+        self.quarter_steps += KNOB_TRANSITIONS[(self.knob_state << 2) | state]
+        self.knob_state = state
+
+        # only count a detent when the knob is back at rest
+        if state != 3:
+            return
+
+        # a detent needs at least half a cycle in one direction (bounces cancel each other out)
+        if self.quarter_steps >= 2:
+            direction = 1
+        elif self.quarter_steps <= -2:
+            direction = -1
+        else:
+            direction = 0
+        self.quarter_steps = 0
+
+        # ignore a detent that is too close to the previous one to be a real click
+        interval = timestamp - self.detent_time
+        if direction == 0 or interval < self.debounce_time:
+            return
+        self.detent_time = timestamp
+
+        # scale the step size with the rotation rate
+        rate = 1/interval
+        scale = (rate - self.accel_min_rate)/(self.accel_max_rate - self.accel_min_rate)
+        scale = min(max(scale, 0), 1)
+        mult = round(1 + (self.accel_max_mult - 1)*scale)
+
+        # add the change to the pending update and make sure an update is posted to the worker
+        # NOTE: the update is queued behind any edges the worker has not handled yet, so a burst of
+        #       detents is applied to the desired speed in one go
+        self.pending_delta = self.pending_delta + direction*mult*self.step_size
+        if not self.update_pending:
+            self.update_pending = True
+            self.callback_worker.post(self.__applyPendingDelta)
+
+    def __applyPendingDelta(self, timestamp):
+        '''
+        DESCRIPTION: Function (run on the callback worker) that applies the change in speed accumulated from
+        a burst of detents to the desired speed (limited to the range of [-1.5, 1.5] m/s)
+        ARGS: timestamp (time the update was posted)
+        RETURN: NONE
+        '''
+
+        # obtain the pending change in speed
+        delta = self.pending_delta
+        self.pending_delta = 0
+        self.update_pending = False
+
+        # update the desired speed (rounded to avoid accumulating floating point error from the steps)
+        # NOTE: done as one read-modify-write of the StateStore so that a terminal input or button press
+        #       cannot be lost between reading and writing the desired speed
+        msg = None
+
+        def step(state):
+            nonlocal msg
+            speed = round(state.speed_des_mps + delta, 2)
+            if speed < -1.5:                        # set lower limit/warning to lcd
+                speed = -1.5
+                msg = "Exceeding lower\nlim of -1.5 m/s"
+            elif speed > 1.5:                       # set upper limit/warning to lcd
+                speed = 1.5
+                msg = "Exceeding upper\nlim of 1.5 m/s"
+            return {'speed_des_mps': speed,                                 # speed in m/s
+                    'speed_des_RPM': speed*(60/pi)/(2/39.3701)}             # convert to RPM
+
+        self.user_input.state_store.modify(step)
+
+        # warn the user if the speed has been limited
+        if msg is not None:
+            self.lcd.sendtoLCDThread(target="knob", msg=msg, duration=2, clr_before=True, clr_after=True)
+
+    def __swClicked(self, timestamp, channel):
         '''
-        DESCRIPTION: Callback function that is called whenever the switch is pressed (used to update the increment size)
-        ARGS: channel (pin number for the sw pin)
+        DESCRIPTION: Function (run on the callback worker) that is called whenever the switch is pressed (used to update the increment size)
+        ARGS: timestamp (time the press was captured), channel (pin number for the sw pin)
         RETURN: NONE
         '''
 
@@ -108,4 +195,7 @@ class Knob(object):
             self.step_size = 0.1
             msg = "Curr step size:\n0.1 m/s"
             self.lcd.sendtoLCDThread(target="knob", msg=msg, duration=2, clr_before=True, clr_after=True)
-            
+
+        # save the step size for the next restart
+        if self.persistent_state is not None:
+            self.persistent_state.set(knob_step_size=self.step_size)
@@ -6,10 +6,12 @@
 '''
 
 # import required libraries
-import queue
+import asyncio
+import collections
 import time
-import threading
 import adafruit_character_lcd.character_lcd as characterlcd
+import Metrics_Class
+from Tracer_Class import tracer
 
 class LCD(characterlcd.Character_LCD_Mono):
     '''
@@ -18,35 +20,167 @@ class LCD(characterlcd.Character_LCD_Mono):
     class, so all dependencies related to that class must be installed.
     One of the major purposes of inheriting this class is the ability to 
     allow for asychronous printing to the LCD module from various threads.
+    The messages are printed by a task on the IOLoop, and the durations of the
+    messages are timed with the loop's timers (no polling thread).
+    The live speeds from the main loop are not queued: the main loop only replaces
+    the latest line for each row (see updateLiveLine()), which is printed once the
+    queued messages have been printed.
+    With fast_pins, the LCD is set up by the parent class and then written through
+    the GPIO set/clear registers by an HD44780 object (HD44780_Class), which only
+    writes the cells that change (clear(), cursor_position(), message and
+    create_char() keep the behaviour of the parent class). Custom characters
+    can be used through customChar(), which keeps the 8 CGRAM locations as a cache.
     
     ARGS: cd_rs, lcd_en, lcd_d4 lcd_d5, lcd_d6, lcd_d7, lcd_columns, lcd_rows
-    (various pins required for the LCD module)
+    (various pins required for the LCD module), io_loop (IOLoop object from the IO_Loop_Class),
+    fast_pins (BCM numbers of the rs, en, d4, d5, d6 and d7 pins for the fast write path, the
+    digitalio pins of the parent class are used if None)
     '''
 
     # initialization function for the LCD class
     def __init__(self, cd_rs, lcd_en, lcd_d4, lcd_d5, lcd_d6,
-                    lcd_d7, lcd_columns, lcd_rows):
-        
+                    lcd_d7, lcd_columns, lcd_rows, io_loop, fast_pins=None):
+
+        self.hd44780 = None                 # HD44780 object of the fast write path (created once the LCD is set up)
+
         # initialize the LCD pins using the original parent class
         super().__init__(rs=cd_rs, en=lcd_en, db4=lcd_d4, db5=lcd_d5,
                             db6=lcd_d6, db7=lcd_d7, columns=lcd_columns, lines=lcd_rows)
 
+        # write through the GPIO registers from now on
+        if fast_pins is not None:
+            from HD44780_Class import HD44780
+            self.hd44780 = HD44780(*fast_pins, columns=lcd_columns, rows=lcd_rows)
+
+        # patterns of the custom characters in the CGRAM locations, least recently used first
+        self.custom_chars = collections.OrderedDict()
+
+        self.io_loop = io_loop              # store the IOLoop object (the LCD task runs on this loop)
+
         # create two queues (one for the main loop, one for the rotary encoder)
-        self.main_q = queue.Queue(maxsize=0)        # infinite queue size
-        self.knob_q = queue.Queue(maxsize=2)        # put a limit on the knob queue (prevent repetitive msgs)
+        # NOTE: these queues are only accessed from the I/O loop, so they do not need to be thread-safe
+        self.main_q = collections.deque()   # infinite queue size
+        self.knob_q = collections.deque()   # put a limit on the knob queue (prevent repetitive msgs)
+        self.knob_q_size = 2                # maximum number of messages in the knob queue
+
+        # counters for the messages printed/dropped
+        self.msgs_printed = Metrics_Class.registry.counter('treadmill_lcd_messages_total', 'Number of messages printed to the LCD')
+        self.knob_msgs_dropped = Metrics_Class.registry.counter('treadmill_lcd_knob_dropped_total', 'Number of knob messages dropped because the knob queue was full')
+
+        # event used to wake the LCD task up when a message arrives (created on the I/O loop by the task)
+        self.msg_ready = None
+
+        # latest live line for each row from the main loop, and the live line currently shown on each row
+        # (None once a queued message has been printed over it)
+        self.live_lines = [None]*lcd_rows
+        self.live_printed = [None]*lcd_rows
+        self.live_pending = False           # whether the LCD task has been woken up to print the live lines
 
         # create two lists to receive items from the above queues
         self.main_item = []
         self.knob_item = []
 
-        # create and start the lcd thread
-        self.lcd_thread = threading.Thread(target=self.__lcdThread, daemon=True)
-        self.lcd_thread.start()
+        # start the lcd task on the I/O loop
+        self.io_loop.run_task(self.__lcdTask())
+
+    def clear(self):
+        '''
+        DESCRIPTION: Function that clears the LCD (only the cells that are not blank are written with the fast
+        write path)
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        if self.hd44780 is None:
+            super().clear()
+            return
+        self.hd44780.clear()
+
+    def cursor_position(self, column, row):
+        '''
+        DESCRIPTION: Function that sets the position of the next message (the fast write path only moves the
+        cursor of the LCD when a cell changes)
+
+        ARGS: column, row (position of the first character of the next message)
+
+        RETURN: NONE
+        '''
+
+        if self.hd44780 is None:
+            super().cursor_position(column, row)
+            return
+        self.row = min(row, self.lines - 1)
+        self.column = min(column, self.columns - 1)
+
+    @property
+    def message(self):
+        '''
+        DESCRIPTION: Property that returns the last message shown on the LCD
+        '''
+
+        return self._message
+
+    @message.setter
+    def message(self, message):
+        '''
+        DESCRIPTION: Property setter that shows a message from the position set by cursor_position() (the
+        position is reset to (0, 0) afterwards)
+        '''
+
+        if self.hd44780 is None:
+            characterlcd.Character_LCD_Mono.message.fset(self, message)
+            return
+        self._message = message
+        self.hd44780.show(self.column, self.row, message)
+        self.column, self.row = 0, 0
+
+    def _write8(self, value, char_mode=False):
+        '''
+        DESCRIPTION: Function that writes a byte to the LCD (used by the other functions of the parent class)
+
+        ARGS: value (byte to write), char_mode (True for data, False for an instruction)
+
+        RETURN: NONE
+        '''
+
+        if self.hd44780 is None:
+            super()._write8(value, char_mode)
+            return
+        self.hd44780.write8(value, char_mode)
+
+    def customChar(self, pattern):
+        '''
+        DESCRIPTION: Function that returns the character to put in a message for a custom character, loading it
+        into the least recently used CGRAM location if it is not already in one
+        NOTE: the LCD has 8 CGRAM locations, a location that is reloaded also changes the characters already
+        shown from it
+
+        ARGS: pattern (8 rows of 5 bits of the character)
+
+        RETURN: character (string of the character of its CGRAM location)
+        '''
+
+        pattern = tuple(pattern)
+        location = self.custom_chars.get(pattern)
+        if location is not None:
+            self.custom_chars.move_to_end(pattern)
+            return chr(location)
+
+        # take a free location or the least recently used one
+        if len(self.custom_chars) < 8:
+            location = len(self.custom_chars)
+        else:
+            location = self.custom_chars.popitem(last=False)[1]
+        self.create_char(location, pattern)
+        self.custom_chars[pattern] = location
+        return chr(location)
 
-    def __lcdThread(self):
+    async def __lcdTask(self):
         '''
-        DESCRIPTION: Function that runs the main thread for printing statements to the lcd module.
-        Note that this thread will place priority on the messages sent from the Knob class because
+        DESCRIPTION: Coroutine that runs the main task for printing statements to the lcd module.
+        Note that this task will place priority on the messages sent from the Knob class because
         the users need to know what speeds they are changing the motors to.
 
         ARGS: NONE
@@ -54,24 +188,33 @@ class LCD(characterlcd.Character_LCD_Mono):
         RETURN: NONE
         '''
 
-        # always running this separate thread waiting for messages from the main loop and knob loop
+        # create the wake up event on the I/O loop
+        self.msg_ready = asyncio.Event()
+
+        # always running this task waiting for messages from the main loop and knob loop
         while True:
             # first try the knob queue because this queue has priority messages
-            try:
-                self.knob_item = self.knob_q.get_nowait()   # obtain message from knob queue
-                self.printfromLCDThread(item = self.knob_item)
-            except queue.Empty:
-                # only after the knob queue is completely empty do we print from the main loop
-                try:
-                    self.main_item = self.main_q.get_nowait()
-                    self.printfromLCDThread(item = self.main_item)
-                except queue.Empty:
-                    # NOTE: it is very important to have this delay here or else this thread runs too fast
-                    time.sleep(0.001)
+            if self.knob_q:
+                self.knob_item = self.knob_q.popleft()      # obtain message from knob queue
+                await self.printfromLCDThread(item = self.knob_item)
+                self.__forgetLiveLines()
+            # only after the knob queue is completely empty do we print from the main loop
+            elif self.main_q:
+                self.main_item = self.main_q.popleft()
+                await self.printfromLCDThread(item = self.main_item)
+                self.__forgetLiveLines()
+            # the live lines have the lowest priority (they are reprinted every iteration of the main loop anyway)
+            elif self.live_pending:
+                self.live_pending = False
+                self.__printLiveLines()
+            else:
+                # wait until a new message has been sent (no polling)
+                self.msg_ready.clear()
+                await self.msg_ready.wait()
 
     def sendtoLCDThread(self, target, msg, duration, clr_before, clr_after):
         '''
-        DESCRIPTION: Function that puts a message into the lcd queue
+        DESCRIPTION: Function that puts a message into the lcd queue (can be called from any thread)
         NOTE: this function requires the user to input extra parameters such as
         the desired duration of the message and whether to clear the screen
         before/after the message
@@ -86,20 +229,101 @@ class LCD(characterlcd.Character_LCD_Mono):
         # create a list to send over to the queue
         item = [msg, duration, clr_before, clr_after]
 
+        # hand the item over to the I/O loop
+        self.io_loop.call_soon(self.__queueItem, target, item)
+
+    def updateLiveLine(self, row, msg):
+        '''
+        DESCRIPTION: Function called from the main loop that replaces the live line printed on a row of the LCD
+        (i.e. the desired and actual speeds). Unlike sendtoLCDThread(), this does not create or queue a new item,
+        the LCD task is only woken up if it has printed the previous live lines.
+
+        ARGS: row (row of the LCD to print the line on), msg (line to be printed, without any newlines)
+
+        RETURN: NONE
+        '''
+
+        self.live_lines[row] = msg
+
+        # wake the LCD task up if it is not already going to print the live lines
+        if not self.live_pending:
+            self.live_pending = True
+            self.io_loop.call_soon(self.__wakeTask)
+
+    def __wakeTask(self):
+        '''
+        DESCRIPTION: Function that runs on the I/O loop and wakes the LCD task up
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        if self.msg_ready is not None:
+            self.msg_ready.set()
+
+    def __printLiveLines(self):
+        '''
+        DESCRIPTION: Function (run on the I/O loop) that prints the latest live line of every row (rows that
+        already show their latest line are not written again)
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        start = time.perf_counter_ns()          # start time of the write (for the trace)
+
+        for row in range(len(self.live_lines)):
+            msg = self.live_lines[row]
+            if msg is not None and msg is not self.live_printed[row]:
+                self.cursor_position(0, row)
+                self.message = msg
+                self.live_printed[row] = msg
+                self.msgs_printed.inc()
+
+        if tracer.enabled:
+            tracer.complete('lcd write', start, time.perf_counter_ns())
+
+    def __forgetLiveLines(self):
+        '''
+        DESCRIPTION: Function (run on the I/O loop) that marks the live lines as no longer shown (after a queued
+        message has been printed over them), so that they are printed again
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        for row in range(len(self.live_printed)):
+            self.live_printed[row] = None
+
+    def __queueItem(self, target, item):
+        '''
+        DESCRIPTION: Function that runs on the I/O loop and places an item on the correct queue
+
+        ARGS: target ("main" or "knob"), item (a list containing the following -- [msg, duration, clr_before, clr_after])
+
+        RETURN: NONE
+        '''
+
         # determine which queue to send the message to and send the item
         if (target == "main"):
-            self.main_q.put_nowait(item)
+            self.main_q.append(item)
         elif (target == "knob"):
-            try:
-                # try to put message on knob queue
-                self.knob_q.put_nowait(item)
-            except queue.Full:
-                # if knob queue is full, ignore any further messages (likely repetitive)
-                pass
+            # if knob queue is full, ignore any further messages (likely repetitive)
+            if len(self.knob_q) >= self.knob_q_size:
+                self.knob_msgs_dropped.inc()
+                return
+            self.knob_q.append(item)
+
+        # wake the LCD task up (if it has started, otherwise it checks the queues once it starts)
+        if self.msg_ready is not None:
+            self.msg_ready.set()
  
-    def printfromLCDThread(self, item):
+    async def printfromLCDThread(self, item):
         '''
-        DESCRIPTION: Function that retrieves a message from the queue and prints the message
+        DESCRIPTION: Coroutine that prints a message retrieved from the queue
         NOTE: this function requires the duration of the print and whether to clear the print
         statement before and after the message
 
@@ -113,16 +337,25 @@ class LCD(characterlcd.Character_LCD_Mono):
         clr_before = item[2]
         clr_after = item[3]
 
-        # check to see if the screen needs to be cleared
-        if clr_before == True:
+        start = time.perf_counter_ns()          # start time of the write (for the trace)
+
+        # check to see if the screen needs to be cleared, and put the message onto the lcd monitor
+        # NOTE: the fast write path shows the message on a clear screen in one go (each cell is written at most once)
+        if clr_before == True and self.hd44780 is not None:
+            self.hd44780.showScreen(msg)
+            self._message = msg
+        elif clr_before == True:
             self.clear()
+            self.message = msg
         else:
-            pass
+            self.message = msg
 
-        # put the message onto the lcd monitor for the desired duration
-        self.message = msg
+        # keep the message for the desired duration (timed by the loop, other I/O keeps running)
+        self.msgs_printed.inc()
+        if tracer.enabled:
+            tracer.complete('lcd write', start, time.perf_counter_ns())
         if not duration == 0:
-            time.sleep(duration)
+            await asyncio.sleep(duration)
         else:
             pass
 
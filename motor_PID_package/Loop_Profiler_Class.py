@@ -0,0 +1,120 @@
+'''
+ * @file    Loop_Profiler_Class.py
+ * @author  William Wang
+ * @brief   This script contains a class that profiles the
+            individual stages of the main control loop
+'''
+
+# import the required libraries
+import time
+from array import array
+
+class LoopProfiler(object):
+    '''
+    DESCRIPTION: This class timestamps each stage of the main loop with time.perf_counter_ns() into a
+    preallocated buffer that keeps the last "capacity" iterations. The time of each stage is the time
+    since the previous mark in the same iteration, and the summary reports the percentiles of every
+    stage so it is clear where the loop budget goes.
+    NOTE: when the profiler is disabled, start() and mark() return immediately
+
+    ARGS: stage_names (names of the stages in the order they are marked), capacity (number of iterations
+    kept in the buffer), enabled (True to record the timestamps)
+    '''
+
+    def __init__(self, stage_names, capacity=10000, enabled=False):
+        # instantiation function for the profiler
+
+        self.stage_names = tuple(stage_names)           # names of the stages
+        self.stride = len(self.stage_names) + 1         # values per iteration (start time and one mark per stage)
+        self.capacity = capacity                        # number of iterations kept in the buffer
+        self.enabled = enabled                          # whether the profiler records anything
+
+        # preallocated buffer of the timestamps (ns) and an empty row used to reset a row without allocating
+        self.times = array('q', bytes(8*self.stride*capacity))
+        self.empty_row = array('q', bytes(8*self.stride))
+        self.iterations = 0                             # number of iterations started
+        self.row = 0                                    # index of the current row in the buffer
+
+    def start(self):
+        '''
+        DESCRIPTION: Function that starts a new iteration (called at the top of the loop)
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        if not self.enabled:
+            return
+
+        # reset the row so that stages which are skipped in this iteration are not counted
+        row = (self.iterations % self.capacity)*self.stride
+        self.times[row:row + self.stride] = self.empty_row
+        self.times[row] = time.perf_counter_ns()
+        self.row = row
+        self.iterations += 1
+
+    def mark(self, stage):
+        '''
+        DESCRIPTION: Function that marks the end of a stage in the current iteration
+
+        ARGS: stage (index of the stage in stage_names)
+
+        RETURN: NONE
+        '''
+
+        if not self.enabled:
+            return
+
+        self.times[self.row + 1 + stage] = time.perf_counter_ns()
+
+    def stage_durations(self):
+        '''
+        DESCRIPTION: Function that calculates the duration of every stage in the iterations kept in the buffer
+
+        ARGS: NONE
+
+        RETURN: durations (dictionary of stage name -> list of durations in ns, plus 'total' for the whole
+        iteration up to the last mark)
+        '''
+
+        durations = {name: [] for name in self.stage_names + ('total',)}
+
+        # do not include the current iteration (it may not be complete)
+        count = min(self.iterations, self.capacity) - 1
+        first = self.iterations - 1 - count
+
+        for iteration in range(first, first + count):
+            row = (iteration % self.capacity)*self.stride
+            prev = self.times[row]
+            for stage, name in enumerate(self.stage_names):
+                stamp = self.times[row + 1 + stage]
+                if stamp:
+                    durations[name].append(stamp - prev)
+                    prev = stamp
+            durations['total'].append(prev - self.times[row])
+
+        return durations
+
+    def summary(self):
+        '''
+        DESCRIPTION: Function that creates a table of the percentiles of every stage
+
+        ARGS: NONE
+
+        RETURN: summary (multi-line string of the table, in microseconds)
+        '''
+
+        if self.iterations < 2:
+            return "Loop profiler: no complete iterations recorded"
+
+        lines = ["%-12s %8s %9s %9s %9s %9s" % ("stage (us)", "count", "p50", "p90", "p99", "max")]
+        for name, values in self.stage_durations().items():
+            if not values:
+                continue
+            values.sort()
+            n = len(values)
+            lines.append("%-12s %8d %9.1f %9.1f %9.1f %9.1f" % (name, n, values[n//2]/1000,
+                            values[int(n*0.9)]/1000, values[int(n*0.99)]/1000, values[-1]/1000))
+
+        return '\n'.join(lines)
@@ -0,0 +1,118 @@
+'''
+ * @file    Main_Loop_Class.py
+ * @author  William Wang
+ * @brief   This script contains a class that runs the part
+            of an iteration of the main loop after the
+            safety checks (the motor, LCD and publishing)
+'''
+
+# import the required libraries
+import time
+
+# stages of the main loop timed by the profiler (python main.py --profile)
+PROFILE_STAGES = ('fault', 'state', 'stopped', 'beams', 'motor', 'format', 'lcd', 'publish')
+(STAGE_FAULT, STAGE_STATE, STAGE_STOPPED, STAGE_BEAMS,
+    STAGE_MOTOR, STAGE_FORMAT, STAGE_LCD, STAGE_PUBLISH) = range(len(PROFILE_STAGES))
+
+class MainLoopIteration(object):
+    '''
+    DESCRIPTION: This class runs the part of an iteration of the main loop of main.py that follows the safety
+    checks: the motor is kept at the desired speed (maintain(), unless the main loop has just ramped it), the
+    desired speed is shown on the LCD and the sample is published to the control server, the telemetry stream,
+    the loop time histogram and the flight recorder (publish()). The values carried from one iteration to the
+    next (the start time of the iteration and the line of the LCD) are kept in the object.
+    NOTE: Hardware_Testing_Scripts/loop_allocation_test.py runs maintain() to check that the steady-state
+    iteration does not allocate any memory that it keeps, so it must stay the path of the main loop
+
+    ARGS: motor_control (MotorPID or MotorChannels object), lcd (LCD object), control_server (ControlServer
+    object), telemetry (TelemetryPublisher object), recorder (FlightRecorder object), loop_time (histogram of the
+    iteration times), profiler (LoopProfiler object with the PROFILE_STAGES), loop_start_time
+    (time.perf_counter() the samples are time stamped from)
+    '''
+
+    def __init__(self, motor_control, lcd, control_server, telemetry, recorder, loop_time, profiler, loop_start_time):
+        # instantiation function for the iteration of the main loop
+
+        self.motor_control = motor_control          # controller of the motor
+        self.lcd = lcd                              # LCD object (the desired speed is shown on the first line)
+        self.control_server = control_server        # control server (latest sample)
+        self.telemetry = telemetry                  # telemetry stream
+        self.recorder = recorder                    # flight recorder
+        self.loop_time = loop_time                  # histogram of the iteration times
+        self.profiler = profiler                    # profiler of the stages of the main loop
+        self.loop_start_time = loop_start_time      # start time of the main loop (sec)
+        self.iter_start_time = loop_start_time      # start time of the current iteration (sec)
+        self.line_1 = None                          # line of the desired speed for the LCD
+        self.line_1_speed = None                    # desired speed shown by line_1 (only formatted again when it changes)
+        self.des_spd_mps = 0                        # desired and measured speeds of the last iteration (m/s)
+        self.curr_spd_mps = 0
+
+    def reset(self, start_time):
+        '''
+        DESCRIPTION: Function called at the start of each run that starts timing the iterations and formats the
+        line of the LCD again (the LCD has been cleared)
+
+        ARGS: start_time (time.perf_counter() the first iteration is timed from)
+
+        RETURN: NONE
+        '''
+
+        self.iter_start_time = start_time
+        self.line_1 = None
+        self.line_1_speed = None
+
+    def maintain(self, speed_des, log_data):
+        '''
+        DESCRIPTION: Function that keeps the motor at the desired speed and publishes the sample (the
+        steady-state iteration of the main loop)
+
+        ARGS: speed_des (desired speed in RPM), log_data (True if a trial has started, taken from the same state
+        snapshot as speed_des)
+
+        RETURN: NONE
+        '''
+
+        self.motor_control.maintainMotorVelocity(speed_des=speed_des, log_data=log_data)
+        self.profiler.mark(STAGE_MOTOR)
+
+        self.publish(speed_des=speed_des)
+
+    def publish(self, speed_des):
+        '''
+        DESCRIPTION: Function that shows the desired speed on the LCD and publishes the latest sample of the
+        controller (called once the motor has been updated or ramped)
+
+        ARGS: speed_des (desired speed in RPM)
+
+        RETURN: NONE
+        '''
+
+        # convert the speeds back to m/s
+        motor_control = self.motor_control
+        des_spd_mps = motor_control.RPMToMPS(speed_des)
+        control_sig = motor_control.control_sig
+        curr_spd_mps = motor_control.RPMToMPS(motor_control.curr_speed)
+        self.des_spd_mps = des_spd_mps
+        self.curr_spd_mps = curr_spd_mps
+
+        # only format the line for the LCD when the desired speed has changed (the same string is reused otherwise)
+        if des_spd_mps != self.line_1_speed:
+            self.line_1 = "Des: %.2f m/s" % des_spd_mps
+            self.line_1_speed = des_spd_mps
+        self.profiler.mark(STAGE_FORMAT)
+
+        # print desired motor speed livetime to the LCD module
+        self.lcd.updateLiveLine(row=0, msg=self.line_1)
+        self.profiler.mark(STAGE_LCD)
+
+        # publish the latest sample for the control server and the telemetry stream
+        iter_stop_time = time.perf_counter()
+        iter_time = iter_stop_time - self.iter_start_time
+        elapsed_time = iter_stop_time - self.loop_start_time
+        self.control_server.publish_sample(elapsed_time, des_spd_mps, curr_spd_mps, control_sig)
+        self.telemetry.publish(elapsed_time, des_spd_mps, curr_spd_mps, control_sig, iter_time)
+        self.loop_time.observe(iter_time)
+        self.recorder.recordSample(iter_stop_time, des_spd_mps, curr_spd_mps, control_sig, motor_control.encoder.pos_i,
+                                    iter_time)
+        self.iter_start_time = iter_stop_time
+        self.profiler.mark(STAGE_PUBLISH)
@@ -0,0 +1,274 @@
+'''
+ * @file    Metrics_Class.py
+ * @author  William Wang
+ * @brief   This script contains classes for low-overhead
+            counters, gauges and histograms of the treadmill
+            and a server that exposes them in the Prometheus
+            text format
+'''
+
+# import the required libraries
+import asyncio
+from bisect import bisect_left
+
+# default buckets for histograms of durations (sec)
+TIME_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+class Counter(object):
+    '''
+    DESCRIPTION: This class is a counter that only goes up (i.e. number of encoder edges).
+    NOTE: updates are plain attribute increments (no lock) so that they are cheap enough for the
+    GPIO callbacks. Each metric should only be updated from one thread.
+
+    ARGS: name (metric name), help_text (description of the metric), labels (string of Prometheus
+    labels, i.e. 'pin="18"')
+    '''
+
+    type_name = 'counter'
+
+    def __init__(self, name, help_text, labels):
+        # instantiation function for the counter
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        '''
+        DESCRIPTION: Function that increases the counter
+
+        ARGS: amount (amount to increase the counter by)
+
+        RETURN: NONE
+        '''
+        self.value += amount
+
+    def samples(self):
+        '''
+        DESCRIPTION: Function that returns the samples of the metric for the text format
+
+        ARGS: NONE
+
+        RETURN: list of (name, labels, value)
+        '''
+        return [(self.name, self.labels, self.value)]
+
+class Gauge(Counter):
+    '''
+    DESCRIPTION: This class is a value that can go up and down (i.e. current control signal).
+
+    ARGS: name (metric name), help_text (description of the metric), labels (string of Prometheus labels)
+    '''
+
+    type_name = 'gauge'
+
+    def set(self, value):
+        '''
+        DESCRIPTION: Function that sets the value of the gauge
+
+        ARGS: value (new value of the gauge)
+
+        RETURN: NONE
+        '''
+        self.value = value
+
+    def dec(self, amount=1):
+        '''
+        DESCRIPTION: Function that decreases the gauge
+
+        ARGS: amount (amount to decrease the gauge by)
+
+        RETURN: NONE
+        '''
+        self.value -= amount
+
+class Histogram(object):
+    '''
+    DESCRIPTION: This class counts observations (i.e. loop times) into fixed buckets. The buckets are
+    fixed when the histogram is created, so an observation is a bisect and two increments.
+
+    ARGS: name (metric name), help_text (description of the metric), labels (string of Prometheus labels),
+    buckets (sorted upper bounds of the buckets)
+    '''
+
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, labels, buckets=TIME_BUCKETS):
+        # instantiation function for the histogram
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0]*(len(self.buckets) + 1)       # the last count is for values above every bucket
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        '''
+        DESCRIPTION: Function that adds an observation to the histogram
+
+        ARGS: value (observed value)
+
+        RETURN: NONE
+        '''
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        '''
+        DESCRIPTION: Function that returns the samples of the metric for the text format (cumulative buckets)
+
+        ARGS: NONE
+
+        RETURN: list of (name, labels, value)
+        '''
+        samples = []
+        prefix = self.labels + ',' if self.labels else ''
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            samples.append((self.name + '_bucket', '%sle="%s"' % (prefix, bound), total))
+        samples.append((self.name + '_sum', self.labels, self.sum))
+        samples.append((self.name + '_count', self.labels, self.count))
+        return samples
+
+class MetricsRegistry(object):
+    '''
+    DESCRIPTION: This class keeps all the metrics of the treadmill and renders them in the Prometheus text
+    format. The classes of the package register their metrics with the shared registry below when they
+    are created.
+
+    ARGS: NONE
+    '''
+
+    def __init__(self):
+        # instantiation function for the registry
+        self.metrics = {}           # metrics stored by (name, labels)
+
+    def __getOrCreate(self, cls, name, help_text, labels, *args):
+        '''
+        DESCRIPTION: Function that returns the metric with the given name and labels (creating it if needed)
+
+        ARGS: cls (class of the metric), name, help_text, labels (dictionary of labels), args (extra arguments for the class)
+
+        RETURN: metric
+        '''
+        labels = ','.join('%s="%s"' % (key, value) for key, value in sorted((labels or {}).items()))
+        metric = self.metrics.get((name, labels))
+        if metric is None:
+            metric = cls(name, help_text, labels, *args)
+            self.metrics[(name, labels)] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=None):
+        '''
+        DESCRIPTION: Function that returns a counter from the registry
+
+        ARGS: name (metric name), help_text (description), labels (dictionary of labels)
+
+        RETURN: Counter object
+        '''
+        return self.__getOrCreate(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=None):
+        '''
+        DESCRIPTION: Function that returns a gauge from the registry
+
+        ARGS: name (metric name), help_text (description), labels (dictionary of labels)
+
+        RETURN: Gauge object
+        '''
+        return self.__getOrCreate(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text, labels=None, buckets=TIME_BUCKETS):
+        '''
+        DESCRIPTION: Function that returns a histogram from the registry
+
+        ARGS: name (metric name), help_text (description), labels (dictionary of labels), buckets (upper bounds)
+
+        RETURN: Histogram object
+        '''
+        return self.__getOrCreate(Histogram, name, help_text, labels, buckets)
+
+    def render(self):
+        '''
+        DESCRIPTION: Function that renders every metric in the Prometheus text format
+
+        ARGS: NONE
+
+        RETURN: text (string in the Prometheus text format)
+        '''
+        lines = []
+        described = set()
+        for metric in sorted(list(self.metrics.values()), key=lambda m: m.name):
+            # the HELP and TYPE lines are only written once for metrics with several labels
+            if metric.name not in described:
+                described.add(metric.name)
+                lines.append('# HELP %s %s' % (metric.name, metric.help_text))
+                lines.append('# TYPE %s %s' % (metric.name, metric.type_name))
+            for name, labels, value in metric.samples():
+                if labels:
+                    lines.append('%s{%s} %s' % (name, labels, value))
+                else:
+                    lines.append('%s %s' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+# shared registry of the treadmill metrics
+registry = MetricsRegistry()
+
+class MetricsServer(object):
+    '''
+    DESCRIPTION: This class runs a minimal HTTP server on the IOLoop that replies to every request with
+    the metrics of the registry, so the health of the rig can be scraped (i.e. by Prometheus or curl)
+    without attaching to the process
+
+    ARGS: io_loop (IOLoop object from the IO_Loop_Class), host (address to listen on), port (port to listen on),
+    metrics_registry (MetricsRegistry to be served)
+    '''
+
+    def __init__(self, io_loop, host='127.0.0.1', port=9105, metrics_registry=registry):
+        # instantiation function for the metrics server
+        self.io_loop = io_loop
+        self.host = host
+        self.port = port
+        self.registry = metrics_registry
+
+        # start the server on the I/O loop
+        self.server_task = self.io_loop.run_task(self.__startServer())
+
+    async def __startServer(self):
+        '''
+        DESCRIPTION: Coroutine that starts accepting HTTP connections
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+        self.server = await asyncio.start_server(self.__handleRequest, host=self.host, port=self.port)
+
+    async def __handleRequest(self, reader, writer):
+        '''
+        DESCRIPTION: Coroutine that replies to a single HTTP request with the metrics
+
+        ARGS: reader, writer (asyncio streams for the connection)
+
+        RETURN: NONE
+        '''
+        try:
+            # read the request up to the blank line (the path does not matter)
+            while True:
+                line = await reader.readline()
+                if not line or line in (b'\r\n', b'\n'):
+                    break
+
+            body = self.registry.render().encode('utf-8')
+            writer.write(b'HTTP/1.0 200 OK\r\n'
+                         b'Content-Type: text/plain; version=0.0.4\r\n'
+                         b'Content-Length: %d\r\n\r\n' % len(body))
+            writer.write(body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,310 @@
+'''
+ * @file    Motor_Channels_Class.py
+ * @author  William Wang
+ * @brief   This script contains the classes that run several
+            motor channels (the motor driver, encoder and PID
+            controller of each belt) from one control loop
+'''
+
+# import the required libraries
+import json
+import time
+from collections import namedtuple
+from PID_Controller_Class import MotorPID
+from Stall_Detector_Class import StallDetector, StallDetectorGroup
+import Metrics_Class
+
+# time the encoders of every channel are measured over (sec, the same as Encoder.calcMotorVelocity())
+MEASURE_TIME = 0.1
+
+# configuration of a motor channel
+ChannelConfig = namedtuple('ChannelConfig', [
+    'name',             # name of the channel (added to the names of its .csv files and to its metrics)
+    'motor_pins',       # keyword arguments of the Motor of the channel (pwm1_pin, pwm2_pin, en_pin, enb_pin, diag_pin)
+    'encoder_pins',     # pins of the encoder of the channel (ENCA, ENCB)
+    'gains',            # tuning constants of the PID controller of the channel (k_p, k_i, k_d), the saved gains if None
+    'ratio',            # desired speed of the channel over the desired speed of the treadmill (None for a fixed speed)
+    'speed_mps',        # fixed desired speed of the channel in m/s while the treadmill runs (None if the speed is coupled)
+])
+
+# pins of the motor driver that must be given for each channel
+MOTOR_PINS = ('pwm1_pin', 'pwm2_pin', 'en_pin', 'enb_pin', 'diag_pin')
+
+def loadChannels(path):
+    '''
+    DESCRIPTION: Function that reads the configuration of the motor channels from a .json file. The file holds
+    a list with an object for each channel, i.e.
+        [{"name": "left", "motor_pins": {"pwm1_pin": 12, "pwm2_pin": 13, "en_pin": 19, "enb_pin": 16, "diag_pin": 26},
+          "encoder_pins": [20, 21]},
+         {"name": "right", "motor_pins": {...}, "encoder_pins": [...], "ratio": 0.5, "gains": [0.1, 0, 0]}]
+    "gains" is optional (the saved gains are used), and the desired speed of a channel is either coupled to the
+    desired speed of the treadmill by "ratio" (1 if neither is given) or fixed by "speed" (m/s, only while the
+    desired speed of the treadmill is not zero).
+
+    ARGS: path (path of the .json file)
+
+    RETURN: channels (list of ChannelConfig, raises a ValueError if the configuration is not valid)
+    '''
+
+    with open(path, 'r') as f:
+        entries = json.load(f)
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("%s must hold a list of channels" % path)
+
+    channels = []
+    pins = set()
+    for entry in entries:
+        name = str(entry.get('name', len(channels)))
+        if name in [channel.name for channel in channels]:
+            raise ValueError("channel %s is defined twice" % name)
+
+        # every pin of the channel must be given and must not be used by another channel
+        motor_pins = entry.get('motor_pins', {})
+        if sorted(motor_pins) != sorted(MOTOR_PINS):
+            raise ValueError("channel %s must give the motor pins %s" % (name, ', '.join(MOTOR_PINS)))
+        encoder_pins = tuple(entry.get('encoder_pins', ()))
+        if len(encoder_pins) != 2:
+            raise ValueError("channel %s must give the 2 encoder pins" % name)
+        for pin in list(motor_pins.values()) + list(encoder_pins):
+            if pin in pins:
+                raise ValueError("pin %s of channel %s is used by another channel" % (pin, name))
+            pins.add(pin)
+
+        gains = entry.get('gains')
+        if gains is not None:
+            gains = tuple(float(gain) for gain in gains)
+            if len(gains) != 3:
+                raise ValueError("channel %s must give 3 gains (k_p, k_i, k_d)" % name)
+
+        if 'ratio' in entry and 'speed' in entry:
+            raise ValueError("channel %s can only give one of ratio and speed" % name)
+        speed_mps = float(entry['speed']) if 'speed' in entry else None
+        ratio = float(entry.get('ratio', 1)) if speed_mps is None else None
+
+        channels.append(ChannelConfig(name=name, motor_pins=dict(motor_pins), encoder_pins=encoder_pins, gains=gains,
+                                        ratio=ratio, speed_mps=speed_mps))
+    return channels
+
+class MotorGroup(object):
+    '''
+    DESCRIPTION: This class stands in for the motors object of the motor driver when several motor channels
+    are run, so that the safety checks (the watchdog, the stall detectors and the driver faults) stop every motor
+    together
+
+    ARGS: motors_list (list of motors objects from single_tb9051ftg_motor_driver module, one for each channel)
+    '''
+
+    def __init__(self, motors_list):
+        # instantiation function for the group of motors
+
+        self.motors_list = motors_list                              # motors object of each channel
+        self.drivers = [motors.motor1 for motors in motors_list]    # motor (driver) of each channel
+        self.motor1 = self.drivers[0]
+
+    def forceStop(self):
+        '''
+        DESCRIPTION: Function that stops the motor of every channel
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        for motors in self.motors_list:
+            motors.forceStop()
+
+class MotorChannels(object):
+    '''
+    DESCRIPTION: This class runs the PID controllers of several motor channels (i.e. the two belts of a split-belt
+    treadmill) from one control loop. It stands in for the MotorPID object of the control loop: every call of
+    maintainMotorVelocity() or changeMotorVelocity() measures the encoders of all the channels over the same
+    MEASURE_TIME (instead of one after the other), and then updates the controller of every channel with its own
+    desired speed. The desired speed of a channel is coupled to the desired speed of the treadmill by its ratio,
+    or fixed (see ChannelConfig), and every channel logs to its own data logger.
+    The channels share the watchdog (kicked by every controller) and each channel has its own stall detector,
+    and the watchdog and the detectors stop the motors of every channel (the motors object is a MotorGroup).
+    NOTE: control_sig, curr_speed, motor and encoder are those of the first channel (shown on the LCD and sent
+    to the telemetry and the flight recorder), the metrics of each channel are labelled with its name.
+
+    ARGS: channels (list of ChannelConfig), motor_list (motor object of each channel), encoders (Encoder object of
+    each channel), data_loggers (data logger of each channel, see MotorPID), state_store (see MotorPID), gains
+    (tuning constants of the channels without their own gains), watchdog (see MotorPID), stall_detectors (list
+    of the StallDetector of each channel, or None)
+    '''
+
+    def __init__(self, channels, motor_list, encoders, data_loggers, state_store, gains=(0.1, 0, 0), watchdog=None,
+                    stall_detectors=None):
+        # instantiation function for the motor channels
+
+        self.channels = channels                    # configuration of each channel
+        self.encoders = encoders                    # encoder of each channel
+        self.state_store = state_store              # access the state_store object in order to know when to log data
+
+        # PID controller of each channel
+        self.controllers = []
+        for i in range(len(channels)):
+            self.controllers.append(MotorPID(motor=motor_list[i], encoder=encoders[i], data_logger=data_loggers[i],
+                                                state_store=state_store, gains=channels[i].gains or gains,
+                                                watchdog=watchdog,
+                                                stall_detector=stall_detectors[i] if stall_detectors else None))
+
+        # attributes of the first channel (see the NOTE of the class)
+        self.motor = motor_list[0]
+        self.encoder = encoders[0]
+        self.control_sig = 0
+        self.curr_speed = 0
+
+        # speed measured from each channel in RPM and the counts the measurement started from (updated in place)
+        self.speeds = [0.0]*len(channels)
+        self.pos_start = [0]*len(channels)
+
+        # metrics of the channels
+        self.speed_gauges = [Metrics_Class.registry.gauge('treadmill_channel_speed_rpm', 'Speed measured from the motor of a channel', {'channel': channel.name})
+                                for channel in channels]
+        self.control_gauges = [Metrics_Class.registry.gauge('treadmill_channel_control_signal', 'Last PWM control signal sent to the motor of a channel', {'channel': channel.name})
+                                for channel in channels]
+        self.update_time = Metrics_Class.registry.histogram('treadmill_channels_update_seconds', 'Time to update the controllers of every channel (without the speed measurement)')
+        self.ramps = Metrics_Class.registry.counter('treadmill_ramps_total', 'Number of speed ramps performed')
+
+    def channelSpeed(self, i, speed_des):
+        '''
+        DESCRIPTION: Function that returns the desired speed of a channel for a desired speed of the treadmill
+
+        ARGS: i (index of the channel), speed_des (desired speed of the treadmill in RPM)
+
+        RETURN: speed_des (desired speed of the channel in RPM, zero whenever the treadmill is stopped)
+        '''
+
+        channel = self.channels[i]
+        if speed_des == 0:
+            return 0
+        if channel.speed_mps is not None:
+            return self.MPSToRPM(channel.speed_mps)
+        return speed_des*channel.ratio
+
+    def __measureSpeeds(self):
+        '''
+        DESCRIPTION: Function that measures the speed of every channel over the same MEASURE_TIME (the same
+        measurement as Encoder.calcMotorVelocity() for each encoder)
+
+        ARGS: NONE
+
+        RETURN: NONE (the speeds in RPM are stored in self.speeds)
+        '''
+
+        encoders = self.encoders
+        pos_start = self.pos_start
+        time_start = time.perf_counter()
+        for i in range(len(encoders)):
+            pos_start[i] = encoders[i].pos_i
+        time.sleep(MEASURE_TIME)
+        for i in range(len(encoders)):
+            pos_start[i] = encoders[i].pos_i - pos_start[i]
+        deltaT = time.perf_counter() - time_start
+
+        speeds = self.speeds
+        for i in range(len(encoders)):
+            speeds[i] = encoders[i].countsToRPM(pos_start[i], deltaT)
+            self.speed_gauges[i].set(speeds[i])
+
+    def maintainMotorVelocity(self, speed_des, log_data):
+        '''
+        DESCRIPTION: Function used to maintain the speed of every channel (see MotorPID.maintainMotorVelocity())
+
+        ARGS: speed_des (desired speed of the treadmill to be maintained in RPM), log_data (True if a trial has
+        started, taken from the same state snapshot as speed_des)
+
+        RETURN: NONE (the control signal and speed of the first channel are stored in self.control_sig and
+        self.curr_speed)
+        '''
+
+        self.__measureSpeeds()
+
+        update_start = time.perf_counter()
+        controllers = self.controllers
+        for i in range(len(controllers)):
+            controller = controllers[i]
+            controller.applyMotorVelocity(speed_des=self.channelSpeed(i, speed_des), curr_speed=self.speeds[i],
+                                            log_data=log_data)
+            self.control_gauges[i].set(controller.control_sig)
+        self.update_time.observe(time.perf_counter() - update_start)
+
+        self.control_sig = controllers[0].control_sig
+        self.curr_speed = controllers[0].curr_speed
+
+    def changeMotorVelocity(self, ramp_time, speed_des):
+        '''
+        DESCRIPTION: Function used to ramp every channel from its current speed to its desired speed over the same
+        ramp_time (the same ramp as MotorPID.changeMotorVelocity() for each channel)
+
+        ARGS: ramp_time (time in seconds over which to ramp the speed), speed_des (desired speed of the treadmill
+        to change to in RPM)
+
+        RETURN: NONE (see maintainMotorVelocity())
+        '''
+
+        controllers = self.controllers
+
+        # obtain the starting speed and the slope of the ramp of every channel
+        self.__measureSpeeds()
+        start_speeds = list(self.speeds)
+        slopes = [(self.channelSpeed(i, speed_des) - start_speeds[i])/ramp_time for i in range(len(controllers))]
+
+        time_elapsed = 0
+        start_time = time.perf_counter()
+        while (time_elapsed <= ramp_time):
+            # save data if necessary (the trial can be started/stopped during the ramp)
+            state = self.state_store.snapshot
+            log_data = (state.trial_started == True) or (state.trial_ramp_down == True)
+
+            for i in range(len(controllers)):
+                controller = controllers[i]
+
+                # send the ramp velocity of the channel to its PID and the control signal to its motor
+                ramp_vel = slopes[i]*time_elapsed + start_speeds[i]
+                controller.control_sig = controller.motorPID(ramp_vel, self.speeds[i])
+                controller.curr_speed = self.speeds[i]
+                controller.motor.setSpeed(controller.control_sig)
+                self.control_gauges[i].set(controller.control_sig)
+
+                if log_data:
+                    elapsed_time = controller.data_logger.det_elasped_time()
+                    controller.data_logger.save_data(elapsed_time, self.RPMToMPS(ramp_vel), self.RPMToMPS(self.speeds[i]))
+
+            # clock the time elapsed and obtain the new speeds
+            time_elapsed = time.perf_counter() - start_time
+            self.__measureSpeeds()
+
+        for i in range(len(controllers)):
+            controllers[i].curr_speed = self.speeds[i]
+        self.control_sig = controllers[0].control_sig
+        self.curr_speed = controllers[0].curr_speed
+        self.ramps.inc()
+
+    def RPMToMPS(self, rpm):
+        # convert a speed from RPM to m/s (see MotorPID)
+        return self.controllers[0].RPMToMPS(rpm)
+
+    def MPSToRPM(self, mps):
+        # convert a speed from m/s to RPM (see MotorPID)
+        return self.controllers[0].MPSToRPM(mps)
+
+def createChannelControl(channels, motor_list, motors, encoders, data_loggers, state_store, gains, watchdog,
+                            stall_time, cpu=None):
+    '''
+    DESCRIPTION: Function that creates the controllers and the stall detectors of the motor channels (used by
+    main.py and by the control process of --isolated)
+
+    ARGS: channels (list of ChannelConfig), motor_list, motors (MotorGroup), encoders and data_loggers (see
+    MotorChannels), state_store, gains and watchdog (see MotorPID), stall_time (see StallDetector, no stall
+    detection if 0), cpu (CPU of the control loop that the stall detector threads avoid, no pinning if None)
+
+    RETURN: motor_control (MotorChannels object), stall_detector (StallDetectorGroup object)
+    '''
+
+    stall_detector = StallDetectorGroup([StallDetector(motors=motors, encoder=encoder, stall_time=stall_time, cpu=cpu,
+                                                        enabled=(stall_time > 0)) for encoder in encoders])
+    motor_control = MotorChannels(channels=channels, motor_list=motor_list, encoders=encoders,
+                                    data_loggers=data_loggers, state_store=state_store, gains=gains,
+                                    watchdog=watchdog, stall_detectors=stall_detector.detectors)
+    return motor_control, stall_detector
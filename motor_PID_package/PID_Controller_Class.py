@@ -8,19 +8,30 @@
 # import required libraries
 import time
 from math import pi
+import Metrics_Class
 
 class MotorPID(object):
     '''
     DESCRIPTION: This class provides various functions that allow the user to control
     a DC motor via PID. Note that this class requires access to motor and
     encoder objects
+    NOTE: the latest control signal and measured speed are kept in self.control_sig and self.curr_speed
+    (instead of returning new tuples every iteration of the control loop)
+
+    NOTE: the class does not print anything (the messages of a ramp are printed by the main loop), so that it
+    can also run in the control process (python main.py --isolated) where there is no terminal, LCD or I/O loop
 
     ARGS: motor (motor (not motors) object from single_tb9051_motor_driver_rpi), encoder
-    (object from Encoder_Class.py), lcd (object from the LCD_Class), data_logger (object
-    from the Data_Collection_Class), exp_button (experiment button object from the Buttons_Class)
+    (object from Encoder_Class.py), data_logger (object from the Data_Collection_Class, or any object
+    with det_elasped_time() and save_data()), state_store (StateStore object from the State_Store_Class
+    that holds the trial flags, or any object with a snapshot attribute), gains (tuning constants of the
+    controller (k_p, k_i, k_d), kept in the state file of the Persistent_State_Class), watchdog (Watchdog
+    object from the Watchdog_Class kicked on every update of the controller, or None), stall_detector
+    (StallDetector object from the Stall_Detector_Class given every control signal and measured speed, or None)
     '''
 
-    def __init__(self, motor, encoder, lcd, data_logger, exp_button):
+    def __init__(self, motor, encoder, data_logger, state_store, gains=(0.1, 0, 0), watchdog=None,
+                    stall_detector=None):
         # instantiation function
         
         self.motor = motor          # obtain a motor object
@@ -28,10 +39,23 @@ class MotorPID(object):
         self.err_prev = 0           # variable that stores the error from the previous iteration of PID function (used for the integral and derivative terms)
         self.err_sum = 0            # variable that stores the integral sum of the error for the integral term of the PID
         self.u_prev = 0             # variable that stores the previous control signal sent to the motor (used to generate new control signal)
+        self.control_sig = 0        # latest PWM control signal sent to the motor
+        self.curr_speed = 0         # latest speed measured from the motor in RPM
         self.time_prev = time.perf_counter()        # variable that stores the previous time for the PID loop (used to calculate deltaT)
         self.data_logger = data_logger              # access the data_logger variable in order to be able to log the speeds to the .csv file for experiments
-        self.exp_button = exp_button                # access the exp_button object in order to know when to log data
-        self.lcd = lcd                              # access the lcd object in order to be able to print vital messages to the LCD module
+        self.state_store = state_store              # access the state_store object in order to know when to log data
+        self.watchdog = watchdog                    # watchdog that stops the motor if the controller is no longer updated
+        self.stall_detector = stall_detector        # detector that cuts the motor if it does not move with a high control signal
+
+        # tuning constants
+        # NOTE: from testing, it appears that having k_p as 0.1 as the only value works quite well (if using u_prev)
+        # NOTE: from testing, k_p = 0.5, k_i = 0.5 works for classic PID (no use of u_prev in control signal)
+        self.k_p, self.k_i, self.k_d = gains
+
+        # metrics of the controller
+        self.pid_interval = Metrics_Class.registry.histogram('treadmill_pid_interval_seconds', 'Time between iterations of the PID controller')
+        self.control_gauge = Metrics_Class.registry.gauge('treadmill_control_signal', 'Last PWM control signal sent to the motor')
+        self.ramps = Metrics_Class.registry.counter('treadmill_ramps_total', 'Number of speed ramps performed')
 
     def motorPID(self, desired_vel, meas_vel):
         '''
@@ -44,16 +68,18 @@ class MotorPID(object):
         RETURN: u (PWM control signal value sent to the motor driver)
         '''
 
+        # tell the watchdog the control loop is running (raises a WatchdogFault if it has stopped the motor)
+        if self.watchdog is not None:
+            self.watchdog.kick()
+
         # obtain the change in time since the last time this function has been called
         time_curr = time.perf_counter()
         deltaT = time_curr - self.time_prev
 
         # tuning constants
-        # NOTE: from testing, it appears that having k_p as 0.1 as the only value works quite well (if using u_prev)
-        # NOTE: from testing, k_p = 0.5, k_i = 0.5 works for classic PID (no use of u_prev in control signal)
-        k_p = 0.1
-        k_i = 0
-        k_d = 0
+        k_p = self.k_p
+        k_i = self.k_i
+        k_d = self.k_d
 
         # NOTE: there is a check for 0 m/s as an input speed because the PID will actually
         #       never send a control signal of "0" and will waste energy sending a voltage
@@ -77,28 +103,50 @@ class MotorPID(object):
         # calculate the control signal
         u = k_p*err + k_i*self.err_sum + k_d*(deltaErr/deltaT) + self.u_prev
 
+        # check that the motor has not stalled (raises a StallFault if it has been cut)
+        if self.stall_detector is not None:
+            self.stall_detector.update(u, meas_vel, desired_vel)
+
         # update required global variables for the next iteration of the loop
         self.err_prev = err
         self.u_prev = u
         self.time_prev = time.perf_counter()
 
+        # update the metrics
+        self.pid_interval.observe(deltaT)
+        self.control_gauge.set(u)
+
         return u
 
-    def maintainMotorVelocity(self, speed_des):
+    def maintainMotorVelocity(self, speed_des, log_data):
         '''
         DESCRIPTION: Function used to maintain the motor velocity if the user has 
         not changed the velocity via the terminal or knob. Note that this function
-        has built-in checks if an experiment has started.
+        saves the data if an experiment has started.
 
-        ARGS: speed_des (desired speed to be maintained in RPM)
+        ARGS: speed_des (desired speed to be maintained in RPM), log_data (True if a trial
+        has started, taken from the same state snapshot as speed_des)
 
-        RETURN: control_sig (PWM control signal to be sent to motor driver), curr_speed 
-        (current speed measured from the motor in RPM)
+        RETURN: NONE (the PWM control signal sent to the motor driver and the current speed
+        measured from the motor in RPM are stored in self.control_sig and self.curr_speed)
         '''
 
         # Read in the current motor velocity
         curr_speed = self.encoder.calcMotorVelocity()
 
+        self.applyMotorVelocity(speed_des=speed_des, curr_speed=curr_speed, log_data=log_data)
+
+    def applyMotorVelocity(self, speed_des, curr_speed, log_data):
+        '''
+        DESCRIPTION: Function that runs the controller with a speed that has already been measured (the second
+        half of maintainMotorVelocity(), used when several motors are measured over the same time)
+
+        ARGS: speed_des (desired speed to be maintained in RPM), curr_speed (speed measured from the motor in
+        RPM), log_data (True if a trial has started)
+
+        RETURN: NONE (see maintainMotorVelocity())
+        '''
+
         # generate a control signal using the PID function
         control_sig = self.motorPID(speed_des, curr_speed)
 
@@ -106,18 +154,15 @@ class MotorPID(object):
         self.motor.setSpeed(control_sig)
 
         # save the data if necessary
-        if self.exp_button.trial_started == True:
+        if log_data == True:
             # determine time elapsed
             elapsed_time = self.data_logger.det_elasped_time()
 
-            # convert speeds to m/s
-            speed_des_mps = self.RPMToMPS(speed_des)
-            curr_speed_mps = self.RPMToMPS(curr_speed)
+            # save the data (speeds converted to m/s)
+            self.data_logger.save_data(elapsed_time, self.RPMToMPS(speed_des), self.RPMToMPS(curr_speed))
 
-            # save the data
-            self.data_logger.save_data(data=[elapsed_time, speed_des_mps, curr_speed_mps])
-
-        return control_sig, curr_speed
+        self.control_sig = control_sig
+        self.curr_speed = curr_speed
 
     def changeMotorVelocity(self, ramp_time, speed_des):
         '''
@@ -130,9 +175,8 @@ class MotorPID(object):
 
         ARGS: ramp_time (time in seconds over which to ramp the speed), speed_des (desired speed to change to)
         
-        RETURN: control_sig (PWM control signal to be sent to motor driver), curr_speed 
-        (current speed measured from the motor in RPM), user_changed_velocity (boolean flag
-        returned in the main loop to verify the user has changed the velocity)
+        RETURN: NONE (the final PWM control signal sent to the motor driver and the current speed
+        measured from the motor in RPM are stored in self.control_sig and self.curr_speed)
         '''
 
         # create variable that stores the time elapsed
@@ -168,35 +212,21 @@ class MotorPID(object):
             stop_time = time.perf_counter()
             time_elapsed = stop_time - start_time
 
-            # save data if necessary
-            if (self.exp_button.trial_started == True) or (self.exp_button.trial_ramp_down == True):
+            # save data if necessary (the trial can be started/stopped during the ramp)
+            state = self.state_store.snapshot
+            if (state.trial_started == True) or (state.trial_ramp_down == True):
                 # determine time elapsed
                 elapsed_time = self.data_logger.det_elasped_time()
 
-                # convert speeds to m/s
-                speed_des_mps = self.RPMToMPS(ramp_vel)
-                curr_speed_mps = self.RPMToMPS(curr_speed)
-
-                # save the data
-                self.data_logger.save_data(data=[elapsed_time, speed_des_mps, curr_speed_mps])
+                # save the data (speeds converted to m/s)
+                self.data_logger.save_data(elapsed_time, self.RPMToMPS(ramp_vel), self.RPMToMPS(curr_speed))
 
             # obtain new speed for the motor
             curr_speed = self.encoder.calcMotorVelocity()
 
-        user_changed_velocity = False
-        print("Ramp completed")
-
-        # reset the trial_ramp_down flag and print out necessary messages
-        if (self.exp_button.trial_ramp_down == True):
-            # reset flag
-            self.exp_button.trial_ramp_down = False
-
-            # print trial ended messages
-            print("\nExperiment stopped")
-            msg = "Trial stopped"
-            self.lcd.sendtoLCDThread(target="knob", msg=msg, duration=2, clr_before=True, clr_after=True)
-
-        return control_sig, curr_speed, user_changed_velocity          # return final control signal and motor velocity and flag
+        self.control_sig = control_sig
+        self.curr_speed = curr_speed
+        self.ramps.inc()
 
     def RPMToMPS(self, rpm):
         '''
@@ -0,0 +1,173 @@
+'''
+ * @file    Persistent_State_Class.py
+ * @author  William Wang
+ * @brief   This script contains a class that keeps the
+            settings of the treadmill (preset speed, gains
+            and knob step size) in a small file so that they
+            survive a restart of the treadmill
+'''
+
+# import the required libraries
+import json
+import os
+import threading
+import time
+
+# settings kept in the state file and their values when there is no file yet
+# NOTE: feedforward_tables is reserved for learned feedforward tables of the controller (speed in RPM to PWM),
+#       it is kept in the file as it is (nothing learns the tables yet)
+DEFAULT_STATE = {
+    'preset_speed_mps': 0,          # preset speed for the trials in m/s
+    'preset_speed_RPM': 0,          # preset speed for the trials in RPM
+    'knob_step_size': 0.1,          # step size of the knob in m/s
+    'gains': [0.1, 0, 0],           # gains of the PID controller (k_p, k_i, k_d)
+    'feedforward_tables': {},       # learned feedforward tables of the controller
+}
+
+class PersistentState(object):
+    '''
+    DESCRIPTION: This class holds the settings of the treadmill that should survive a restart of the service
+    (or a power cycle of the Pi), so that a trial at the last preset speed only takes a press of the experiment
+    button after a restart. The settings are read from a JSON file once at startup (a single small read), and
+    every change is written back:
+        - debounced: the file is written once the settings have not changed for write_delay seconds, so turning
+          the knob or pressing a button several times only writes the file once
+        - atomically: the settings are written to a temporary file that replaces the state file (os.replace()),
+          so a power cut during a write leaves either the old or the new file and never a partial one
+    NOTE: the file is written by a thread of the I/O loop's executor, never by the thread changing a setting
+    (the callback worker or the main loop). A missing or unreadable file gives the default settings.
+
+    ARGS: io_loop (IOLoop object from the IO_Loop_Class), path (path of the state file, treadmill_state.json
+    next to this file if None), write_delay (time in sec without changes before the file is written)
+    '''
+
+    def __init__(self, io_loop, path=None, write_delay=2):
+        # instantiation function for the persistent state
+
+        self.io_loop = io_loop                  # IOLoop object (the debounce timer runs on this loop)
+        self.write_delay = write_delay          # time without changes before the file is written (sec)
+        self.change_time = 0                    # time of the last change of the settings
+        self.write_pending = False              # whether a write of the file has been scheduled
+        self.lock = threading.Lock()            # protects the settings and write_pending
+        self.file_lock = threading.Lock()       # makes sure only one thread writes the file at a time
+
+        if path is None:
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'treadmill_state.json')
+        self.path = path                        # path of the state file
+
+        # read the settings (the defaults are used for any setting missing from the file)
+        self.values = dict(DEFAULT_STATE)
+        start_time = time.perf_counter()
+        self.loaded = self.__load()             # whether the settings have been read from the file
+        self.load_time = time.perf_counter() - start_time
+
+    def __load(self):
+        '''
+        DESCRIPTION: Function that reads the settings from the state file
+
+        ARGS: NONE
+
+        RETURN: True if the file has been read, False if it does not exist or could not be read
+        '''
+
+        try:
+            with open(self.path, 'rb') as file:
+                values = json.loads(file.read())
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            print("State file %s could not be read (%s), using the default settings" % (self.path, e))
+            return False
+
+        if not isinstance(values, dict):
+            print("State file %s is not valid, using the default settings" % self.path)
+            return False
+
+        self.values.update(values)
+        return True
+
+    def get(self, name):
+        '''
+        DESCRIPTION: Function that returns a setting
+
+        ARGS: name (name of the setting, i.e. 'preset_speed_mps')
+
+        RETURN: value (value of the setting)
+        '''
+
+        return self.values[name]
+
+    def set(self, **changes):
+        '''
+        DESCRIPTION: Function that changes settings and schedules a write of the state file (can be called from
+        any thread)
+
+        ARGS: changes (settings to be changed, i.e. knob_step_size=0.01)
+
+        RETURN: NONE
+        '''
+
+        with self.lock:
+            changes = {name: value for name, value in changes.items() if self.values.get(name) != value}
+            if not changes:
+                return
+            self.values.update(changes)
+            self.change_time = time.perf_counter()
+
+            # the first change since the last write starts the debounce timer
+            if self.write_pending:
+                return
+            self.write_pending = True
+
+        self.io_loop.call_soon(self.__debounce)
+
+    def __debounce(self):
+        '''
+        DESCRIPTION: Function (run on the I/O loop) that writes the file once the settings have not changed for
+        write_delay seconds, and checks again later otherwise
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        remaining = self.change_time + self.write_delay - time.perf_counter()
+        if remaining > 0:
+            self.io_loop.loop.call_later(remaining, self.__debounce)
+        else:
+            self.io_loop.loop.run_in_executor(None, self.flush)
+
+    def flush(self):
+        '''
+        DESCRIPTION: Function that writes the state file straight away if any setting has changed since the last
+        write (called by the debounce timer, and by the main program before it exits)
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        with self.file_lock:
+            with self.lock:
+                if not self.write_pending:
+                    return
+                self.write_pending = False
+                data = json.dumps(self.values, indent=4)
+
+            # write a temporary file and replace the state file with it (the directory is synced so that the
+            # rename is on the SD card too)
+            temp_path = self.path + '.tmp'
+            try:
+                with open(temp_path, 'w') as file:
+                    file.write(data)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temp_path, self.path)
+
+                dir_fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+            except OSError as e:
+                print("State file %s could not be written (%s)" % (self.path, e))
@@ -0,0 +1,135 @@
+'''
+ * @file    Realtime_Class.py
+ * @author  William Wang
+ * @brief   This script contains a class that runs the
+            treadmill in an opt-in real-time mode (garbage
+            collection control, memory locking and a real-time
+            scheduling policy for the control thread)
+'''
+
+# import the required libraries
+import ctypes
+import ctypes.util
+import gc
+import os
+import threading
+
+# flags for mlockall() (from <sys/mman.h>)
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+class RealtimeMode(object):
+    '''
+    DESCRIPTION: This class removes the main sources of pauses from the control loop when it is enabled:
+        - the objects created during startup are frozen (gc.freeze()) so the collector never scans them again
+        - the automatic garbage collection is disabled during trials and a full collection is done between trials
+        - the memory of the process is locked (mlockall()) so the control loop never waits on a page fault
+        - the control thread is given the SCHED_FIFO policy and pinned to its own CPU
+    Every step that needs a permission the process does not have (i.e. running as the pi user without
+    LimitRTPRIO/LimitMEMLOCK in treadmill.service) is reported and skipped, the treadmill then runs as usual.
+    NOTE: the class must be created before any threads are started, because it lowers the stack size of new
+    threads (every page of every thread stack is locked by mlockall())
+
+    ARGS: enabled (whether the real-time mode is used, every function does nothing otherwise), priority
+    (SCHED_FIFO priority of the control thread, 1 to 99), cpu (CPU the control thread is pinned to, the last
+    CPU if None), thread_stack_size (stack size of new threads in bytes)
+    '''
+
+    def __init__(self, enabled=False, priority=50, cpu=None, thread_stack_size=512*1024):
+        # instantiation function for the real-time mode
+
+        self.enabled = enabled                  # whether the real-time mode is used
+        self.priority = priority                # SCHED_FIFO priority of the control thread
+        self.cpu = cpu                          # CPU the control thread is pinned to
+        self.in_trial = False                   # whether the automatic garbage collection is disabled for a trial
+        self.collections = 0                    # number of collections done between trials
+
+        # keep the stacks of the threads small (they are locked into memory)
+        if self.enabled:
+            threading.stack_size(thread_stack_size)
+
+    def lockMemory(self):
+        '''
+        DESCRIPTION: Function that locks the current and future memory of the process into RAM
+
+        ARGS: NONE
+
+        RETURN: True if the memory has been locked
+        '''
+
+        if not self.enabled:
+            return False
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+            print("Real-time mode: could not lock the memory (%s), continuing without it" % os.strerror(ctypes.get_errno()))
+            return False
+
+        return True
+
+    def freezeStartup(self):
+        '''
+        DESCRIPTION: Function called once the startup is complete that collects the garbage from the startup and
+        moves every remaining object out of the reach of the garbage collector
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        if self.enabled:
+            gc.collect()
+            gc.freeze()
+
+    def setupControlThread(self):
+        '''
+        DESCRIPTION: Function called from the control thread (the main loop) that gives the calling thread the
+        SCHED_FIFO policy and pins it to its CPU
+        NOTE: threads created by the control thread afterwards inherit the policy and the CPU, so this should be
+        called once every other thread has been started
+
+        ARGS: NONE
+
+        RETURN: True if the thread has the SCHED_FIFO policy
+        '''
+
+        if not self.enabled:
+            return False
+
+        # pin the thread to its CPU (pid 0 is the calling thread)
+        cpu = self.cpu if self.cpu is not None else os.cpu_count() - 1
+        try:
+            os.sched_setaffinity(0, {cpu})
+        except OSError as e:
+            print("Real-time mode: could not pin the control thread to CPU %d (%s)" % (cpu, e.strerror))
+
+        # give the thread the real-time policy
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+        except OSError as e:
+            print("Real-time mode: could not use SCHED_FIFO for the control thread (%s), continuing without it" % e.strerror)
+            return False
+
+        return True
+
+    def trialChanged(self, in_trial):
+        '''
+        DESCRIPTION: Function called from the main loop whenever a trial starts or ends (including the ramp down).
+        The automatic garbage collection is disabled for the trial, and the garbage of the trial is collected
+        once it has ended.
+
+        ARGS: in_trial (True if a trial has started, False if it has ended)
+
+        RETURN: NONE
+        '''
+
+        if not self.enabled or in_trial == self.in_trial:
+            return
+        self.in_trial = in_trial
+
+        if in_trial:
+            gc.disable()
+        else:
+            gc.collect()
+            self.collections += 1
+            gc.enable()
@@ -0,0 +1,110 @@
+'''
+ * @file    Shared_Ring_Class.py
+ * @author  William Wang
+ * @brief   This script contains a class for a ring buffer
+            of fixed-size records in shared memory, used to
+            pass data between the processes of the treadmill
+            without pickling
+'''
+
+# import the required libraries
+from multiprocessing import shared_memory
+
+class SharedRing(object):
+    '''
+    DESCRIPTION: This class is a single-writer ring buffer of fixed-size records of doubles in a
+    multiprocessing.shared_memory block. The block starts with the total number of records written, followed
+    by the records. The writer fills the record returned by reserve() in place and publishes it with commit(),
+    so writing a record never creates any objects. Readers keep their own count of the records they have read.
+    NOTE: the last value of every record is its sequence number (the record number + 1). The writer clears it
+    before it starts overwriting a record and sets it just before the record is published. A reader copies the
+    record and only accepts it if the sequence number (copied last) matches, so a record that is being
+    overwritten by the writer (the reader fell a whole ring behind) is never used.
+
+    ARGS: record_size (number of values in each record, not including the sequence number), capacity (number
+    of records in the ring), name (name of an existing ring to attach to, a new ring is created if None)
+    '''
+
+    def __init__(self, record_size, capacity, name=None):
+        # instantiation function for the shared ring
+
+        self.record_size = record_size + 1          # number of values in each record (including the sequence number)
+        self.capacity = capacity                    # number of records in the ring
+        self.owner = name is None                   # whether this process created the ring (and removes it on close())
+
+        size = 8*(1 + self.record_size*capacity)
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.name = self.shm.name                   # name used by the other process to attach to the ring
+
+        # views of the header (total number of records written) and of the records
+        self.header = self.shm.buf[:8].cast('Q')
+        self.records = self.shm.buf[8:size].cast('d')
+
+    def count(self):
+        '''
+        DESCRIPTION: Function that returns the total number of records written to the ring
+
+        ARGS: NONE
+
+        RETURN: count (number of records written)
+        '''
+        return self.header[0]
+
+    def reserve(self):
+        '''
+        DESCRIPTION: Function (writer only) that returns the position of the next record, which the writer fills
+        in self.records before calling commit()
+
+        ARGS: NONE
+
+        RETURN: i (index of the first value of the record in self.records)
+        '''
+
+        # clear the sequence number of the record (readers no longer accept its old values)
+        i = (self.header[0] % self.capacity)*self.record_size
+        self.records[i + self.record_size - 1] = 0
+        return i
+
+    def commit(self):
+        '''
+        DESCRIPTION: Function (writer only) that publishes the record returned by reserve()
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        count = self.header[0] + 1
+        self.records[(self.header[0] % self.capacity)*self.record_size + self.record_size - 1] = count
+        self.header[0] = count
+
+    def read(self, number):
+        '''
+        DESCRIPTION: Function (readers only) that copies a record out of the ring
+
+        ARGS: number (number of the record, from 0 to count() - 1)
+
+        RETURN: values (list of the values of the record without the sequence number, None if the record has
+        been overwritten or is not completely visible yet)
+        '''
+
+        i = (number % self.capacity)*self.record_size
+        values = self.records[i:i + self.record_size].tolist()
+        if values.pop() != number + 1:
+            return None
+        return values
+
+    def close(self):
+        '''
+        DESCRIPTION: Function that detaches from the ring (and removes it if this process created it)
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        self.header.release()
+        self.records.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,240 @@
+'''
+ * @file    Stall_Detector_Class.py
+ * @author  William Wang
+ * @brief   This script contains a class that detects a
+            stalled motor or a jammed belt from the control
+            effort and the encoder, and cuts the motor
+'''
+
+# import the required libraries
+import os
+import threading
+import time
+import Exceptions
+import Metrics_Class
+
+class StallDetector(object):
+    '''
+    DESCRIPTION: This class detects a stalled motor (or a jammed belt). The PID controller keeps raising the
+    control signal (through u_prev) while the motor does not move, so a stall is declared once the motor has
+    been driven for stall_time seconds while:
+        - the measured speed stays below speed_threshold (checked on every update of the PID controller), or
+        - the encoder has not had a single edge (checked by the detector thread every check_period seconds, so a
+          stall is detected without waiting for the next speed measurement of the controller)
+    The motor is driven when the control effort is high, or, once the motor has moved during the run, when the
+    control signal pushes towards a moving setpoint with at least drive_threshold (at low speeds the effort
+    needed is far below effort_threshold, and a jam would only be timed once the controller has wound the effort
+    up to it). A motor starting from rest is only timed with a high effort, so a slow breakaway is not a stall.
+    The detector thread cuts the motor straight away (motors.forceStop()), and the next update of the PID
+    controller raises a StallFault so the control loop stops without setting a speed again. The detector is
+    only armed during a run of the treadmill.
+
+    ARGS: motors (motors object from single_tb9051ftg_motor_driver module), encoder (Encoder object from
+    Encoder_Class.py), stall_time (time in sec the motor can be driven without moving), effort_threshold
+    (absolute PWM control signal above which the effort is high, out of 480), drive_threshold (absolute PWM
+    control signal above which a motor that has moved is driven towards its setpoint), speed_threshold (absolute
+    speed in RPM below which the motor is not moving), cpu (CPU of the control loop that the detector thread avoids, no
+    pinning if None), enabled (whether the detector is used)
+    '''
+
+    def __init__(self, motors, encoder, stall_time=0.25, effort_threshold=120, drive_threshold=40, speed_threshold=3,
+                    cpu=None, enabled=True):
+        # instantiation function for the stall detector
+
+        self.motors = motors                        # motors object (cut when a stall is detected)
+        self.encoder = encoder                      # encoder object (time of the last edge)
+        self.stall_time = stall_time                # time the effort can be high without the motor moving (sec)
+        self.effort_threshold = effort_threshold    # absolute control signal above which the effort is high
+        self.drive_threshold = drive_threshold      # absolute control signal above which a motor that has moved is driven
+        self.speed_threshold = speed_threshold      # absolute speed below which the motor is not moving (RPM)
+        self.cpu = cpu                              # CPU of the control loop (the detector thread avoids it)
+        self.enabled = enabled                      # whether the detector is used
+        self.check_period = stall_time/10           # time between the checks of the encoder edges (sec)
+        self.effort_time = None                     # time the motor started being driven (None while it is not)
+        self.slow_time = None                       # time the motor stopped moving while driven (None while it moves)
+        self.moved = False                          # whether the motor has moved since it was last at rest
+        self.armed = False                          # whether the detector is watching the motor
+        self.tripped = False                        # whether the motor has been cut by the detector thread
+        self.control_sig = 0                        # latest control signal driving the motor
+        self.stall_sig = 0                          # control signal when the stall was detected
+        self.arm_event = threading.Event()          # set while the detector is armed
+
+        self.stalls = Metrics_Class.registry.counter('treadmill_motor_stalls_total', 'Number of stalls of the motor detected')
+
+        # create and start the detector thread
+        # NOTE: daemon thread so that the detector is killed with the main program
+        if self.enabled:
+            self.detector_thread = threading.Thread(target=self.__detectorThread, name='stall_detector', daemon=True)
+            self.detector_thread.start()
+
+    def arm(self):
+        '''
+        DESCRIPTION: Function called from the control thread at the start of a run that starts watching the motor
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        if not self.enabled:
+            return
+        self.effort_time = None
+        self.slow_time = None
+        self.moved = False
+        self.tripped = False
+        self.armed = True
+        self.arm_event.set()
+
+    def disarm(self):
+        '''
+        DESCRIPTION: Function called from the control thread at the end of a run (once the motor has been
+        stopped) that stops watching the motor
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        self.armed = False
+        self.arm_event.clear()
+
+    def update(self, control_sig, speed, speed_des=0):
+        '''
+        DESCRIPTION: Function called by the PID controller with every new control signal and measured speed
+
+        ARGS: control_sig (PWM control signal calculated by the controller), speed (measured speed in RPM),
+        speed_des (desired speed of the controller in RPM)
+
+        RETURN: NONE (raises a StallFault if the motor has stalled)
+        '''
+
+        if not self.armed:
+            return
+        if self.tripped:
+            self.__stalled()
+
+        # the motor is at rest again once it is stopped on purpose
+        if abs(speed) >= self.speed_threshold:
+            self.moved = True
+        elif speed_des == 0:
+            self.moved = False
+
+        # time the motor has been driven for, and the time it has not been moving for while driven
+        driven = (abs(control_sig) >= self.effort_threshold
+                    or (self.moved and abs(speed_des) >= self.speed_threshold and abs(control_sig) >= self.drive_threshold
+                        and control_sig*speed_des > 0))
+        if not driven:
+            self.effort_time = None
+            self.slow_time = None
+            return
+
+        now = time.perf_counter()
+        self.control_sig = control_sig
+        if self.effort_time is None:
+            self.effort_time = now
+        if abs(speed) >= self.speed_threshold:
+            self.slow_time = None
+        elif self.slow_time is None:
+            self.slow_time = now
+        elif now - self.slow_time >= self.stall_time:
+            self.__trip(control_sig)
+            self.__stalled()
+
+    def __trip(self, control_sig):
+        '''
+        DESCRIPTION: Function that cuts the motor once a stall has been detected
+
+        ARGS: control_sig (control signal when the stall was detected)
+
+        RETURN: NONE
+        '''
+
+        self.tripped = True
+        self.motors.forceStop()
+        self.stall_sig = control_sig
+        self.stalls.inc()
+
+    def __stalled(self):
+        '''
+        DESCRIPTION: Function called from the control thread once the motor has been cut, that stops the
+        control loop
+
+        ARGS: NONE
+
+        RETURN: NONE (raises a StallFault)
+        '''
+
+        self.disarm()
+        self.tripped = False
+        raise Exceptions.StallFault(control_sig=self.stall_sig)
+
+    def __detectorThread(self):
+        '''
+        DESCRIPTION: Function running in the detector thread that cuts the motor if the encoder has had no edges
+        for stall_time seconds while the motor has been driven
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        # run on the CPUs the control loop does not use (pid 0 is the calling thread)
+        if self.cpu is not None:
+            cpus = os.sched_getaffinity(0) - {self.cpu}
+            if not cpus:
+                cpus = set(range(os.cpu_count())) - {self.cpu}
+            try:
+                os.sched_setaffinity(0, cpus)
+            except OSError:
+                pass
+
+        while True:
+            self.arm_event.wait()
+            time.sleep(self.check_period)
+
+            effort_time = self.effort_time
+            if effort_time is None or not self.armed or self.tripped:
+                continue
+
+            # the motor is not moving if there has been no edge since it started being driven (or for stall_time)
+            since = max(effort_time, self.encoder.edge_time_ns*1e-9)
+            if time.perf_counter() - since >= self.stall_time:
+                self.__trip(self.control_sig)
+
+class StallDetectorGroup(object):
+    '''
+    DESCRIPTION: This class arms and disarms the stall detectors of several motor channels together (the
+    MotorChannels object of the Motor_Channels_Class gives each channel its own detector, and each detector
+    cuts every motor of the group)
+
+    ARGS: detectors (list of StallDetector objects, one for each channel)
+    '''
+
+    def __init__(self, detectors):
+        # instantiation function for the group of stall detectors
+
+        self.detectors = detectors                  # stall detector of each channel
+
+    def arm(self):
+        '''
+        DESCRIPTION: Function called from the control thread at the start of a run that arms every detector
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        for detector in self.detectors:
+            detector.arm()
+
+    def disarm(self):
+        '''
+        DESCRIPTION: Function called from the control thread at the end of a run that disarms every detector
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        for detector in self.detectors:
+            detector.disarm()
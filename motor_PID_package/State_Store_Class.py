@@ -0,0 +1,80 @@
+'''
+ * @file    State_Store_Class.py
+ * @author  William Wang
+ * @brief   This script contains a class that stores the
+            shared state of the treadmill (setpoint, trial and
+            safety flags) as a single immutable snapshot
+'''
+
+# import the required libraries
+from collections import namedtuple
+from Instrumented_Lock_Class import make_lock
+
+# immutable snapshot of the shared state of the treadmill
+# NOTE: speeds are stored in both m/s (for the user) and RPM (for the PID controller)
+TreadmillState = namedtuple('TreadmillState', [
+    'version',                  # incremented by every update (useful to tell whether anything has changed)
+    'speed_des_mps',            # desired speed in m/s
+    'speed_des_RPM',            # desired speed in RPM
+    'user_changed_velocity',    # True when the main loop should ramp to the desired speed
+    'preset_speed_mps',         # preset speed for the trials in m/s
+    'preset_speed_RPM',         # preset speed for the trials in RPM
+    'trial_started',            # True while a trial is running (data is being logged)
+    'trial_ramp_down',          # True while the speed ramps down at the end of a trial (data is still logged)
+    'program_started',          # True while the main loop should run (toggled with the start/stop button)
+    'run',                      # number of the current run of the treadmill (incremented every time the main loop starts)
+    'beam_tripped',             # pin of the first IR sensor that has been triggered (None if no sensor has been triggered)
+])
+
+class StateStore(object):
+    '''
+    DESCRIPTION: This class holds the shared state of the treadmill as one versioned, immutable snapshot
+    (TreadmillState). Writers (the knob, the buttons, the terminal input, the IR sensor callbacks and the
+    control server) replace the whole snapshot with update() or modify(); the writers are serialised by a
+    lock. Readers take the snapshot with a single attribute read (no lock), so the control loop always sees
+    a consistent setpoint/trial/safety combination for the whole iteration.
+
+    ARGS: NONE
+    '''
+
+    def __init__(self):
+        # instantiation function for the state store
+
+        self.write_lock = make_lock('state_write_lock')     # lock that serialises the writers (never taken by readers)
+
+        # initial state of the treadmill (not moving, no trial and the program waiting for the start button)
+        self.snapshot = TreadmillState(version=0, speed_des_mps=0, speed_des_RPM=0, user_changed_velocity=False,
+                                        preset_speed_mps=0, preset_speed_RPM=0, trial_started=False,
+                                        trial_ramp_down=False, program_started=False, run=0,
+                                        beam_tripped=None)
+
+    def update(self, **changes):
+        '''
+        DESCRIPTION: Function that replaces the snapshot with a copy that has the given fields changed
+
+        ARGS: changes (fields of the TreadmillState to be changed, i.e. trial_ramp_down=False)
+
+        RETURN: state (the new snapshot)
+        '''
+
+        with self.write_lock:
+            state = self.snapshot._replace(version=self.snapshot.version + 1, **changes)
+            self.snapshot = state
+        return state
+
+    def modify(self, func):
+        '''
+        DESCRIPTION: Function that performs a read-modify-write of the snapshot (i.e. stepping the desired
+        speed from the knob). func is called with the current snapshot while the write lock is held and
+        returns a dictionary of the fields to be changed (or None to leave the snapshot as it is).
+
+        ARGS: func (function taking a TreadmillState and returning a dictionary of changes or None)
+
+        RETURN: state (the snapshot after the modification)
+        '''
+
+        with self.write_lock:
+            changes = func(self.snapshot)
+            if changes:
+                self.snapshot = self.snapshot._replace(version=self.snapshot.version + 1, **changes)
+            return self.snapshot
@@ -0,0 +1,177 @@
+'''
+ * @file    Telemetry_Class.py
+ * @author  William Wang
+ * @brief   This script contains a class that publishes a
+            live, decimated telemetry stream of the control
+            loop over a Unix domain socket
+'''
+
+# import the required libraries
+import asyncio
+import os
+from array import array
+
+class TelemetryPublisher(object):
+    '''
+    DESCRIPTION: This class takes the setpoint, measured speed, control signal and loop time of every
+    iteration of the control loop and streams them to subscribers over a Unix domain socket, decimated
+    to the rate chosen by each subscriber. Every frame holds the min/max envelope of each channel over
+    the samples it covers, so short spikes are never hidden by the decimation.
+    NOTE: the control loop only writes into a preallocated ring buffer (no locks). The subscribers read
+    the ring from the IOLoop, and a subscriber that falls behind (or a socket that is full) loses frames
+    instead of stalling the control loop.
+
+    A subscriber may send "RATE <Hz>" at any time to change its frame rate. Each frame is one line:
+        FRAME <time> <samples> <setpoint min> <max> <measured min> <max> <control min> <max> <loop time min> <max>
+
+    ARGS: io_loop (IOLoop object from the IO_Loop_Class), socket_path (path of the Unix domain socket),
+    ring_size (number of samples kept in the ring buffer), default_rate (frame rate in Hz for new subscribers)
+    '''
+
+    # number of values in each sample (time, setpoint, measured speed, control signal, loop time)
+    SAMPLE_SIZE = 5
+
+    def __init__(self, io_loop, socket_path='/tmp/treadmill_telemetry.sock', ring_size=4096, default_rate=20):
+        # instantiation function for the telemetry publisher
+
+        self.io_loop = io_loop                  # IOLoop object (the server and subscribers run on this loop)
+        self.socket_path = socket_path          # path of the Unix domain socket
+        self.ring_size = ring_size              # number of samples in the ring buffer
+        self.default_rate = default_rate        # frame rate for new subscribers (Hz)
+        self.max_buffered = 16384               # a subscriber's frames are dropped while this many bytes are waiting to be sent
+        self.frames_dropped = 0                 # number of frames dropped because of slow subscribers
+
+        # preallocated ring buffer of the samples (written only by the control loop)
+        self.ring = array('d', bytes(8*self.SAMPLE_SIZE*ring_size))
+        self.write_count = 0                    # total number of samples written (the ring index is write_count % ring_size)
+
+        # start the server on the I/O loop
+        self.server_task = self.io_loop.run_task(self.__startServer())
+
+    def publish(self, elapsed_time, setpoint, measured, control_sig, loop_time):
+        '''
+        DESCRIPTION: Function called from the control loop every iteration that writes a sample into the
+        ring buffer. This never blocks and never allocates any new containers.
+
+        ARGS: elapsed_time (time of the sample in seconds), setpoint (desired speed in m/s), measured (measured
+        speed in m/s), control_sig (PWM control signal sent to the motor), loop_time (time of the loop iteration in seconds)
+
+        RETURN: NONE
+        '''
+
+        i = (self.write_count % self.ring_size)*self.SAMPLE_SIZE
+        ring = self.ring
+        ring[i] = elapsed_time
+        ring[i + 1] = setpoint
+        ring[i + 2] = measured
+        ring[i + 3] = control_sig
+        ring[i + 4] = loop_time
+
+        # publish the sample (single attribute assignment, the readers only read samples below write_count)
+        self.write_count = self.write_count + 1
+
+    async def __startServer(self):
+        '''
+        DESCRIPTION: Coroutine that creates the Unix domain socket and starts accepting subscribers
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        # remove a socket left over from a previous run
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        self.server = await asyncio.start_unix_server(self.__handleSubscriber, path=self.socket_path)
+
+        # only the owner and group can subscribe (as for the control socket)
+        os.chmod(self.socket_path, 0o660)
+
+    async def __handleSubscriber(self, reader, writer):
+        '''
+        DESCRIPTION: Coroutine that sends decimated frames to a single subscriber until it disconnects
+
+        ARGS: reader, writer (asyncio streams for the subscriber connection)
+
+        RETURN: NONE
+        '''
+
+        rate = self.default_rate
+        read_count = self.write_count           # start from the newest sample
+        command = asyncio.ensure_future(reader.readline())
+
+        try:
+            while True:
+                # wait for the next frame (or a command from the subscriber)
+                await asyncio.wait((command,), timeout=1/rate)
+
+                if command.done():
+                    line = command.result()
+                    if not line:
+                        break           # the subscriber has disconnected
+                    words = line.split()
+                    if len(words) == 2 and words[0].upper() == b'RATE':
+                        try:
+                            rate = min(max(float(words[1]), 0.1), 1000)
+                        except ValueError:
+                            pass
+                    command = asyncio.ensure_future(reader.readline())
+
+                # create a frame from the new samples
+                frame, read_count = self.__decimate(read_count)
+                if frame is None:
+                    continue
+
+                # drop the frame instead of letting the queued data grow if the subscriber is slow
+                if writer.transport.get_write_buffer_size() > self.max_buffered:
+                    self.frames_dropped += 1
+                    continue
+                writer.write(frame)
+
+        except ConnectionError:
+            pass
+        finally:
+            command.cancel()
+            writer.close()
+
+    def __decimate(self, read_count):
+        '''
+        DESCRIPTION: Function that reduces the samples written since read_count into one frame with the
+        min/max envelope of each channel
+
+        ARGS: read_count (number of samples that have already been read by the subscriber)
+
+        RETURN: frame (encoded frame line, or None if there are no new samples), read_count (updated count)
+        '''
+
+        write_count = self.write_count
+
+        # skip the samples that have already been overwritten
+        if write_count - read_count > self.ring_size:
+            read_count = write_count - self.ring_size
+
+        if write_count == read_count:
+            return None, read_count
+
+        ring = self.ring
+        n = self.SAMPLE_SIZE
+        start = (read_count % self.ring_size)*n
+        lows = list(ring[start + 1:start + n])
+        highs = list(lows)
+        elapsed_time = ring[start]
+
+        for count in range(read_count + 1, write_count):
+            i = (count % self.ring_size)*n
+            elapsed_time = ring[i]
+            for c in range(1, n):
+                value = ring[i + c]
+                if value < lows[c - 1]:
+                    lows[c - 1] = value
+                elif value > highs[c - 1]:
+                    highs[c - 1] = value
+
+        frame = "FRAME %.4f %d %.3f %.3f %.3f %.3f %.1f %.1f %.6f %.6f\n" % (elapsed_time, write_count - read_count,
+                    lows[0], highs[0], lows[1], highs[1], lows[2], highs[2], lows[3], highs[3])
+
+        return frame.encode('ascii'), write_count
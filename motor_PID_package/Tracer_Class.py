@@ -0,0 +1,167 @@
+'''
+ * @file    Tracer_Class.py
+ * @author  William Wang
+ * @brief   This script contains a class that records the
+            activity of the threads of the treadmill into a
+            ring buffer and exports it as a Chrome/Perfetto
+            trace
+'''
+
+# import the required libraries
+import itertools
+import json
+import os
+import threading
+import time
+from array import array
+
+class Tracer(object):
+    '''
+    DESCRIPTION: This class records spans (begin/end), instant events, GPIO edge events and lock waits from
+    any thread into a fixed-size ring buffer. The buffer can be dumped as Chrome trace JSON, which can be
+    opened in chrome://tracing or https://ui.perfetto.dev to see every thread of the treadmill on a timeline
+    (i.e. an encoder callback that is waiting behind a button handler).
+    NOTE: the tracer is disabled by default; every recording function returns immediately (and the callers
+    check tracer.enabled first) so that it costs nothing unless the treadmill is run with --trace
+
+    ARGS: capacity (number of events kept in the ring buffer)
+    '''
+
+    def __init__(self, capacity=65536):
+        # instantiation function for the tracer
+
+        self.enabled = False                        # whether events are recorded
+        self.capacity = capacity                    # number of events kept in the ring buffer
+        self.lock_wait_threshold = 5000             # lock waits shorter than this (ns) are not recorded
+
+        # preallocated ring buffer of the events (one entry per event in each of the following)
+        self.names = [None]*capacity                # event names
+        self.phases = [None]*capacity               # Chrome trace phases ('B' begin, 'E' end, 'X' complete, 'i' instant)
+        self.stamps = array('q', bytes(8*capacity)) # start time of the events (ns)
+        self.durations = array('q', bytes(8*capacity))  # duration of 'X' events (ns)
+        self.tids = array('Q', bytes(8*capacity))   # thread that recorded the event
+
+        # next() of an itertools.count is atomic, so every thread gets its own slot in the ring buffer
+        self.counter = itertools.count()
+
+        # names of threads that are not threading.Thread objects (i.e. the RPi.GPIO callback thread)
+        self.thread_names = {}
+
+    def __record(self, name, phase, stamp, duration):
+        '''
+        DESCRIPTION: Function that writes an event into the next slot of the ring buffer
+
+        ARGS: name (event name), phase (Chrome trace phase), stamp (start time in ns), duration (duration in ns)
+
+        RETURN: NONE
+        '''
+
+        i = next(self.counter) % self.capacity
+        self.names[i] = name
+        self.phases[i] = phase
+        self.stamps[i] = stamp
+        self.durations[i] = duration
+        self.tids[i] = threading.get_ident()
+
+    def begin(self, name):
+        '''
+        DESCRIPTION: Function that records the beginning of a span on the current thread
+
+        ARGS: name (name of the span)
+
+        RETURN: NONE
+        '''
+        if self.enabled:
+            self.__record(name, 'B', time.perf_counter_ns(), 0)
+
+    def end(self, name):
+        '''
+        DESCRIPTION: Function that records the end of a span on the current thread
+
+        ARGS: name (name of the span)
+
+        RETURN: NONE
+        '''
+        if self.enabled:
+            self.__record(name, 'E', time.perf_counter_ns(), 0)
+
+    def complete(self, name, start, stop):
+        '''
+        DESCRIPTION: Function that records a span whose start and stop times are already known (i.e. a GPIO
+        callback or a lock wait)
+
+        ARGS: name (name of the span), start/stop (times from time.perf_counter_ns())
+
+        RETURN: NONE
+        '''
+        if self.enabled:
+            self.__record(name, 'X', start, stop - start)
+
+    def instant(self, name):
+        '''
+        DESCRIPTION: Function that records an instant event (i.e. a GPIO edge or a user input)
+
+        ARGS: name (name of the event)
+
+        RETURN: NONE
+        '''
+        if self.enabled:
+            self.__record(name, 'i', time.perf_counter_ns(), 0)
+
+    def name_current_thread(self, name):
+        '''
+        DESCRIPTION: Function that names the current thread in the trace (used for threads that are not
+        created by the threading module, i.e. the RPi.GPIO callback thread)
+
+        ARGS: name (name of the thread)
+
+        RETURN: NONE
+        '''
+        self.thread_names[threading.get_ident()] = name
+
+    def dump(self, path):
+        '''
+        DESCRIPTION: Function that writes the events in the ring buffer to a Chrome trace JSON file
+
+        ARGS: path (path of the file to be written)
+
+        RETURN: count (number of events written)
+        '''
+
+        # work out which slots hold events (the oldest events have been overwritten if the ring has wrapped)
+        total = next(self.counter)
+        count = min(total, self.capacity)
+        first = total - count
+
+        # names of the threads
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        names.update(self.thread_names)
+
+        pid = os.getpid()
+        events = []
+        tids = set()
+        for index in range(first, total):
+            i = index % self.capacity
+            if self.names[i] is None:
+                continue
+            event = {'name': self.names[i], 'ph': self.phases[i], 'ts': self.stamps[i]/1000,
+                        'pid': pid, 'tid': self.tids[i]}
+            if self.phases[i] == 'X':
+                event['dur'] = self.durations[i]/1000
+            elif self.phases[i] == 'i':
+                event['s'] = 't'
+            events.append(event)
+            tids.add(self.tids[i])
+
+        # add the thread names as metadata events
+        for tid in tids:
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                            'args': {'name': names.get(tid, 'thread %d' % tid)}})
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ns'}, f)
+
+        return len(events)
+
+# shared tracer of the treadmill
+tracer = Tracer()
@@ -0,0 +1,314 @@
+'''
+ * @file    Tracking_Class.py
+ * @author  William Wang
+ * @brief   This script contains the classes of the tracking
+            mode, in which the position of the animal on the
+            belt drives an outer loop that sets the desired
+            speed of the treadmill
+'''
+
+# import the required libraries
+import asyncio
+import os
+import threading
+import time
+from math import pi
+import Metrics_Class
+
+# conversion of a speed from m/s to RPM (as in the User_Input_Class)
+MPS_TO_RPM = (60/pi)/(2/39.3701)
+
+class UltrasonicPosition(object):
+    '''
+    DESCRIPTION: This class is a position source for the PositionTracker that takes the position of the animal
+    from the ultrasonic sensor. The sensor is mounted at the front of the belt facing the animal, so the animal
+    is ahead of the centre of the belt when it is closer to the sensor than the centre is.
+
+    ARGS: ultrasonic (Ultrasonic object from the Ultrasonic_Class), center_distance (distance from the sensor to
+    the centre of the belt in cm)
+    '''
+
+    def __init__(self, ultrasonic, center_distance=30):
+        # instantiation function for the ultrasonic position source
+
+        self.ultrasonic = ultrasonic            # access the ultrasonic object to read the distance
+        self.center_distance = center_distance  # distance from the sensor to the centre of the belt (cm)
+
+    def read(self):
+        '''
+        DESCRIPTION: Function that returns the latest position of the animal
+
+        ARGS: NONE
+
+        RETURN: position (position of the animal ahead of the centre of the belt in m, None if there is no
+        reading), position_time (time.perf_counter() of the reading)
+        '''
+
+        # the time is read first, so a reading that arrives in between is only taken as older than it is
+        position_time = self.ultrasonic.reading_time
+        distance = self.ultrasonic.distance
+        if distance is None:
+            return None, None
+        return (self.center_distance - distance)/100, position_time
+
+class PositionServer(object):
+    '''
+    DESCRIPTION: This class is a position source for the PositionTracker that takes the position of the animal
+    from a stream over a Unix domain socket (i.e. from a script tracking the animal with a camera). The protocol
+    is line based, and there is no reply to a position (only "ERR" lines for lines that cannot be read):
+
+        POS <m> [<time>]        position of the animal ahead of the centre of the belt, and the time the position
+                                was captured (time.monotonic() of the client, which is the same clock as
+                                time.perf_counter() on Linux). The time the line is received is used if no time
+                                is given.
+
+    ARGS: io_loop (IOLoop object from the IO_Loop_Class), socket_path (path of the Unix domain socket)
+    '''
+
+    def __init__(self, io_loop, socket_path='/tmp/treadmill_position.sock'):
+        # instantiation function for the position server
+
+        self.io_loop = io_loop                  # IOLoop object (the server runs on this loop)
+        self.socket_path = socket_path          # path of the Unix domain socket
+
+        # latest position in the form of (position in m, time.perf_counter() of the position)
+        # NOTE: the tuple is replaced with a single attribute assignment, so the tracker always reads a position
+        #       with its own time
+        self.latest = (None, None)
+
+        # start the server on the I/O loop
+        self.server_task = self.io_loop.run_task(self.__startServer())
+
+    def read(self):
+        '''
+        DESCRIPTION: Function that returns the latest position of the animal
+
+        ARGS: NONE
+
+        RETURN: position (position of the animal ahead of the centre of the belt in m, None if no position has
+        been received), position_time (time.perf_counter() of the position)
+        '''
+
+        return self.latest
+
+    async def __startServer(self):
+        '''
+        DESCRIPTION: Coroutine that creates the Unix domain socket and starts accepting clients
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        # remove a socket left over from a previous run
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        self.server = await asyncio.start_unix_server(self.__handleClient, path=self.socket_path)
+
+        # only the owner and group can move the treadmill
+        os.chmod(self.socket_path, 0o660)
+
+    async def __handleClient(self, reader, writer):
+        '''
+        DESCRIPTION: Coroutine that reads the positions from a single client until it disconnects
+
+        ARGS: reader, writer (asyncio streams for the client connection)
+
+        RETURN: NONE
+        '''
+
+        try:
+            while True:
+                line = await reader.readline()
+
+                # the client has disconnected
+                if not line:
+                    break
+
+                receive_time = time.perf_counter()
+                words = line.decode('ascii', errors='replace').split()
+                if not words:
+                    continue
+
+                try:
+                    if words[0].upper() != 'POS' or len(words) not in (2, 3):
+                        raise ValueError
+                    position = float(words[1])
+                    position_time = float(words[2]) if len(words) == 3 else receive_time
+                except ValueError:
+                    writer.write(b'ERR expected POS <m> [<time>]\n')
+                    await writer.drain()
+                    continue
+
+                self.latest = (position, position_time)
+
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+class PositionTracker(object):
+    '''
+    DESCRIPTION: This class runs the outer loop of the tracking mode in its own thread at a fixed rate. Every
+    iteration it reads the latest position of the animal from a position source and sets the desired speed (in
+    the StateStore) to keep the animal at the centre of the belt: the speed is a PID controller of the position
+    (the integral is the speed of the animal, starting from the desired speed when the tracking starts, and the
+    derivative is the filtered velocity of the position, which makes up for the lag of the MotorPID), limited
+    to [min_speed, max_speed] and to max_accel. The MotorPID picks the setpoint up on its next iteration without
+    a ramp (user_changed_velocity is not set).
+    The loop only tracks during a trial (not while the speed is ramping, while the trial ramps down or once a
+    beam has been tripped), so the knob, buttons and terminal input work as before outside of the trials. A
+    change of the desired speed by anything else restarts the integral from the new speed.
+    The latency from the position to the setpoint is bounded: a position older than max_age is not used (the
+    speed is held instead), and the setpoint is written within one period of the outer loop of a new position.
+    NOTE: the position is that of the animal ahead of the centre of the belt in m (positive when the animal is
+    ahead of the centre, so the belt has to speed up).
+
+    ARGS: state_store (StateStore object from the State_Store_Class), source (position source with a read()
+    function returning the position in m and its time.perf_counter(), i.e. UltrasonicPosition or PositionServer),
+    rate (iterations of the outer loop per second), gain (speed in m/s per m of the position), integral_gain (speed
+    in m/s per m*s of the position), derivative_gain (speed in m/s per m/s of the velocity of the position),
+    velocity_filter (time constant of the low-pass filter of the velocity of the position in sec), min_speed and max_speed (limits of the desired speed in m/s), max_accel
+    (largest change of the desired speed in m/s per second), max_age (oldest position used in sec)
+    '''
+
+    def __init__(self, state_store, source, rate=50, gain=2.0, integral_gain=0.5, derivative_gain=1.0,
+                    velocity_filter=0.2, min_speed=0, max_speed=1.5, max_accel=3.0, max_age=0.2):
+        # instantiation function for the position tracker
+
+        self.state_store = state_store          # access the state_store object to set the desired speed
+        self.source = source                    # source of the position of the animal
+        self.period = 1/rate                    # time between the iterations of the outer loop (sec)
+        self.gain = gain                        # proportional gain ((m/s)/m)
+        self.integral_gain = integral_gain      # integral gain ((m/s)/(m*s))
+        self.derivative_gain = derivative_gain  # gain of the velocity of the position ((m/s)/(m/s))
+        self.velocity_filter = velocity_filter  # time constant of the filter of the velocity of the position (sec)
+        self.velocity = 0                       # filtered velocity of the position (m/s)
+        self.last_position = (None, None)       # last new position and its time (for the velocity)
+        self.min_speed = min_speed              # limits of the desired speed (m/s)
+        self.max_speed = max_speed
+        self.max_accel = max_accel              # largest change of the desired speed (m/s^2)
+        self.max_age = max_age                  # oldest position used (sec)
+        self.integral = 0                       # integral term of the PID controller (m/s)
+        self.speed = None                       # desired speed last set by the tracker (m/s, None if not tracking)
+        self.position_time = None               # time.perf_counter() of the last position used for a setpoint
+
+        # version of the TreadmillState, time of the position and time of the setpoint of the last setpoint written
+        # NOTE: replaced with a single attribute assignment (used to measure the latency up to the control loop)
+        self.last_update = (None, None, None)
+        self.running = True                     # whether the outer loop runs
+
+        # metrics of the tracking mode
+        self.position_gauge = Metrics_Class.registry.gauge('treadmill_tracking_position_m', 'Position of the animal ahead of the centre of the belt')
+        self.stale = Metrics_Class.registry.counter('treadmill_tracking_stale_total', 'Number of iterations of the tracking loop without a recent position')
+        self.latency = Metrics_Class.registry.histogram('treadmill_tracking_latency_seconds', 'Time from a position of the animal to the desired speed set from it')
+
+        # create and start the thread of the outer loop
+        # NOTE: daemon thread so that the thread is killed with the main program
+        self.tracking_thread = threading.Thread(target=self.__trackingThread, name='tracking', daemon=True)
+        self.tracking_thread.start()
+
+    def stop(self):
+        '''
+        DESCRIPTION: Function that stops the outer loop (after the current iteration)
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        self.running = False
+
+    def __tracking(self, state):
+        '''
+        DESCRIPTION: Function that tells whether the desired speed is set by the tracker
+
+        ARGS: state (TreadmillState snapshot from the State_Store_Class)
+
+        RETURN: tracking (True during a trial that is not ramping and has no tripped beam)
+        '''
+
+        return (state.program_started and state.trial_started and not state.trial_ramp_down
+                    and not state.user_changed_velocity and state.beam_tripped is None)
+
+    def __trackingThread(self):
+        '''
+        DESCRIPTION: Function running in the tracking thread that runs the outer loop every period
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        next_time = time.perf_counter()
+        while self.running:
+            self.__update()
+
+            # wait for the next iteration (a late iteration moves the following ones instead of being caught up)
+            next_time = next_time + self.period
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.perf_counter()
+
+    def __update(self):
+        '''
+        DESCRIPTION: Function that runs an iteration of the outer loop (sets the desired speed from the latest
+        position)
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        state = self.state_store.snapshot
+        if not self.__tracking(state):
+            self.speed = None
+            return
+
+        # start the integral from the desired speed (and the velocity from 0) when the tracking starts or the speed
+        # has been changed
+        if state.speed_des_mps != self.speed:
+            self.integral = state.speed_des_mps
+            self.velocity = 0
+
+        # hold the speed without a recent position
+        position, position_time = self.source.read()
+        if position is None or time.perf_counter() - position_time > self.max_age:
+            self.stale.inc()
+            self.speed = state.speed_des_mps
+            return
+        self.position_gauge.set(position)
+
+        # velocity of the position (the speed of the animal relative to the belt), from each new position
+        last_position, last_time = self.last_position
+        if position_time != last_time:
+            if last_time is not None and position_time - last_time < self.max_age:
+                dt = position_time - last_time
+                self.velocity = self.velocity + min(dt/self.velocity_filter, 1)*((position - last_position)/dt - self.velocity)
+            self.last_position = (position, position_time)
+
+        # PID controller of the position, limited to the speed range and the acceleration
+        self.integral = min(max(self.integral + self.integral_gain*position*self.period, self.min_speed), self.max_speed)
+        speed = self.integral + self.gain*position + self.derivative_gain*self.velocity
+        speed = min(max(speed, self.min_speed), self.max_speed)
+        step = self.max_accel*self.period
+        speed = min(max(speed, state.speed_des_mps - step), state.speed_des_mps + step)
+
+        def setSpeed(state):
+            # the speed is only set if the tracking has not been stopped in the meantime
+            if not self.__tracking(state) or state.speed_des_mps == speed:
+                return None
+            return {'speed_des_mps': speed, 'speed_des_RPM': speed*MPS_TO_RPM}
+
+        new_state = self.state_store.modify(setSpeed)
+        self.speed = new_state.speed_des_mps
+
+        # time from the position to the setpoint (once for each position)
+        if new_state.version != state.version and position_time != self.position_time:
+            setpoint_time = time.perf_counter()
+            self.latency.observe(setpoint_time - position_time)
+            self.position_time = position_time
+            self.last_update = (new_state.version, position_time, setpoint_time)
@@ -0,0 +1,166 @@
+'''
+ * @file    Ultrasonic_Class.py
+ * @author  William Wang
+ * @brief   This script contains a class that measures
+            distances with the HC-SR04 ultrasonic sensor in
+            the background
+'''
+
+# import the required libraries
+import statistics
+import threading
+import time
+import RPi.GPIO as GPIO
+import Metrics_Class
+
+# speed of sound (cm/s)
+SPEED_OF_SOUND = 34300
+
+# width of the trigger pulse (sec, the sensor needs at least 10 us)
+TRIGGER_PULSE = 0.00001
+
+class Ultrasonic(object):
+    '''
+    DESCRIPTION: This class measures distances with the HC-SR04 ultrasonic sensor from a background thread at a
+    fixed rate. The thread fires the trigger and waits (without polling the pins) for the echo: both edges of the
+    echo pin run a callback that records the time of the edge, and the callback of the falling edge wakes the
+    thread. If no echo has ended within the timeout, the reading is dropped (and counted), so a missing echo
+    never hangs the thread. The trigger is not fired while the echo of a dropped reading is still HIGH, and an
+    edge is only taken as the rising edge if its callback runs after the trigger and reads the echo HIGH, so
+    the late falling edge of a dropped reading is never timed as a new echo. The distance is the median of the
+    last filter_size readings, which rejects the odd reading that was timed late (i.e. a callback delayed by
+    other GPIO callbacks) or that came from a stray echo.
+    NOTE: the distance is read from the distance attribute (a single float, None until the first reading), so
+    reading it from the main loop costs nothing.
+
+    ARGS: trigger_pin, echo_pin (pins of the sensor on the RPi in BCM form), rate (readings per second, the
+    HC-SR04 needs about 60 ms between readings), timeout (longest time in sec from the trigger to the end of
+    the echo, 30 ms is about 5 m), filter_size (number of readings in the median filter)
+    '''
+
+    def __init__(self, trigger_pin=24, echo_pin=25, rate=10, timeout=0.03, filter_size=5):
+        # instantiation function for the ultrasonic sensor
+
+        self.trigger_pin = trigger_pin              # pins of the sensor
+        self.echo_pin = echo_pin
+        self.period = 1/rate                        # time between the readings (sec)
+        self.timeout = timeout                      # longest time from the trigger to the end of the echo (sec)
+        self.filter_size = filter_size              # number of readings in the median filter
+        self.readings = []                          # last readings (cm, oldest first)
+        self.distance = None                        # median of the last readings (cm, None until the first reading)
+        self.reading_time = None                    # time.perf_counter() of the last reading
+        self.trigger_ns = None                      # time.perf_counter_ns() of the trigger of the current reading
+        self.rise_ns = None                         # time.perf_counter_ns() of the rising edge of the echo
+        self.fall_ns = None                         # time.perf_counter_ns() of the falling edge of the echo
+        self.echo_event = threading.Event()         # set by the callback once the echo has ended
+        self.running = True                         # whether the sensor is read
+
+        # metrics of the sensor
+        self.distance_gauge = Metrics_Class.registry.gauge('treadmill_ultrasonic_distance_cm', 'Median distance measured by the ultrasonic sensor')
+        self.timeouts = Metrics_Class.registry.counter('treadmill_ultrasonic_timeouts_total', 'Number of readings of the ultrasonic sensor without an echo in time')
+
+        # set up the pins (the trigger is LOW between the readings)
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(trigger_pin, GPIO.OUT, initial=GPIO.LOW)
+        GPIO.setup(echo_pin, GPIO.IN)
+
+        # time both edges of the echo with a callback
+        GPIO.add_event_detect(echo_pin, GPIO.BOTH, callback = self.__echoEdge)
+
+        # create and start the thread that reads the sensor
+        # NOTE: daemon thread so that the thread is killed with the main program
+        self.sensor_thread = threading.Thread(target=self.__sensorThread, name='ultrasonic', daemon=True)
+        self.sensor_thread.start()
+
+    def stop(self):
+        '''
+        DESCRIPTION: Function that stops reading the sensor (after the current reading)
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        self.running = False
+
+    def __echoEdge(self, channel):
+        '''
+        DESCRIPTION: Callback function that records the time of an edge of the echo pin (the echo pin is LOW
+        from the end of one reading to the trigger of the next)
+
+        ARGS: channel (pin number for the echo pin in BCM format)
+
+        RETURN: NONE
+        '''
+
+        # the first edge after the trigger with the echo HIGH is the rising edge (an edge before the trigger, or
+        # one that reads LOW, is the late falling edge of a dropped reading)
+        # NOTE: a very close object whose echo has already fallen again is dropped with the timeout
+        edge_ns = time.perf_counter_ns()
+        if self.trigger_ns is None or edge_ns < self.trigger_ns:
+            return
+        if self.rise_ns is None:
+            if GPIO.input(channel) == GPIO.HIGH:
+                self.rise_ns = edge_ns
+        elif self.fall_ns is None:
+            self.fall_ns = edge_ns
+            self.echo_event.set()
+
+    def __sensorThread(self):
+        '''
+        DESCRIPTION: Function running in the sensor thread that takes a reading every period
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        next_time = time.perf_counter()
+        while self.running:
+            self.__read()
+
+            # wait for the next reading (a late reading moves the following ones instead of being caught up)
+            next_time = next_time + self.period
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.perf_counter()
+
+    def __read(self):
+        '''
+        DESCRIPTION: Function that fires the trigger and waits for the echo, then updates the median distance
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        # the echo of a dropped reading has not ended yet (the sensor would not fire again)
+        if GPIO.input(self.echo_pin) == GPIO.HIGH:
+            self.timeouts.inc()
+            return
+
+        # forget the edges of the last reading before firing the trigger
+        self.rise_ns = None
+        self.fall_ns = None
+        self.echo_event.clear()
+        self.trigger_ns = time.perf_counter_ns()
+
+        GPIO.output(self.trigger_pin, GPIO.HIGH)
+        time.sleep(TRIGGER_PULSE)
+        GPIO.output(self.trigger_pin, GPIO.LOW)
+
+        if not self.echo_event.wait(self.timeout):
+            self.timeouts.inc()
+            return
+
+        # the echo is HIGH for the time the sound takes there and back
+        reading = (self.fall_ns - self.rise_ns)*1e-9*SPEED_OF_SOUND/2
+
+        self.readings.append(reading)
+        if len(self.readings) > self.filter_size:
+            del self.readings[0]
+        self.distance = statistics.median(self.readings)
+        self.reading_time = time.perf_counter()
+        self.distance_gauge.set(self.distance)
@@ -6,101 +6,154 @@
 '''
 
 # import required modules
+import asyncio
+import os
 import queue
-import threading
-import time
+import stat
+import sys
 from math import pi
+from Tracer_Class import tracer
 
 class UserInput(object):
     '''
-    DESCRIPTION: This class entails several functions that run a separate thread which handle user inputs 
+    DESCRIPTION: This class entails several functions that run a task on the IOLoop which handles user inputs 
     over the terminal regarding changing the speed of the DC motor
 
+    The desired and preset speeds (in m/s and RPM) are kept in the StateStore so that the main loop reads
+    them together with the trial and safety flags in one snapshot.
+
     ARGS: input_mode ("m/s" indicates to input speeds in terms of m/s, "PWM" indicates to input speeds
-    in terms of PWM values (-480 to 480))
+    in terms of PWM values (-480 to 480)), io_loop (IOLoop object from the IO_Loop_Class), state_store
+    (StateStore object from the State_Store_Class)
     '''
 
-    def __init__(self, input_mode):
+    def __init__(self, input_mode, io_loop, state_store):
         # instantiation function
         
-        self.speed_des_mps = 0          # initially set the desired speed to be 0 m/s
-        self.speed_des_RPM = 0          # desired speed in RPM
-        self.speed_des_PWM = 0          # desired speed in terms of PWM
-        self.preset_speed_mps = 0       # stores the preset speed in terms of m/s
-        self.preset_speed_RPM = 0       # stores the preset speed in terms of RPM
-        self.speed_des_lock = threading.Lock()      # lock used to access any of the speed_des variables
-        self.user_changed_velocity = False          # initially set the motor to maintain velocities
+        self.speed_des_PWM = 0          # desired speed in terms of PWM (only used by the open loop PWM scripts)
+        self.state_store = state_store  # StateStore object (holds the desired speed, preset speed and the user_changed_velocity flag)
         self.q = queue.Queue()      # queue used to pass information from the user input to the motors
-        self.input_mode = input_mode        # string that specifies what type of user thread to run
+        self.input_mode = input_mode        # string that specifies what type of user input task to run
+        self.io_loop = io_loop              # IOLoop object (the terminal input and console prints run on this loop)
 
-        # create a thread that runs the user input function (obtain user defined speeds)
-        # NOTE: This is a daemon thread which allows the thread to be killed when the main program is killed,
-        #       or else main thread will not be killed
+        # start the task that handles the user inputs from the terminal on the I/O loop
         
         # if user wants to input m/s values
         if self.input_mode == 'm/s':
-            self.user_input_thread = threading.Thread(target=self.__getUserInput, daemon=True)
-            
-            # start the thread upon instantiation
-            self.user_input_thread.start()
+            self.user_input_task = self.io_loop.run_task(self.__getUserInput())
 
         # if user wants to input PWM values
         elif self.input_mode == 'PWM':
-            self.user_input_thread = threading.Thread(target=self.__getUserPWM, daemon=True)
-            self.user_input_thread.start()
+            self.user_input_task = self.io_loop.run_task(self.__getUserPWM())
+
+    def __openStdin(self):
+        '''
+        DESCRIPTION: Function (run on the I/O loop) that creates a stream reader for the terminal input.
+        NOTE: the reader is fed whenever stdin is readable, so stdin is never put into non-blocking mode
+        (which would also affect prints to the same terminal). Only a terminal or a pipe can be watched by the
+        loop, so with any other stdin (i.e. /dev/null under systemd, or a file) the reader only has the EOF
+
+        ARGS: NONE
+
+        RETURN: reader (asyncio.StreamReader with the terminal input)
+        '''
+
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+
+        # no terminal or pipe to read from
+        try:
+            fd = sys.stdin.fileno()
+            mode = os.fstat(fd).st_mode
+        except (AttributeError, ValueError, OSError):
+            reader.feed_eof()
+            return reader
+        if not (os.isatty(fd) or stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode)):
+            reader.feed_eof()
+            return reader
+
+        def feed_reader():
+            # read what is available (the fd is readable so this does not block)
+            data = os.read(fd, 1024)
+            if data:
+                reader.feed_data(data)
+            else:
+                # end of the input (i.e. running as a service without a terminal)
+                loop.remove_reader(fd)
+                reader.feed_eof()
+
+        try:
+            loop.add_reader(fd, feed_reader)
+        except OSError:
+            # the fd cannot be watched by the loop
+            reader.feed_eof()
+
+        return reader
 
-    def __getUserInput(self):
+    async def __getUserInput(self):
         '''
-        DESCRIPTION: Function running in child thread that waits for user inputs for speeds in terms of m/s
+        DESCRIPTION: Coroutine running on the I/O loop that waits for user inputs for speeds in terms of m/s
 
         ARGS: NONE
 
         RETURN: NONE
         '''
 
-        # loop that is always waiting for a user input for the speed (running on a separate thread)
+        reader = self.__openStdin()
+
+        # loop that is always waiting for a user input for the speed
         while True:
-            try:
-                # if statement prevents user from inputting new speeds until the ramp has completed
-                if not self.user_changed_velocity:
-                    # obtain the user input for the motor speed
-                    user_input = input('Enter a motor speed in meters/second (range from [-1.5, 1.5] m/s): ')
+            # prevent the user from inputting new speeds until the ramp has completed
+            while self.state_store.snapshot.user_changed_velocity:
+                await asyncio.sleep(0.01)
 
-                    # try to turn the input into a float (will throw an exception if it doesn't work)
-                    user_input = float(user_input)
+            # obtain the user input for the motor speed
+            print('Enter a motor speed in meters/second (range from [-1.5, 1.5] m/s): ', end='', flush=True)
+            user_input = await reader.readline()
 
-                    # check the number to see if it is in the correct range (0 m/s to 1.5 m/s)
-                    if not ((user_input >= -1.5) and (user_input <= 1.5)):
-                        print("The speed you entered is not within the specified range. Please enter a new speed.")
-                    else:
-                        self.q.put(user_input)       # put the user-defined speed on the queue in m/s
+            # stop waiting for inputs if there is no terminal
+            if not user_input:
+                return
 
-                    # wait for a bit to allow the confirmation statement to print
-                    time.sleep(0.2)
+            try:
+                # try to turn the input into a float (will throw an exception if it doesn't work)
+                user_input = float(user_input)
 
+                # check the number to see if it is in the correct range (0 m/s to 1.5 m/s)
+                if not ((user_input >= -1.5) and (user_input <= 1.5)):
+                    print("The speed you entered is not within the specified range. Please enter a new speed.")
                 else:
-                    # Wait for some time to prevent thread from using too many resources
-                    time.sleep(0.001)
+                    self.q.put(user_input)       # put the user-defined speed on the queue in m/s
+
+                # wait for a bit to allow the confirmation statement to print
+                await asyncio.sleep(0.2)
 
             except ValueError:
                 print("You did not enter a number in the correct format (check for any unwanted characters, spaces, etc).")
                 print("Please enter your speed again.")
 
-    def __getUserPWM(self):
+    async def __getUserPWM(self):
         '''
-        DESCRIPTION: Function running in child thread that waits for user inputs for speeds in terms of PWM (-480 to 480)
+        DESCRIPTION: Coroutine running on the I/O loop that waits for user inputs for speeds in terms of PWM (-480 to 480)
 
         ARGS: NONE
 
         RETURN: NONE
         '''
 
-        # loop that is always waiting for a user input for the speed (running on a separate thread)
+        reader = self.__openStdin()
+
+        # loop that is always waiting for a user input for the speed
         while True:
-            try:
-                # obtain the user input for the motor speed
-                user_input = input('Enter a motor speed in PWM (range from [-480, 480]): ')
+            # obtain the user input for the motor speed
+            print('Enter a motor speed in PWM (range from [-480, 480]): ', end='', flush=True)
+            user_input = await reader.readline()
+
+            # stop waiting for inputs if there is no terminal
+            if not user_input:
+                return
 
+            try:
                 # try to turn the input into a float (will throw an exception if it doesn't work)
                 user_input = float(user_input)
 
@@ -111,7 +164,7 @@ class UserInput(object):
                     self.q.put(user_input)       # put the user-defined speed on the queue
 
                 # After successfully sending a user input, wait a bit before sending the next input
-                time.sleep(0.2)
+                await asyncio.sleep(0.2)
 
             except ValueError:
                 print("You did not enter a number in the correct format (check for any unwanted characters, spaces, etc).")
@@ -127,16 +180,36 @@ class UserInput(object):
         RETURN: NONE
         '''
 
-        # determine the desired speed from the user (in m/s) and covert it to RPM
-        try:
-            with self.speed_des_lock:
-                self.speed_des_mps = self.q.get(block=False)                  # False used to prevent code on waiting for info
-                print(f'Current desired speed updated to: {self.speed_des_mps} m/s')
-                self.user_changed_velocity = True
-                self.speed_des_RPM = self.speed_des_mps*(60/pi)/(2/39.3701)       # conversion to RPM
+        # nothing to do if there is no new input (checked first so that no queue.Empty exception is created
+        # every iteration of the main loop)
+        if self.q.empty():
+            return
 
+        # determine the desired speed from the user (in m/s)
+        try:
+            speed_des_mps = self.q.get(block=False)                  # False used to prevent code on waiting for info
         except queue.Empty:
-            pass
+            return
+
+        self.setDesiredSpeed(speed_des_mps)
+
+    def setDesiredSpeed(self, speed_des_mps):
+        '''
+        DESCRIPTION: Function that updates the desired speed and flags the main loop to ramp to it. This is
+        the setpoint path shared by the terminal input and the ControlServer (can be called from any thread)
+
+        ARGS: speed_des_mps (desired speed in m/s, already checked to be within [-1.5, 1.5] m/s)
+
+        RETURN: NONE
+        '''
+
+        tracer.instant('desired speed set')
+
+        # update the desired speed (in m/s) and covert it to RPM
+        self.state_store.update(speed_des_mps=speed_des_mps, user_changed_velocity=True,
+                                speed_des_RPM=speed_des_mps*(60/pi)/(2/39.3701))      # conversion to RPM
+
+        self.io_loop.console_print(f'Current desired speed updated to: {speed_des_mps} m/s')
 
     def readUserPWM(self):
         '''
@@ -149,10 +222,10 @@ class UserInput(object):
         '''
 
         # determine the desired speed from the user
+        # NOTE: speed_des_PWM is only written and read by the main thread, so it does not need the StateStore
         try:
-            with self.speed_des_lock:
-                self.speed_des_PWM = self.q.get(block=False)                  # False used to prevent code on waiting for info
-                print(f'Current desired speed updated to: {self.speed_des_PWM}')
+            self.speed_des_PWM = self.q.get(block=False)                  # False used to prevent code on waiting for info
+            self.io_loop.console_print(f'Current desired speed updated to: {self.speed_des_PWM}')
 
         except queue.Empty:
             pass
@@ -167,7 +240,46 @@ class UserInput(object):
         RETURN: NONE
         '''
 
-        with self.speed_des_lock:
-            self.speed_des_mps = 0
-            self.speed_des_RPM = 0
-            self.user_changed_velocity = True        # allows the system to ramp the speed down
+        # allows the system to ramp the speed down
+        self.state_store.update(speed_des_mps=0, speed_des_RPM=0, user_changed_velocity=True)
+
+    def savePresetSpeed(self):
+        '''
+        DESCRIPTION: Function that saves the current desired speed as the preset speed for any future trials and
+        sends the motor speed to zero (in preparation for a trial with the preset speed). Both are done in one
+        update so the main loop never sees one without the other.
+
+        ARGS: NONE
+
+        RETURN: state (the new TreadmillState snapshot)
+        '''
+
+        return self.state_store.modify(lambda state: {'preset_speed_mps': state.speed_des_mps,
+                                                        'preset_speed_RPM': state.speed_des_RPM,
+                                                        'speed_des_mps': 0, 'speed_des_RPM': 0,
+                                                        'user_changed_velocity': True})
+
+    def rampCompleted(self, speed_des_RPM):
+        '''
+        DESCRIPTION: Function called by the main loop after a ramp that resets the user_changed_velocity flag.
+        The flag is left set if the desired speed has been changed during the ramp, so that the main loop
+        ramps again to the new speed instead of losing it. The trial_ramp_down flag is reset at the same time
+        (the ramp down at the end of a trial has been completed).
+
+        ARGS: speed_des_RPM (desired speed in RPM the main loop has ramped to)
+
+        RETURN: trial_stopped (True if the ramp was the ramp down at the end of a trial)
+        '''
+
+        trial_stopped = False
+
+        def reset(state):
+            # reset both flags in a single update of the snapshot (neither if the speed was changed during the ramp)
+            nonlocal trial_stopped
+            if state.speed_des_RPM != speed_des_RPM:
+                return None
+            trial_stopped = state.trial_ramp_down
+            return {'user_changed_velocity': False, 'trial_ramp_down': False}
+
+        self.state_store.modify(reset)
+        return trial_stopped
@@ -0,0 +1,174 @@
+'''
+ * @file    Watchdog_Class.py
+ * @author  William Wang
+ * @brief   This script contains a class for a watchdog
+            that stops the motor if the control loop stops
+            updating it (i.e. the loop is blocked)
+'''
+
+# import the required libraries
+import os
+import sys
+import threading
+import time
+import traceback
+import Exceptions
+import Metrics_Class
+
+# time between the checks of a tripped watchdog for the control loop to stop (sec)
+TRIPPED_POLL_DELAY = 0.01
+
+class Watchdog(object):
+    '''
+    DESCRIPTION: This class runs a watchdog thread for the control loop. The control loop kicks the watchdog
+    every time it updates the PID controller (kick() only stores the time), and the watchdog thread sleeps until
+    the deadline after the last kick. If there has been no kick by then, the watchdog:
+        - stops the motor through the motor driver (motors.forceStop())
+        - records the stack of the stalled control thread, which is printed with the time of the stall
+        - raises a WatchdogFault from the next kick, so the control loop stops (and never sets a speed again)
+          once it is no longer blocked
+    The watchdog only runs while it is armed (from the start to the end of a run of the treadmill).
+    NOTE: the watchdog thread needs the GIL, so a stall inside a C function that holds the GIL (i.e. a long
+    garbage collection) is only detected once the GIL has been released. A stall on I/O, a sleep or a lock is
+    detected at the deadline.
+
+    ARGS: motors (motors object from single_tb9051ftg_motor_driver module), deadline (time in sec without a
+    kick before the motor is stopped), cpu (CPU of the control loop, the watchdog thread runs on the other CPUs
+    so it is never starved by a real-time control loop, no pinning if None), enabled (whether the watchdog is
+    used, it is never armed otherwise)
+    '''
+
+    def __init__(self, motors, deadline=0.5, cpu=None, enabled=True):
+        # instantiation function for the watchdog
+
+        self.motors = motors                    # motors object (stopped when the control loop stalls)
+        self.deadline = deadline                # time without a kick before the motor is stopped (sec)
+        self.cpu = cpu                          # CPU of the control loop (the watchdog thread avoids it)
+        self.enabled = enabled                  # whether the watchdog is used
+        self.kick_time = 0                      # time of the last kick
+        self.armed = False                      # whether the control loop is being watched
+        self.tripped = False                    # whether the motor has been stopped by the watchdog
+        self.control_thread_id = None           # id of the thread that armed the watchdog (the control thread)
+        self.stall_kick_time = 0                # time of the last kick before the stall
+        self.stall_stack = ''                   # stack of the control thread when the stall was detected
+        self.arm_event = threading.Event()      # set while the watchdog is armed
+
+        # metrics of the watchdog
+        self.stalls = Metrics_Class.registry.counter('treadmill_watchdog_stalls_total', 'Number of times the watchdog stopped a stalled control loop')
+        self.stall_time = Metrics_Class.registry.histogram('treadmill_watchdog_stall_seconds', 'Time the control loop was stalled for (from its last kick to the next)')
+        self.detection_time = Metrics_Class.registry.histogram('treadmill_watchdog_detection_seconds', 'Time from the deadline of a stalled control loop to the motor being stopped')
+
+        # create and start the watchdog thread
+        # NOTE: daemon thread so that the watchdog is killed with the main program
+        if self.enabled:
+            self.watchdog_thread = threading.Thread(target=self.__watchdogThread, name='watchdog', daemon=True)
+            self.watchdog_thread.start()
+
+    def arm(self):
+        '''
+        DESCRIPTION: Function called from the control thread at the start of a run that starts watching the
+        control loop
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        if not self.enabled:
+            return
+        self.control_thread_id = threading.get_ident()
+        self.tripped = False
+        self.kick_time = time.perf_counter()
+        self.armed = True
+        self.arm_event.set()
+
+    def disarm(self):
+        '''
+        DESCRIPTION: Function called from the control thread at the end of a run (once the motor has been
+        stopped) that stops watching the control loop
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        self.armed = False
+        self.arm_event.clear()
+
+    def kick(self):
+        '''
+        DESCRIPTION: Function called from the control loop every time it updates the PID controller
+
+        ARGS: NONE
+
+        RETURN: NONE (raises a WatchdogFault if the motor has been stopped by the watchdog)
+        '''
+
+        self.kick_time = time.perf_counter()
+        if self.tripped:
+            self.__stalled()
+
+    def __stalled(self):
+        '''
+        DESCRIPTION: Function called from the first kick after the motor has been stopped by the watchdog, that
+        records the time of the stall and stops the control loop
+
+        ARGS: NONE
+
+        RETURN: NONE (raises a WatchdogFault)
+        '''
+
+        stall_time = self.kick_time - self.stall_kick_time
+        self.stall_time.observe(stall_time)
+        self.disarm()
+        self.tripped = False
+        raise Exceptions.WatchdogFault(stall_time=stall_time)
+
+    def __watchdogThread(self):
+        '''
+        DESCRIPTION: Function running in the watchdog thread that sleeps until the deadline after the last kick,
+        and stops the motor if the control loop has not kicked the watchdog by then
+
+        ARGS: NONE
+
+        RETURN: NONE
+        '''
+
+        # run on the CPUs the control loop does not use (pid 0 is the calling thread)
+        if self.cpu is not None:
+            cpus = os.sched_getaffinity(0) - {self.cpu}
+            if not cpus:
+                cpus = set(range(os.cpu_count())) - {self.cpu}
+            try:
+                os.sched_setaffinity(0, cpus)
+            except OSError:
+                pass
+
+        while True:
+            self.arm_event.wait()
+
+            # wait until the deadline after the last kick (the control loop has kicked again if it has moved)
+            remaining = self.kick_time + self.deadline - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+                continue
+            if not self.armed or self.tripped:
+                continue
+
+            # the control loop has stalled, stop the motor first
+            self.stall_kick_time = self.kick_time
+            self.tripped = True
+            self.motors.forceStop()
+            stop_time = time.perf_counter()
+            self.detection_time.observe(stop_time - self.stall_kick_time - self.deadline)
+            self.stalls.inc()
+
+            # record where the control thread is stuck
+            frame = sys._current_frames().get(self.control_thread_id)
+            self.stall_stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+            print("\nWatchdog: no update of the control loop for %.0f ms, motor stopped. Stack of the control loop:\n%s" %
+                    ((stop_time - self.stall_kick_time)*1000, self.stall_stack), flush=True)
+
+            # wait until the control loop has stopped (or is disarmed) before watching it again
+            while self.tripped and self.armed:
+                time.sleep(TRIPPED_POLL_DELAY)
@@ -6,41 +6,61 @@
 '''
 
 # import required modules
-from single_tb9051ftg_rpi import Motor, Motors, MAX_SPEED
-from Encoder_Class import Encoder
-from IR_Break_Beam_Class import IRBreakBeam
-from PID_Controller_Class import MotorPID
+# NOTE: the libraries of the devices (board, digitalio, the LCD, the motor driver and RPi.GPIO) are only imported
+#       by the functions that create the devices, so that they are imported in parallel during the startup
+#       (and not at all by the control process of --isolated for the devices it does not use)
+import time
+STARTUP_TIME = time.perf_counter()          # time the script started (the startup phases are timed from here)
 from User_Input_Class import UserInput
-from Knob_Class import Knob
-from LCD_Class import LCD
-from Data_Collection_Class import DataLogger
-import Buttons_Class
+from Data_Collection_Class import DataLogger, DataLoggerGroup
+from Flight_Recorder_Class import FlightRecorder
+from Callback_Worker_Class import CallbackWorker
+from State_Store_Class import StateStore
+from Persistent_State_Class import PersistentState
+from IO_Loop_Class import IOLoop
+from Control_Server_Class import ControlServer
+from Telemetry_Class import TelemetryPublisher
+import Metrics_Class
+from Loop_Profiler_Class import LoopProfiler
+from Main_Loop_Class import (MainLoopIteration, PROFILE_STAGES, STAGE_FAULT, STAGE_STATE, STAGE_STOPPED,
+                                STAGE_BEAMS, STAGE_MOTOR)
+from Tracer_Class import tracer
+from Instrumented_Lock_Class import lock_stats
+from Realtime_Class import RealtimeMode
 import Exceptions
-import RPi.GPIO as GPIO
-import time
-import board
-import digitalio
+import argparse
+import concurrent.futures
+import functools
 
-# Create a StartStopButton object which will be used to start/stop the main function via a service
-start_button = Buttons_Class.StartStopButton(button_pin=17)
+# time the main loop sleeps between iterations when the control loop runs in its own process (sec)
+ISOLATED_LOOP_DELAY = 0.005
 
-def main():
-    '''
-    DESCRIPTION: main function that executes the treadmill script
+# time between the checks of the start button while the treadmill is idle (sec)
+START_POLL_DELAY = 0.01
 
-    ARGS: NONE
+# states of the treadmill service (treadmill_service_state metric)
+SERVICE_IDLE, SERVICE_RUNNING, SERVICE_FAULTED = range(3)
 
-    RETURN: NONE
+# faults that can stop the motor during the ramp down of a stop
+RAMP_FAULTS = (Exceptions.WatchdogFault, Exceptions.StallFault)
+
+# longest time the startup waits for the servers and the control process to be ready (sec)
+READY_TIMEOUT = 10
+
+def createLCD(io_loop, fast_lcd=False):
     '''
+    DESCRIPTION: Function that creates the LCD object (requires some setup with the input pins)
 
-    # pass in the start_button as a global variable
-    global start_button
+    ARGS: io_loop (IOLoop object from the IO_Loop_Class), fast_lcd (whether the LCD is written through the
+    GPIO registers once it has been set up)
 
-    # print start statement for the program to the terminal
-    print("Program starting")
+    RETURN: lcd (LCD object)
+    '''
+
+    import board
+    import digitalio
+    from LCD_Class import LCD
 
-    # ---------------- Create various objects required for the script --------------------- #
-    # Create the LCD object for the LCD screen (requires some setup with the input pins)
     # Size of the LCD
     lcd_columns = 16
     lcd_rows = 2
@@ -53,201 +73,683 @@ def main():
     lcd_d6 = digitalio.DigitalInOut(board.D5)
     lcd_d7 = digitalio.DigitalInOut(board.D6)
 
+    # BCM numbers of the same pins (rs, en, d4, d5, d6, d7) for the fast write path
+    fast_pins = (9, 11, 8, 7, 5, 6) if fast_lcd else None
+
     # Initialise the lcd class
-    lcd = LCD(lcd_rs, lcd_en, lcd_d4, lcd_d5, lcd_d6,
-                                        lcd_d7, lcd_columns, lcd_rows)
+    return LCD(lcd_rs, lcd_en, lcd_d4, lcd_d5, lcd_d6,
+                                        lcd_d7, lcd_columns, lcd_rows, io_loop, fast_pins=fast_pins)
+
+def createControlHardware(state_store, encoder_sample_rate=0, channels=None):
+    '''
+    DESCRIPTION: Function that creates the hardware used by the control loop (motor driver, encoder and IR
+    break beam sensors). With --isolated this is called in the control process instead (so it has to stay
+    a module-level function).
+
+    ARGS: state_store (StateStore object from the State_Store_Class where the IR sensors record their trips),
+    encoder_sample_rate (samples per second of the sampling mode of the encoder, per-edge callbacks if 0),
+    channels (list of ChannelConfig from the Motor_Channels_Class to create a motor driver and an encoder for
+    each channel, or None for the single motor)
+
+    RETURN: motor1, motors, encoder, IR_array (with channels, motor1 and encoder are lists of the motor and the
+    encoder of each channel, and motors is a MotorGroup)
+    '''
+
+    from single_tb9051ftg_rpi import Motor, Motors
+    from Encoder_Class import Encoder
+    from IR_Break_Beam_Class import IRBreakBeamArray
+
+    if channels is None:
+        # Create the Motor and Motors objects
+        motor1 = Motor(pwm1_pin=12, pwm2_pin=13, en_pin=19, enb_pin=16, diag_pin=26)
+        motors = Motors(motor1)
+
+        # Create an encoder object
+        encoder = Encoder(ENCA=20, ENCB=21, sample_rate=encoder_sample_rate)
+    else:
+        # Create the motor and the encoder of each channel (the motors of every channel are stopped together)
+        from Motor_Channels_Class import MotorGroup
+        motor1 = [Motor(**channel.motor_pins) for channel in channels]
+        motors = MotorGroup([Motors(motor) for motor in motor1])
+        encoder = [Encoder(ENCA=channel.encoder_pins[0], ENCB=channel.encoder_pins[1], sample_rate=encoder_sample_rate)
+                    for channel in channels]
+
+    # Create the IR break beam sensors (add the pins of any new sensors around the belt here)
+    IR_array = IRBreakBeamArray(state_store=state_store, beam_pins=(18, 23))
+
+    return motor1, motors, encoder, IR_array
+
+def announceRamp(io_loop, lcd, des_spd_mps):
+    '''
+    DESCRIPTION: Function that tells the user the speed is ramping
+
+    ARGS: io_loop (IOLoop object), lcd (LCD object), des_spd_mps (speed in m/s that is being ramped to)
+
+    RETURN: NONE
+    '''
+
+    # print message that the speed is ramping
+    io_loop.console_print("Ramping speed to: %.2f m/s" % des_spd_mps)
+    msg = "Ramping speed\nto: %.2f m/s" % des_spd_mps
+    lcd.sendtoLCDThread(target="main", msg=msg, duration=5, clr_before=True, clr_after=True)
+
+def completeRamp(io_loop, lcd, user_input, speed_des):
+    '''
+    DESCRIPTION: Function called once a ramp has been completed that resets the flags of the ramp and tells
+    the user if it has ended a trial
+
+    ARGS: io_loop (IOLoop object), lcd (LCD object), user_input (UserInput object), speed_des (speed in RPM
+    that has been ramped to)
 
-    # Create the Motor and Motors objects
-    motor1 = Motor(pwm1_pin=12, pwm2_pin=13, en_pin=19, enb_pin=16, diag_pin=26)
-    motors = Motors(motor1)
+    RETURN: NONE
+    '''
+
+    io_loop.console_print("Ramp completed")
+
+    # reset flags (unless the speed was changed during the ramp) and print the trial ended messages
+    if user_input.rampCompleted(speed_des_RPM=speed_des):
+        io_loop.console_print("\nExperiment stopped")
+        msg = "Trial stopped"
+        lcd.sendtoLCDThread(target="knob", msg=msg, duration=2, clr_before=True, clr_after=True)
+
+def rampDown(motor_control, lcd, recorder, service_state):
+    '''
+    DESCRIPTION: Function that slows the motor down to a halt once the treadmill has stopped. The watchdog and
+    the stall detector are still armed during the ramp down (i.e. a beam fault with a jammed belt), so a fault
+    during the ramp is reported (the motor has already been stopped) instead of escaping the handler of the
+    first stop
+
+    ARGS: motor_control (MotorPID object), lcd (LCD object), recorder (FlightRecorder object), service_state
+    (gauge of the state of the service)
+
+    RETURN: NONE
+    '''
+
+    try:
+        motor_control.changeMotorVelocity(ramp_time=2, speed_des=0)
+    except RAMP_FAULTS as fault:
+        reportRampFault(fault=fault, lcd=lcd, recorder=recorder, service_state=service_state)
 
-    # Create an encoder object
-    encoder = Encoder(ENCA=20, ENCB=21)
+def reportRampFault(fault, lcd, recorder, service_state):
+    '''
+    DESCRIPTION: Function that tells the user a fault has stopped the motor during the ramp down of a stop (in
+    this process, or in the control process with --isolated), and faults the treadmill
 
-    # Create a IR break beam sensor object
-    IR_sen = IRBreakBeam(beam_pin=18)
+    ARGS: fault (exception raised during the ramp down), lcd (LCD object), recorder (FlightRecorder object),
+    service_state (gauge of the state of the service)
 
-    # Create a second IR break beam object
-    IR_sen_2 = IRBreakBeam(beam_pin=23)
+    RETURN: NONE
+    '''
 
-    # Create user input object
-    user_input = UserInput(input_mode='m/s')
+    if isinstance(fault, Exceptions.StallFault):
+        print("\nMotor stalled with a control signal of %.0f during the ramp down, motor stopped!" % fault.control_sig)
+        msg = "Motor stalled!"
+        reason = 'stall'
+    else:
+        print("\nControl loop stalled for %.0f ms during the ramp down, motor stopped!" % (fault.stall_time*1000))
+        msg = "Loop stalled!"
+        reason = 'watchdog'
+    lcd.sendtoLCDThread(target="main", msg=msg, duration=0, clr_before=True, clr_after=False)
+    recorder.dump(reason=reason)
+    service_state.set(SERVICE_FAULTED)
+
+def main(args):
+    '''
+    DESCRIPTION: main function that executes the treadmill script (sets up the treadmill once, and then runs
+    the main loop every time the start/stop button is pressed until the service is stopped)
 
-    # Create data collection object
-    data_logger = DataLogger()
+    ARGS: args (command line arguments from argparse)
 
-    # Create object for the knob (requires the user_input object)
-    knob = Knob(user_input=user_input, lcd=lcd, clk=2, dt=3, sw=4)
+    RETURN: NONE
+    '''
 
-    # Create object for the preset speed button (requires the user_input object)
-    preset_speed_button = Buttons_Class.PresetSpeedButton(button_pin=27, user_input=user_input, lcd=lcd)
+    # pass in the start_button, callback_worker, state_store and realtime as global variables
+    global start_button, callback_worker, state_store, realtime
 
-    # Create object for the experiment button
-    exp_button = Buttons_Class.ExperimentButton(button_pin=22, camera_pin=10, data_collector=data_logger,
-                                                        user_input=user_input, lcd=lcd)
+    # print start statement for the program to the terminal
+    print("Program starting")
 
-    # Create a PID control object
-    motor_control = MotorPID(motor=motor1, encoder=encoder, lcd=lcd, data_logger=data_logger, exp_button=exp_button)
+    # time of each phase of the startup (printed once the treadmill is ready)
+    startup_phases = [('imports', time.perf_counter())]
 
-    # execute the main loop for the treadmill
+    # ---------------- Create various objects required for the script --------------------- #
+    # Create the I/O loop that runs the terminal input, LCD, console prints and data logging
+    io_loop = IOLoop()
+
+    # Read the settings saved before the last restart (preset speed, gains and step size of the knob), the preset
+    # speed is restored so that a trial at the preset speed only takes a press of the experiment button
+    persistent_state = PersistentState(io_loop=io_loop)
+    gains = persistent_state.get('gains')
+    state_store.update(preset_speed_mps=persistent_state.get('preset_speed_mps'),
+                        preset_speed_RPM=persistent_state.get('preset_speed_RPM'))
+    if persistent_state.loaded:
+        print("Restored preset speed of %.2f m/s (settings read in %.2f ms)" % (persistent_state.get('preset_speed_mps'),
+                                                                                persistent_state.load_time*1000))
+
+    # Read the configuration of the motor channels (only with --channels)
+    if args.channels is not None:
+        from Motor_Channels_Class import loadChannels
+        channels = loadChannels(args.channels)
+        print("Running %d motor channels: %s" % (len(channels), ", ".join(channel.name for channel in channels)))
+    else:
+        channels = None
+
+    # Create the control process and start it straight away (--isolated), it imports its modules and sets up
+    # the hardware of the control loop while the rest of the treadmill is created
+    if args.isolated:
+        from Control_Process_Class import (ControlProcess, raiseIfStopped, KIND_SAMPLE, KIND_ROW,
+                                            KIND_RAMP_STARTED, KIND_RAMP_COMPLETED, KIND_STOPPED,
+                                            STOP_WATCHDOG, STOP_STALL)
+        hardware_factory = functools.partial(createControlHardware, encoder_sample_rate=args.encoder_sample_rate,
+                                                channels=channels)
+        control_process = ControlProcess(hardware_factory=hardware_factory, realtime=args.realtime, gains=gains,
+                                            watchdog_deadline=args.watchdog_deadline, stall_time=args.stall_time,
+                                            channels=channels)
+        control_process.start(state=state_store.snapshot)
+    else:
+        control_process = None
+
+    # the devices are created in parallel (the LCD and the hardware of the control loop first, then the knob
+    # and the buttons, which need the LCD), while this thread creates the objects that do not use any devices
+    from Knob_Class import Knob
+    import Buttons_Class
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3, thread_name_prefix='startup') as startup_pool:
+        # Create the LCD object for the LCD screen
+        lcd_future = startup_pool.submit(createLCD, io_loop=io_loop, fast_lcd=args.fast_lcd)
+
+        # Create the hardware of the control loop (in the control process with --isolated)
+        if control_process is None:
+            hardware_future = startup_pool.submit(createControlHardware, state_store=state_store,
+                                                    encoder_sample_rate=args.encoder_sample_rate, channels=channels)
+
+        # Create user input object
+        user_input = UserInput(input_mode='m/s', io_loop=io_loop, state_store=state_store)
+
+        # Create data collection object (a log for each channel with --channels, the rows of the control process
+        # are logged to the log of their channel)
+        if channels is None:
+            data_logger = DataLogger(io_loop=io_loop)
+            channel_loggers = [data_logger]
+        else:
+            channel_loggers = [DataLogger(io_loop=io_loop, name=channel.name) for channel in channels]
+            data_logger = DataLoggerGroup(loggers=channel_loggers)
+
+        # Create the flight recorder that always keeps the last seconds of the control loop (saved when the treadmill stops)
+        recorder = FlightRecorder(io_loop=io_loop)
+
+        # Create the profiler for the stages of the main loop (only records when --profile is given, and not with --isolated)
+        profiler = LoopProfiler(stage_names=PROFILE_STAGES, enabled=(args.profile and not args.isolated))
+
+        # Create the telemetry publisher that streams the control loop to the telemetry_viewer.py script
+        telemetry = TelemetryPublisher(io_loop=io_loop)
+
+        # Create the server for the metrics (i.e. curl http://127.0.0.1:9105/metrics)
+        metrics_server = Metrics_Class.MetricsServer(io_loop=io_loop)
+        loop_time = Metrics_Class.registry.histogram('treadmill_loop_iteration_seconds', 'Time of an iteration of the main loop')
+
+        lcd = lcd_future.result()
+
+        # Create object for the knob (requires the user_input object)
+        knob_future = startup_pool.submit(Knob, user_input=user_input, lcd=lcd, callback_worker=callback_worker,
+                                            clk=2, dt=3, sw=4, persistent_state=persistent_state)
+
+        # Create object for the preset speed button (requires the user_input object)
+        preset_future = startup_pool.submit(Buttons_Class.PresetSpeedButton, button_pin=27, user_input=user_input,
+                                                lcd=lcd, callback_worker=callback_worker, persistent_state=persistent_state)
+
+        # Create object for the experiment button
+        exp_button = Buttons_Class.ExperimentButton(button_pin=22, camera_pin=10, data_collector=data_logger,
+                                                            user_input=user_input, lcd=lcd, callback_worker=callback_worker,
+                                                            state_store=state_store)
+
+        knob = knob_future.result()
+        preset_speed_button = preset_future.result()
+        if control_process is None:
+            motor1, motors, encoder, IR_array = hardware_future.result()
+
+    # Create the ultrasonic sensor that measures distances in the background (only with --ultrasonic-rate)
+    if args.ultrasonic_rate > 0:
+        from Ultrasonic_Class import Ultrasonic
+        ultrasonic = Ultrasonic(trigger_pin=24, echo_pin=25, rate=args.ultrasonic_rate)
+    else:
+        ultrasonic = None
+
+    # Create the outer loop of the tracking mode that sets the desired speed during the trials from the position of
+    # the animal (only with --tracking)
+    if args.tracking is not None:
+        from Tracking_Class import PositionTracker, UltrasonicPosition, PositionServer
+        if args.tracking == 'ultrasonic':
+            position_source = UltrasonicPosition(ultrasonic=ultrasonic, center_distance=args.tracking_center)
+        else:
+            position_source = PositionServer(io_loop=io_loop)
+        tracker = PositionTracker(state_store=state_store, source=position_source, rate=args.tracking_rate)
+    else:
+        tracker = None
+
+    # Create the control server that allows scripts to command the treadmill over a Unix domain socket
+    control_server = ControlServer(io_loop=io_loop, user_input=user_input, exp_button=exp_button,
+                                    state_store=state_store, profiler=profiler, recorder=recorder,
+                                    ultrasonic=ultrasonic)
+
+    # Create the watchdog that stops the motor if the control loop stalls, the detector that cuts the motor if it
+    # stalls, and a PID control object that uses both (a controller and a detector for each channel with --channels)
+    if control_process is None:
+        from Watchdog_Class import Watchdog
+        watchdog = Watchdog(motors=motors, deadline=args.watchdog_deadline, enabled=(args.watchdog_deadline > 0))
+        if channels is None:
+            from Stall_Detector_Class import StallDetector
+            from PID_Controller_Class import MotorPID
+            stall_detector = StallDetector(motors=motors, encoder=encoder, stall_time=args.stall_time,
+                                            enabled=(args.stall_time > 0))
+            motor_control = MotorPID(motor=motor1, encoder=encoder, data_logger=data_logger, state_store=state_store,
+                                        gains=gains, watchdog=watchdog, stall_detector=stall_detector)
+        else:
+            from Motor_Channels_Class import createChannelControl
+            motor_control, stall_detector = createChannelControl(channels=channels, motor_list=motor1, motors=motors,
+                                                                    encoders=encoder, data_loggers=channel_loggers,
+                                                                    state_store=state_store, gains=gains,
+                                                                    watchdog=watchdog, stall_time=args.stall_time)
+    startup_phases.append(('devices', time.perf_counter()))
+
+    # number of runs, state of the service and the time from pressing the start button to a running control loop
+    runs = Metrics_Class.registry.counter('treadmill_runs_total', 'Number of times the treadmill has been started')
+    service_state = Metrics_Class.registry.gauge('treadmill_service_state', 'State of the treadmill (0 idle, 1 running, 2 faulted)')
+    start_latency = Metrics_Class.registry.histogram('treadmill_start_latency_seconds', 'Time from pressing the start button to the first iteration of the control loop')
+
+    # run the treadmill until the service is stopped (the objects above are only created once, and the treadmill
+    # moves between idle, running and faulted in place every time the start/stop button is pressed)
     try:
-        # print start message and current step size of the knob
+        # print start message and current step size of the knob (the live lines of the main loop are only
+        # printed once these messages have been shown)
         msg = "Program\nstarting!"
         lcd.sendtoLCDThread(target="main", msg=msg, duration=2.5, clr_before=True, clr_after=True)
-        msg = "Curr step size:\n0.1 m/s"
+        msg = "Curr step size:\n%g m/s" % knob.step_size
         lcd.sendtoLCDThread(target="main", msg=msg, duration=2.5, clr_before=True, clr_after=True)
-        time.sleep(5)        # synchonize the print statement with the main script
+
+        # wait until the treadmill is ready (the servers are listening and the control process has set up its hardware)
+        concurrent.futures.wait([control_server.server_task, telemetry.server_task, metrics_server.server_task],
+                                    timeout=READY_TIMEOUT)
+        if control_process is not None:
+            for record in control_process.receiveUntilIdle(timeout=READY_TIMEOUT):
+                pass
+        startup_phases.append(('ready', time.perf_counter()))
+
+        # print the time of each phase of the startup
+        phase_start = STARTUP_TIME
+        for i in range(len(startup_phases)):
+            name, phase_stop = startup_phases[i]
+            startup_phases[i] = "%s %.0f ms" % (name, (phase_stop - phase_start)*1000)
+            phase_start = phase_stop
+        print("Startup: %s (ready %.0f ms after the script started)" % (", ".join(startup_phases), (phase_start - STARTUP_TIME)*1000))
+
+        # enter the real-time mode (only with --realtime, every thread has been started by now)
+        realtime.lockMemory()
+        realtime.freezeStartup()
+        if control_process is None:
+            realtime.setupControlThread()
 
         # time delay after which print statements should occur (sec)
         print_delay = 1
 
-        # create a start timer for the print statements
-        print_time_start = time.perf_counter()
-
-        while True:
-            # test for driver faults
-            Exceptions.raiseIfFault(motors=motors)
-
-            # test to see if the user stopped the program with the button
-            Exceptions.raiseIfProgramStopped(start_stop_button=start_button)
-
-            # test the break beam sensor so that it isn't broken
-            Exceptions.raiseIfBeamBroken(IR_sen=IR_sen)
-            
-            # test the second break beam sensor to see if it's broken
-            Exceptions.raiseIfBeamBroken(IR_sen=IR_sen_2)
-
-            # attempt to get a user input if available on the queue (starts at zero speed and tries to maintain velocity)
-            user_input.readUserInput()
-            with user_input.speed_des_lock:            # access the speed_des_RPM with lock so that the rotary encoder does not access it via interrupts
-                speed_des = user_input.speed_des_RPM
-                user_changed_velocity = user_input.user_changed_velocity        # check if the user inputted a command via terminal
-
-            # set the motor speed determined from user input and current motor speeds (ramping included)
-            if (user_changed_velocity):
-                # convert desired speed to m/s to inform the user what speed they are ramping to
-                des_spd_mps = motor_control.RPMToMPS(speed_des)
-
-                # print message that the speed is ramping
-                print("Ramping speed to: %.2f m/s" % des_spd_mps)
-                msg = "Ramping speed\nto: %.2f m/s" % des_spd_mps
-                lcd.sendtoLCDThread(target="main", msg=msg, duration=5, clr_before=True, clr_after=True)
-
-                # change the motor velocity
-                control_sig, curr_speed, user_changed_velocity = motor_control.changeMotorVelocity(ramp_time=5, speed_des=speed_des)
-                user_input.user_changed_velocity = user_changed_velocity    # reset flag
-
-                # convert desired and current speeds back to m/s and print to the LCD
-                curr_spd_mps = motor_control.RPMToMPS(curr_speed)
-                line_1 = "Des: %.2f m/s" % des_spd_mps
-                line_2 = "\nAct: %.2f m/s" % curr_spd_mps
-                
-            else:
-                control_sig, curr_speed = motor_control.maintainMotorVelocity(speed_des=speed_des)
-
-                # convert desired and current speeds back to m/s and print to the LCD
-                des_spd_mps = motor_control.RPMToMPS(speed_des)
-                curr_spd_mps = motor_control.RPMToMPS(curr_speed)
-                line_1 = "Des: %.2f m/s\n" % des_spd_mps
-                line_2 = "\nAct: %.2f m/s" % curr_spd_mps
-
-            # print desired motor speed livetime to the LCD module
-            lcd.sendtoLCDThread(target="main", msg=line_1, duration=0, clr_before=False, clr_after=False)
-
-            # check the print time
-            print_time_stop = time.perf_counter()
-
-            # print useful information about motor speeds to terminal
-            if ((print_time_stop - print_time_start) >= print_delay):
-                # print(control_sig, "|", speed_des, "|", curr_speed)
-                lcd.sendtoLCDThread(target="main", msg=line_2, duration=0, clr_before=False, clr_after=False)    # print the actual speeds on a delay
+        # start time of the main loop (used to time stamp the samples for the control server)
+        loop_start_time = time.perf_counter()
+
+        # the part of each iteration of the main loop after the safety checks (the control process runs its own loop)
+        if control_process is None:
+            main_loop = MainLoopIteration(motor_control=motor_control, lcd=lcd, control_server=control_server,
+                                            telemetry=telemetry, recorder=recorder, loop_time=loop_time,
+                                            profiler=profiler, loop_start_time=loop_start_time)
+
+        # set when the service should exit (after a keyboard interrupt, or if the control process has exited, and
+        # straight away with --startup-benchmark)
+        shutdown = args.startup_benchmark
+        if control_process is not None and not control_process.alive():
+            print("Control process has exited")
+            shutdown = True
+
+        while not shutdown:
+            # ------------------ idle (or faulted) until the start button is pressed ------------------ #
+            print("Waiting for the start button")
+            while state_store.snapshot.program_started == False:
+                time.sleep(START_POLL_DELAY)
+
+            # start every run from a stopped treadmill without a trial (the preset speed is kept between runs)
+            state_store.modify(lambda state: {'speed_des_mps': 0, 'speed_des_RPM': 0, 'user_changed_velocity': False,
+                                                'trial_started': False, 'trial_ramp_down': False, 'beam_tripped': None,
+                                                'run': state.run + 1})
+            start_time = start_button.press_time or time.perf_counter()
+            print("Program started")
+            lcd.sendtoLCDThread(target="main", msg="Program\nstarted!", duration=1, clr_before=True, clr_after=True)
+            runs.inc()
+            service_state.set(SERVICE_RUNNING)
+
+            # watch the control loop and the motor for stalls during the run (the control process has its own watchdog
+            # and stall detector)
+            if control_process is None:
+                IR_array.reset()
+                watchdog.arm()
+                stall_detector.arm()
+
+            try:
+                # create a start timer for the print statements
                 print_time_start = time.perf_counter()
 
+                # line of the desired speed for the LCD and the speed it shows (only formatted again when the speed changes)
+                line_1 = None
+                line_1_speed = None
+
+                # run the main loop for the control process (--isolated), which only passes the setpoints to the
+                # control process and handles the records it sends back
+                des_spd_mps = 0
+                curr_spd_mps = 0
+                while control_process is not None:
+                    # attempt to get a user input and send the shared state to the control process if it has changed
+                    user_input.readUserInput()
+                    state = state_store.snapshot
+                    recorder.recordState(state=state)
+                    realtime.trialChanged(in_trial=(state.trial_started or state.trial_ramp_down))
+                    control_process.publishState(state=state)
+
+                    # handle the records (checked for a running process first, so that its last records are handled)
+                    control_alive = control_process.alive()
+                    for record in control_process.receive():
+                        kind = record[0]
+                        if kind == KIND_SAMPLE:
+                            elapsed_time = record[1] - loop_start_time
+                            des_spd_mps = record[2]
+                            curr_spd_mps = record[3]
+                            control_server.publish_sample(elapsed_time, des_spd_mps, curr_spd_mps, record[4])
+                            telemetry.publish(elapsed_time, des_spd_mps, curr_spd_mps, record[4], record[5])
+                            loop_time.observe(record[5])
+                            recorder.recordSample(record[1], des_spd_mps, curr_spd_mps, record[4], record[6], record[5])
+
+                            # the treadmill is ready once the control process sends the first sample of the run
+                            if start_time is not None:
+                                start_latency.observe(time.perf_counter() - start_time)
+                                start_time = None
+                        elif kind == KIND_ROW:
+                            channel_loggers[int(record[4])].save_data(record[1] - data_logger.start_time, record[2], record[3])
+                        elif kind == KIND_RAMP_STARTED:
+                            announceRamp(io_loop=io_loop, lcd=lcd, des_spd_mps=record[2])
+                        elif kind == KIND_RAMP_COMPLETED:
+                            completeRamp(io_loop=io_loop, lcd=lcd, user_input=user_input, speed_des=record[1])
+                        else:
+                            raiseIfStopped(record=record)
+                    if not control_alive:
+                        raise Exceptions.ProgramStopped
+
+                    # print the desired and actual speeds to the LCD module
+                    if des_spd_mps != line_1_speed:
+                        line_1 = "Des: %.2f m/s" % des_spd_mps
+                        line_1_speed = des_spd_mps
+                    lcd.updateLiveLine(row=0, msg=line_1)
+                    if ((time.perf_counter() - print_time_start) >= print_delay):
+                        lcd.updateLiveLine(row=1, msg="Act: %.2f m/s" % curr_spd_mps)
+                        print_time_start = time.perf_counter()
+
+                    time.sleep(ISOLATED_LOOP_DELAY)
+
+                # start timing the iterations of the run (used to time the iterations for the telemetry)
+                main_loop.reset(start_time=print_time_start)
+
+                while True:
+                    # start timing the stages of this iteration
+                    profiler.start()
+                    tracer.begin('loop iteration')
+
+                    # test for driver faults
+                    Exceptions.raiseIfFault(motors=motors)
+                    profiler.mark(STAGE_FAULT)
+
+                    # attempt to get a user input if available on the queue (starts at zero speed and tries to maintain velocity)
+                    user_input.readUserInput()
+
+                    # take the snapshot of the shared state once for this iteration (the setpoint, trial and safety
+                    # flags are all read from the same snapshot without any locks)
+                    state = state_store.snapshot
+                    speed_des = state.speed_des_RPM
+                    recorder.recordState(state=state)
+
+                    # no automatic garbage collection during a trial (including its ramp down) in the real-time mode
+                    realtime.trialChanged(in_trial=(state.trial_started or state.trial_ramp_down))
+                    profiler.mark(STAGE_STATE)
+
+                    # test to see if the user stopped the program with the button
+                    Exceptions.raiseIfProgramStopped(state=state)
+                    profiler.mark(STAGE_STOPPED)
+
+                    # test the break beam sensors so that none of them is broken or has been triggered
+                    Exceptions.raiseIfBeamTripped(IR_array=IR_array)
+                    profiler.mark(STAGE_BEAMS)
+
+                    # set the motor speed determined from user input and current motor speeds (ramping included),
+                    # then show the desired speed on the LCD and publish the sample
+                    if (state.user_changed_velocity):
+                        # convert desired speed to m/s to inform the user what speed they are ramping to
+                        des_spd_mps = motor_control.RPMToMPS(speed_des)
+                        announceRamp(io_loop=io_loop, lcd=lcd, des_spd_mps=des_spd_mps)
+
+                        # change the motor velocity
+                        motor_control.changeMotorVelocity(ramp_time=5, speed_des=speed_des)
+                        completeRamp(io_loop=io_loop, lcd=lcd, user_input=user_input, speed_des=speed_des)
+                        profiler.mark(STAGE_MOTOR)
+                        main_loop.publish(speed_des=speed_des)
+
+                    else:
+                        main_loop.maintain(speed_des=speed_des, log_data=state.trial_started)
+                    tracer.end('loop iteration')
+
+                    # the treadmill is ready once the first iteration of the run has been completed
+                    if start_time is not None:
+                        start_latency.observe(main_loop.iter_start_time - start_time)
+                        start_time = None
+
+                    # check the print time
+                    print_time_stop = time.perf_counter()
+
+                    # print useful information about motor speeds to terminal
+                    if ((print_time_stop - print_time_start) >= print_delay):
+                        # print(control_sig, "|", speed_des, "|", curr_speed)
+                        lcd.updateLiveLine(row=1, msg="Act: %.2f m/s" % main_loop.curr_spd_mps)    # print the actual speeds on a delay
+                        print_time_start = time.perf_counter()
+
+            except KeyboardInterrupt:
+                # print stop messages
+                print("\nKeyboard Interrupt")
+                msg = "Program stopped!"
+                lcd.sendtoLCDThread(target="main", msg=msg, duration=0, clr_before=True, clr_after=False)
+
+                # reset the program_start variable and exit the service
+                state_store.update(program_started=False)
+                shutdown = True
+
+                # slow the motor down so that it does not stop abruptly
+                # (the control process does this itself with --isolated)
+                if control_process is None:
+                    rampDown(motor_control=motor_control, lcd=lcd, recorder=recorder, service_state=service_state)
+
+                # add delay to allow the message to print the LCD screen
+                time.sleep(0.2)
+
+            except Exceptions.ProgramStopped as p:
+                # print stop messages
+                msg = "Program stopped!"
+                print("\n" + msg)
+                lcd.sendtoLCDThread(target="main", msg=msg, duration=0, clr_before=True, clr_after=False)
+                recorder.dump(reason='program_stopped')
+
+                # reset the program_start variable
+                state_store.update(program_started=False)
+                service_state.set(SERVICE_IDLE)
+
+                # slow the motor down to a halt
+                # (the control process does this itself with --isolated)
+                if control_process is None:
+                    rampDown(motor_control=motor_control, lcd=lcd, recorder=recorder, service_state=service_state)
+
+            except Exceptions.DriverFault as e:
+                # print messages
+                print("\nDriver %s fault!" % e.driver_num)
+                msg = ("Driver %s fault!" % e.driver_num)
+                lcd.sendtoLCDThread(target="main", msg=msg, duration=0, clr_before=True, clr_after=False)
+                recorder.dump(reason='driver_fault')
+
+                # reset the program_started variable (the fault is checked again when the treadmill is started)
+                state_store.update(program_started=False)
+                service_state.set(SERVICE_FAULTED)
+
+            except Exceptions.BeamFault as b:
+                # print messages
+                print(f"\nIR sensor on pin {b.pin_num} is broken or has been triggered!")
+                msg = ("IR %s triggered!" % b.pin_num)
+                lcd.sendtoLCDThread(target="main", msg=msg, duration=0, clr_before=True, clr_after=False)
+                print("Motor shutting down!")
+                recorder.dump(reason='beam_fault')
+
+                # reset the program_started variable (the sensors are checked again when the treadmill is started)
+                state_store.update(program_started=False)
+                service_state.set(SERVICE_FAULTED)
+
+                # slow the motor down to a halt
+                # (the control process does this itself with --isolated)
+                if control_process is None:
+                    rampDown(motor_control=motor_control, lcd=lcd, recorder=recorder, service_state=service_state)
+
+            except Exceptions.WatchdogFault as w:
+                # print messages (the motor has already been stopped by the watchdog, which printed the stack of the loop)
+                print("\nControl loop stalled for %.0f ms, motor stopped!" % (w.stall_time*1000))
+                msg = "Loop stalled!"
+                lcd.sendtoLCDThread(target="main", msg=msg, duration=0, clr_before=True, clr_after=False)
+                recorder.dump(reason='watchdog')
+
+                # reset the program_started variable (the treadmill is started again with the start button)
+                state_store.update(program_started=False)
+                service_state.set(SERVICE_FAULTED)
+
+            except Exceptions.StallFault as s:
+                # print messages (the motor has already been cut by the stall detector)
+                print("\nMotor stalled with a control signal of %.0f, motor stopped!" % s.control_sig)
+                msg = "Motor stalled!"
+                lcd.sendtoLCDThread(target="main", msg=msg, duration=0, clr_before=True, clr_after=False)
+                recorder.dump(reason='stall')
+
+                # reset the program_started variable (the treadmill is started again with the start button)
+                # NOTE: no ramp down, the motor must not be driven into the jammed belt again
+                state_store.update(program_started=False)
+                service_state.set(SERVICE_FAULTED)
+
+            finally:
+                # end a trial that was still running when the treadmill stopped (resets the camera pin)
+                if state_store.snapshot.trial_started:
+                    exp_button.request_trial(started=False)
+
+                if control_process is None:
+                    motors.forceStop()
+                    watchdog.disarm()
+                    stall_detector.disarm()
+                else:
+                    # wait for the control process to halt the motor (the rows of its ramp down are still logged)
+                    control_process.publishState(state=state_store.update(program_started=False))
+                    for record in control_process.receiveUntilIdle():
+                        if record[0] == KIND_ROW:
+                            channel_loggers[int(record[4])].save_data(record[1] - data_logger.start_time, record[2], record[3])
+                        elif record[0] == KIND_STOPPED and record[1] in (STOP_WATCHDOG, STOP_STALL):
+                            # a fault has stopped the motor during the ramp down of the control process (the
+                            # STOPPED of the run itself is only here if this process has stopped first)
+                            try:
+                                raiseIfStopped(record=record)
+                            except RAMP_FAULTS as fault:
+                                reportRampFault(fault=fault, lcd=lcd, recorder=recorder, service_state=service_state)
+
+                    # the service exits if the control process has exited (and is restarted by the service)
+                    if not control_process.alive():
+                        print("Control process has exited")
+                        shutdown = True
+
     except KeyboardInterrupt:
-        # print stop messages
+        # the service has been stopped while the treadmill was idle
         print("\nKeyboard Interrupt")
-        msg = "Program stopped!"
-        lcd.sendtoLCDThread(target="main", msg=msg, duration=0, clr_before=True, clr_after=False)
-
-        # reset the program_start variable
-        with start_button.start_stop_lock:
-            start_button.program_started = False
 
-        # slow the motor down so that it does not stop abruptly
-        speed_des = 0
-        motor_control.changeMotorVelocity(ramp_time=2, speed_des=speed_des)
-
-        # add delay to allow the message to print the LCD screen
-        time.sleep(0.2)
-
-    except Exceptions.ProgramStopped as p:
-        # print stop messages
-        msg = "Program stopped!"
-        print("\n" + msg)
-        lcd.sendtoLCDThread(target="main", msg=msg, duration=0, clr_before=True, clr_after=False)
-
-        # reset the program_start variable
-        with start_button.start_stop_lock:
-            start_button.program_started = False
-
-        # slow the motor down to a halt
-        speed_des = 0
-        motor_control.changeMotorVelocity(ramp_time=2, speed_des=speed_des)
-
-        # add delay to allow exception to print to LCD
-        time.sleep(0.2)
-
-    except Exceptions.DriverFault as e:
-        # print messages
-        print("\nDriver %s fault!" % e.driver_num)
-        msg = ("Driver %s fault!" % e.driver_num)
-        lcd.sendtoLCDThread(target="main", msg=msg, duration=0, clr_before=True, clr_after=False)
+    finally:
+        # print where the loop time went
+        if profiler.enabled:
+            print(profiler.summary())
 
-        # reset the program_started variable
-        with start_button.start_stop_lock:
-            start_button.program_started = False
+        # print how the shared-state locks have been used
+        if lock_stats.enabled:
+            print(lock_stats.summary())
 
-        # add delay to allow fault to print to LCD
-        time.sleep(0.2)
+        # save the trace of the threads
+        if tracer.enabled:
+            print("Trace of %d events saved to %s" % (tracer.dump(args.trace), args.trace))
 
-    except Exceptions.BeamFault as b:
-        # print messages
-        print(f"\nIR sensor on pin {b.pin_num} is broken or has been triggered!")
-        msg = ("IR %s triggered!" % b.pin_num)
-        lcd.sendtoLCDThread(target="main", msg=msg, duration=0, clr_before=True, clr_after=False)
-        print("Motor shutting down!")
+        # write any settings that have changed since the last write of the state file
+        persistent_state.flush()
 
-        # reset the program_started variable
-        with start_button.start_stop_lock:
-            start_button.program_started = False
+        # stop the control process (it halts the motor before it exits)
+        if control_process is not None:
+            control_process.stop()
 
-        # slow the motor down to a halt
-        speed_des = 0
-        motor_control.changeMotorVelocity(ramp_time=2, speed_des=speed_des)
+        # write the rows still in the logs to their files
+        for logger in channel_loggers:
+            if not logger.close():
+                print("Log rows could not be written before exiting")
 
-        # add delay to allow message to print to LCD screen
-        time.sleep(0.2)
+        if tracker is not None:
+            tracker.stop()
+        if ultrasonic is not None:
+            ultrasonic.stop()
 
-    finally:
+        import RPi.GPIO as GPIO
         GPIO.cleanup()
         print("GPIO pins cleaned up")
-        motors.forceStop()
+        if control_process is None:
+            motors.forceStop()
         print("Motors stopped")
         print("Program exited")
 
 
 # Execute the main function
 if __name__ == '__main__':
-    # Execute an infinite loop that runs as a background service
-
-    while True:
-        # get the state for the start_stop button (to see if we should start the main program)
-        with start_button.start_stop_lock:
-            program_started = start_button.program_started
-    
-        if program_started == True:
-            # only execute the main program if the start button has been pressed
-            main()  
-
-            # break out of the while loop (the service will restart the entire script)
-            break     
+    # obtain the command line arguments
+    parser = argparse.ArgumentParser(description='Run the PID controller for the treadmill')
+    parser.add_argument('--profile', action='store_true', help='time the stages of the main loop and print a summary on exit')
+    parser.add_argument('--trace', metavar='PATH', help='record the activity of the threads and save it as a Chrome trace to PATH on exit')
+
+    parser.add_argument('--lock-stats', action='store_true', help='measure the use of the shared-state locks and print a summary on exit')
+    parser.add_argument('--realtime', action='store_true', help='freeze/disable the garbage collection, lock the memory and run the main loop with SCHED_FIFO')
+    parser.add_argument('--isolated', action='store_true', help='run the encoder, PID controller and safety checks in their own process pinned to their own CPU')
+    parser.add_argument('--watchdog-deadline', type=float, default=0.5, metavar='SECONDS', help='stop the motor if the control loop has not updated it for SECONDS (0 disables the watchdog)')
+    parser.add_argument('--stall-time', type=float, default=0.25, metavar='SECONDS', help='cut the motor if it has not moved for SECONDS with a high control signal (0 disables the stall detection)')
+    parser.add_argument('--encoder-sample-rate', type=int, default=0, metavar='HZ', help='sample the encoder pins HZ times a second from a thread (through /dev/gpiomem) instead of a callback per edge (i.e. 20000)')
+    parser.add_argument('--fast-lcd', action='store_true', help='write to the LCD through the GPIO registers (through /dev/gpiomem), only changing the characters that differ')
+    parser.add_argument('--ultrasonic-rate', type=float, default=0, metavar='HZ', help='read the HC-SR04 ultrasonic sensor (trigger pin 24, echo pin 25) HZ times a second in the background and report the distance in STATUS (0 disables the sensor)')
+    parser.add_argument('--tracking', choices=('ultrasonic', 'socket'), help='set the desired speed during the trials to keep the animal at the centre of the belt, from the ultrasonic sensor or from positions sent to /tmp/treadmill_position.sock')
+    parser.add_argument('--tracking-rate', type=float, default=50, metavar='HZ', help='rate of the outer loop of the tracking mode')
+    parser.add_argument('--tracking-center', type=float, default=30, metavar='CM', help='distance from the ultrasonic sensor to the centre of the belt for --tracking ultrasonic')
+    parser.add_argument('--channels', metavar='PATH', help='run a motor channel (motor driver, encoder and PID controller) for each channel of the .json file at PATH from one control loop (see Motor_Channels_Class.py)')
+    parser.add_argument('--startup-benchmark', action='store_true', help='print the time of each phase of the startup and exit once the treadmill is ready')
+    args = parser.parse_args()
+    if args.tracking == 'ultrasonic' and args.ultrasonic_rate <= 0:
+        parser.error('--tracking ultrasonic requires --ultrasonic-rate')
+
+    # enable the tracer and the lock statistics before any of the threads and locks are created
+    tracer.enabled = args.trace is not None
+    lock_stats.enabled = args.lock_stats
+
+    # set up the real-time mode before any of the threads are created (it changes their stack size)
+    realtime = RealtimeMode(enabled=args.realtime)
+
+    # Create the store of the shared state (setpoint, trial and safety flags) read by the main loop
+    state_store = StateStore()
+
+    # Create the worker that handles all button and knob events outside of the RPi.GPIO callback thread
+    callback_worker = CallbackWorker()
+
+    # Create a StartStopButton object which will be used to start/stop the main function via a service
+    import Buttons_Class
+    start_button = Buttons_Class.StartStopButton(button_pin=17, callback_worker=callback_worker, state_store=state_store)
+
+    # Execute the treadmill as a background service (main() waits for the start button itself, and only
+    # returns when the service is stopped)
+    main(args)
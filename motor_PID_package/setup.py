@@ -16,5 +16,12 @@ setup(name='motor_PID_package',
       install_requires=['adafruit-blinka', 'adafruit-circuitpython-charlcd', 'single_tb9051ftg_rpi'],
       py_modules=['Encoder_Class', 'Exceptions', 'IR_Break_Beam_Class', 'PID_Controller_Class',
                    'User_Input_Class', 'Knob_Class', 'LCD_Class', 'Buttons_Class',
-                   'Data_Collection_Class'],
+                   'Data_Collection_Class', 'Callback_Worker_Class', 'IO_Loop_Class',
+                   'Control_Server_Class', 'Telemetry_Class', 'Metrics_Class',
+                   'Loop_Profiler_Class', 'Tracer_Class', 'Instrumented_Lock_Class',
+                   'State_Store_Class', 'Realtime_Class', 'Shared_Ring_Class',
+                   'Control_Process_Class', 'Persistent_State_Class', 'Watchdog_Class',
+                   'Flight_Recorder_Class', 'Stall_Detector_Class',
+                   'HD44780_Class', 'Ultrasonic_Class', 'Tracking_Class',
+                   'Motor_Channels_Class', 'Main_Loop_Class'],
       )
@@ -0,0 +1,85 @@
+'''
+ * @file    telemetry_viewer.py
+ * @author  William Wang
+ * @brief   This script is a small viewer for the telemetry
+            stream published by main.py. It draws a scrolling
+            text waveform of the belt speed in the terminal.
+            Usage: python telemetry_viewer.py [rate in Hz]
+'''
+
+# import required modules
+import socket
+import sys
+
+# path of the telemetry socket (see the TelemetryPublisher in Telemetry_Class.py)
+SOCKET_PATH = '/tmp/treadmill_telemetry.sock'
+
+# width of the waveform and the range of speeds it covers (m/s)
+PLOT_WIDTH = 61
+SPEED_RANGE = 1.5
+
+def speedToColumn(speed):
+    '''
+    DESCRIPTION: Function that converts a speed into a column of the waveform
+
+    ARGS: speed (speed in m/s)
+
+    RETURN: column (column of the waveform, limited to the plot width)
+    '''
+
+    column = round((speed + SPEED_RANGE)/(2*SPEED_RANGE)*(PLOT_WIDTH - 1))
+    return min(max(column, 0), PLOT_WIDTH - 1)
+
+def drawFrame(values):
+    '''
+    DESCRIPTION: Function that draws a single frame as one line of the waveform. The measured speed
+    envelope is drawn with '=' and the setpoint with '|'
+
+    ARGS: values (the values of the FRAME line as floats)
+
+    RETURN: line (line to be printed)
+    '''
+
+    elapsed_time, samples, sp_min, sp_max, meas_min, meas_max, u_min, u_max, dt_min, dt_max = values
+
+    # draw the envelope of the measured speed and the setpoint on top of it
+    row = [' ']*PLOT_WIDTH
+    row[speedToColumn(0)] = '.'
+    for c in range(speedToColumn(meas_min), speedToColumn(meas_max) + 1):
+        row[c] = '='
+    row[speedToColumn(sp_max)] = '|'
+
+    return "%8.2f [%s] %6.3f %6.1f %5.1fms" % (elapsed_time, ''.join(row), meas_max, u_max, dt_max*1000)
+
+def main():
+    '''
+    DESCRIPTION: main function that connects to the telemetry socket and prints the frames
+
+    ARGS: NONE
+
+    RETURN: NONE
+    '''
+
+    # obtain the frame rate from the command line
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    # connect to the publisher and request the frame rate
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(SOCKET_PATH)
+    sock.sendall(b"RATE %f\n" % rate)
+
+    print("%8s [%s] %6s %6s %7s" % ("time", "-1.5 m/s".ljust(PLOT_WIDTH - 7) + "1.5m/s", "act", "u", "loop"))
+
+    try:
+        for line in sock.makefile('r'):
+            words = line.split()
+            if words and words[0] == 'FRAME':
+                print(drawFrame([float(w) for w in words[1:]]))
+    except KeyboardInterrupt:
+        print("\nKeyboard Interrupt")
+    finally:
+        sock.close()
+
+# Execute the main function
+if __name__ == '__main__':
+    main()